@@ -0,0 +1,100 @@
+'''
+One stream of input value samples shared by several consumers.
+
+Instead of every consumer (display, file log, ...) polling the
+instrument on its own timer, the instrument is read once per base
+interval, the shortest interval any subscriber asked for, and every
+Sample is fanned out to the subscribers that are due.  Each subscriber
+decimates the stream to its own interval by the sample's monotonic
+timestamp, so subscribers with equal intervals share every reading and
+slower ones get every n-th.
+
+    acquisition = Acquisition()
+    acquisition.subscribe('display', 1.0, show_sample)
+    acquisition.subscribe('file', 5.0, write_sample)
+    timer.setInterval(acquisition.interval() * 1000)
+    ...
+    acquisition.publish(sample)
+
+A failed reading is published as None to the subscribers that are due.
+'''
+
+from clock import monotonic
+
+
+class _Subscriber(object):
+    __slots__ = ('name', 'interval', 'callback', 'next_due',)
+
+    def __init__(self, name, interval, callback):
+        self.name = name
+        self.interval = interval
+        self.callback = callback
+        self.next_due = None
+
+
+class Acquisition(object):
+    def __init__(self):
+        # in order of subscription
+        self._subscribers = []
+
+    def subscribe(self, name, interval, callback):
+        """ deliver a sample to callback(sample) every interval seconds
+
+            Subscribing an existing name replaces it.
+        """
+        self.unsubscribe(name)
+        self._subscribers.append(_Subscriber(name, interval, callback))
+
+    def unsubscribe(self, name):
+        self._subscribers = [subscriber for subscriber in self._subscribers
+            if subscriber.name != name]
+
+    def set_interval(self, name, interval):
+        for subscriber in self._subscribers:
+            if subscriber.name == name:
+                subscriber.interval = interval
+                subscriber.next_due = None
+
+    def subscribers(self):
+        return [subscriber.name for subscriber in self._subscribers]
+
+    def interval(self):
+        """ @return base interval of the stream in seconds, None without subscribers
+
+        """
+        if not self._subscribers:
+            return None
+        return min(subscriber.interval for subscriber in self._subscribers)
+
+    def reset(self):
+        """ restart the decimation, the next sample goes to everybody
+
+        """
+        for subscriber in self._subscribers:
+            subscriber.next_due = None
+
+    def publish(self, sample):
+        """ hand sample to the subscribers that are due
+
+            @return number of subscribers the sample was delivered to
+        """
+        base_interval = self.interval()
+        if base_interval is None:
+            return 0
+
+        now = sample.timestamp if sample is not None else monotonic()
+        # a reading up to half a base interval early still counts
+        slack = base_interval / 2.0
+        delivered = 0
+        for subscriber in list(self._subscribers):
+            if subscriber.next_due is not None and now < subscriber.next_due - slack:
+                continue
+            if subscriber.next_due is None:
+                subscriber.next_due = now
+            subscriber.next_due += subscriber.interval
+            if subscriber.next_due <= now:
+                # fell behind, e.g. after timeouts: keep the phase of now
+                subscriber.next_due = now + subscriber.interval
+            subscriber.callback(sample)
+            delivered += 1
+        return delivered
@@ -0,0 +1,160 @@
+'''
+Windowed aggregation of the sample stream.
+
+WindowAggregator sits between the acquisition and a sink: it takes every
+Sample and keeps, per window of wall time (window seconds, aligned to
+multiples of window), the count, min, max, mean and standard deviation
+of voltage, power and current, updated in O(1) per sample with Welford's
+method.  When a sample opens the next window the finished one is handed
+to a callback as an Aggregate; flush() hands over the window in
+progress.  AggregateCsvSink writes aggregates as CSV rows with the
+columns of AGGREGATE_LOG_STRUCT, so a soak test sampled at 20 Hz can
+keep one row per minute instead of 1200.
+
+    writer = BackgroundSink(AggregateCsvSink('dc_load_log.agg.csv'))
+    aggregator = WindowAggregator(60, writer.write)
+    acquisition.subscribe('aggregate', 0.05, lambda sample: aggregator.add(sample, mode))
+    ...
+    aggregator.flush()
+'''
+
+import math
+import time
+
+from sinks import CsvSink, format_timestamp
+
+QUANTITIES = ('voltage', 'power', 'current',)
+STATISTICS = ('min', 'max', 'mean', 'stddev',)
+AGGREGATE_LOG_STRUCT = ('timestamp', 'window', 'count', 'missing',) + tuple(
+    '%s_%s' % (quantity, statistic) for quantity in QUANTITIES for statistic in STATISTICS) + (
+    'mode', 'total_seconds',)
+
+
+class RunningStats(object):
+    """ count, min, max, mean and variance of a series, Welford's method
+
+    """
+
+    __slots__ = ('count', 'min', 'max', 'mean', '_m2',)
+
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def variance(self):
+        """ @return sample variance, 0 for less than two values
+
+        """
+        if self.count < 2:
+            return 0.0
+        return self._m2 / (self.count - 1)
+
+    def stddev(self):
+        return math.sqrt(self.variance())
+
+
+class Aggregate(object):
+    """ statistics of the samples of one window
+
+        wall_time: start of the window, time.time() scale
+        window: length of the window in seconds
+        count: samples in the window
+        missing: failed readings in the window
+        voltage, power, current: RunningStats
+    """
+
+    __slots__ = ('wall_time', 'window', 'count', 'missing', 'voltage', 'power', 'current',)
+
+    def __init__(self, wall_time, window):
+        self.wall_time = wall_time
+        self.window = window
+        self.count = 0
+        self.missing = 0
+        self.voltage = RunningStats()
+        self.power = RunningStats()
+        self.current = RunningStats()
+
+    def add(self, sample):
+        self.count += 1
+        self.voltage.add(sample.voltage)
+        self.power.add(sample.power)
+        self.current.add(sample.current)
+
+    def __repr__(self):
+        return 'Aggregate(wall_time=%r, count=%r, voltage=%r..%r, current=%r..%r)' % (
+            self.wall_time, self.count, self.voltage.min, self.voltage.max,
+            self.current.min, self.current.max)
+
+
+class WindowAggregator(object):
+    def __init__(self, window, callback):
+        """ @param window: seconds per aggregate
+            @param callback: callback(aggregate, mode) for every finished window
+
+        """
+        if window <= 0:
+            raise ValueError('Aggregation window must be positive: %s' % (window,))
+        self.window = window
+        self.callback = callback
+        self._current = None
+        self._mode = None
+
+    def _window_start(self, wall_time):
+        return math.floor(wall_time / self.window) * self.window
+
+    def add(self, sample, mode=None):
+        """ add sample, None for a failed reading
+
+        """
+        wall_time = sample.wall_time if sample is not None else time.time()
+        start = self._window_start(wall_time)
+        if self._current is not None and start != self._current.wall_time:
+            self.flush()
+        if self._current is None:
+            self._current = Aggregate(start, self.window)
+        if sample is None:
+            self._current.missing += 1
+            return
+        self._current.add(sample)
+        self._mode = mode
+
+    def flush(self):
+        """ hand the window in progress to the callback
+
+        """
+        aggregate, self._current = self._current, None
+        if aggregate is not None and (aggregate.count or aggregate.missing):
+            self.callback(aggregate, self._mode)
+
+
+class AggregateCsvSink(CsvSink):
+    """ CsvSink writing Aggregates with the columns of AGGREGATE_LOG_STRUCT
+
+    """
+
+    header = AGGREGATE_LOG_STRUCT
+
+    def row(self, aggregate, mode):
+        row = [format_timestamp(aggregate.wall_time), aggregate.window, aggregate.count,
+            aggregate.missing]
+        for quantity in QUANTITIES:
+            stats = getattr(aggregate, quantity)
+            if stats.count:
+                row.extend((stats.min, stats.max, stats.mean, stats.stddev(),))
+            else:
+                row.extend(('', '', '', '',))
+        row.extend((mode, int(aggregate.wall_time - self.started),))
+        return row
@@ -0,0 +1,234 @@
+'''
+Non-blocking transport for the B&K DC loads.
+
+AsyncDCLoad exposes the same public methods as DCLoad, but every call
+writes its command and returns a ResponseFuture right away.  A reader
+thread per instrument collects the 26 byte responses and completes the
+pending requests in order, so the requests of several instruments (or
+several requests to one instrument) overlap on the wire instead of
+blocking in sp.read one at a time.
+
+The application runs on Python 2, where asyncio is not available; the
+futures here follow the concurrent.futures interface (result, exception,
+done, add_done_callback) so callers read the same either way.
+
+    loads = [AsyncDCLoad(), AsyncDCLoad()]
+    loads[0].Initialize(3, 38400)
+    loads[1].Initialize(4, 38400)
+    values = gather([load.GetInputValues() for load in loads], timeout=1)
+'''
+
+import time
+import threading
+import collections
+
+import serial
+
+import codec
+from dcload import DCLoad, InstrumentException
+
+# default time a request may wait for its response, seconds
+DEFAULT_REQUEST_TIMEOUT = 2
+# serial read timeout used by the reader thread to check for expired requests
+READ_POLL_INTERVAL = 0.05
+# DCLoad methods available as requests
+ASYNC_METHODS = frozenset(DCLoad._public_methods_ + ['GetSample'])
+
+
+class ResponseFuture(object):
+    """ result of a request which is sent but may not be answered yet
+
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise InstrumentException('Request timed out')
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise InstrumentException('Request timed out')
+        return self._exception
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result):
+        self._complete(result, None)
+
+    def set_exception(self, exception):
+        self._complete(None, exception)
+
+    def _complete(self, result, exception):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+def gather(futures, timeout=None):
+    """ wait for all futures and return their results in order
+
+        @param timeout: overall time limit in seconds, None waits forever
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    results = []
+    for future in futures:
+        remaining = None if deadline is None else max(0, deadline - time.time())
+        results.append(future.result(remaining))
+    return results
+
+
+class AsyncDCLoad(object):
+    def __init__(self, timeout=DEFAULT_REQUEST_TIMEOUT):
+        self.timeout = timeout
+        self._load = DCLoad()
+        self._pending = collections.deque()
+        self._buffer = ''
+        # serializes frame capture/replay on self._load and keeps the
+        # pending queue in the same order as the frames on the wire
+        self._lock = threading.Lock()
+        self._reader = None
+        self._running = False
+
+    def __getattr__(self, name):
+        if name in ASYNC_METHODS:
+            def method(*args):
+                return self.submit(name, *args)
+            method.__name__ = name
+            return method
+        raise AttributeError(name)
+
+    @property
+    def address(self):
+        return self._load.address
+
+    def Initialize(self, com_port, baudrate, address=0):
+        sp = serial.Serial(com_port-1, baudrate, timeout=READ_POLL_INTERVAL)
+        self.attach(sp, address)
+
+    def attach(self, sp, address=0):
+        """ start serving requests over an already open serial port
+
+        """
+        sp.timeout = READ_POLL_INTERVAL
+        self._load.sp = sp
+        self._load.address = address
+        self._load.BuildFrameCache()
+        self._running = True
+        self._reader = threading.Thread(target=self._read_responses,
+            name='AsyncDCLoad reader %s' % (address,))
+        self._reader.daemon = True
+        self._reader.start()
+
+    def close(self):
+        self._running = False
+        if self._reader is not None:
+            self._reader.join()
+            self._reader = None
+        self._fail_pending(InstrumentException('Connection closed'))
+        if self._load.sp is not None:
+            self._load.sp.close()
+
+    def submit(self, name, *args):
+        """ send method name with args to the instrument
+
+            @return ResponseFuture completed with the method's result
+        """
+        future = ResponseFuture()
+        try:
+            with self._lock:
+                frame, result = self._load.CaptureCommand(name, *args)
+                if frame is not None:
+                    deadline = time.time() + self.timeout
+                    self._pending.append((future, ord(frame[2]), name, args, deadline))
+                    self._load.sp.write(frame)
+        except Exception, e:
+            future.set_exception(e)
+            return future
+
+        if frame is None:
+            future.set_result(result)
+        return future
+
+    def _read_responses(self):
+        length_packet = self._load.length_packet
+        while self._running:
+            try:
+                data = self._load.sp.read(max(1, length_packet - len(self._buffer)))
+            except Exception, e:
+                self._fail_pending(e)
+                time.sleep(READ_POLL_INTERVAL)
+                continue
+
+            if data:
+                self._buffer += data
+                while self._complete_oldest():
+                    pass
+            self._expire_pending()
+
+    def _complete_oldest(self):
+        """ complete the oldest pending request if its response is buffered
+
+            @return True if a request was completed
+        """
+        load = self._load
+        with self._lock:
+            if not self._pending:
+                # unsolicited or late response of an expired request
+                load.discarded_bytes += len(self._buffer)
+                self._buffer = ''
+                return False
+
+            future, cmd_byte, name, args, deadline = self._pending[0]
+            response, self._buffer, skipped = codec.sync(self._buffer, load.address, cmd_byte,
+                cmd_byte in load.data_commands)
+            if skipped:
+                load.resync_events += 1
+                load.discarded_bytes += skipped
+            if response is None:
+                return False
+
+            self._pending.popleft()
+            try:
+                result = load.ReplayResponse(response, name, *args)
+                exception = None
+            except Exception, e:
+                result, exception = None, e
+        future._complete(result, exception)
+        return True
+
+    def _expire_pending(self):
+        now = time.time()
+        expired = []
+        with self._lock:
+            while self._pending and self._pending[0][4] < now:
+                expired.append(self._pending.popleft()[0])
+            self._load.timeouts += len(expired)
+        for future in expired:
+            future.set_exception(InstrumentException('Request timed out'))
+
+    def _fail_pending(self, exception):
+        with self._lock:
+            pending, self._pending = self._pending, collections.deque()
+        for entry in pending:
+            entry[0].set_exception(exception)
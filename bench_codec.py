@@ -0,0 +1,104 @@
+'''
+Micro-benchmark of the frame codec.
+
+Compares the per frame cost of the byte at a time encoder/decoder that
+InstrumentInterface used to implement (reproduced below) with the
+struct based codec module.
+
+    python bench_codec.py [number of frames]
+'''
+
+import sys
+import timeit
+
+import codec
+
+LENGTH_PACKET = codec.LENGTH_PACKET
+DEFAULT_FRAMES = 100000
+
+
+# Reference implementation, as in InstrumentInterface before codec.py
+def legacy_checksum(cmd):
+    checksum = 0
+    for i in xrange(LENGTH_PACKET - 1):
+        checksum += ord(cmd[i])
+    checksum %= 256
+    return checksum
+
+
+def legacy_code_integer(value, num_bytes=4):
+    value = int(value)
+    s = chr(value & 0xff)
+    if num_bytes >= 2:
+        s += chr((value & (0xff << 8)) >> 8)
+        if num_bytes == 4:
+            s += chr((value & (0xff << 16)) >> 16)
+            s += chr((value & (0xff << 24)) >> 24)
+    return s
+
+
+def legacy_decode_integer(data):
+    n = ord(data[0])
+    if len(data) >= 2:
+        n += (ord(data[1]) << 8)
+        if len(data) == 4:
+            n += (ord(data[2]) << 16)
+            n += (ord(data[3]) << 24)
+    return n
+
+
+def legacy_encode_integer(address, command, value, num_bytes=4):
+    cmd = chr(0xaa) + chr(address) + chr(command)
+    cmd += legacy_code_integer(value)[:num_bytes]
+    cmd += chr(0)*(LENGTH_PACKET - num_bytes - 3 - 1)
+    cmd += chr(legacy_checksum(cmd))
+    return cmd
+
+
+def legacy_decode_input_values(response):
+    voltage = legacy_decode_integer(response[3:7])
+    current = legacy_decode_integer(response[7:11])
+    power = legacy_decode_integer(response[11:15])
+    op_state = legacy_decode_integer(response[15])
+    demand_state = legacy_decode_integer(response[16:18])
+    return voltage, current, power, op_state, demand_state
+
+
+CASES = (
+    ('encode integer',
+        lambda: legacy_encode_integer(0, 0x2A, 12345),
+        lambda: codec.encode_integer(0, 0x2A, 12345)),
+    ('decode input values',
+        lambda: legacy_decode_input_values(RESPONSE),
+        lambda: codec.decode_input_values(RESPONSE)),
+    ('checksum',
+        lambda: legacy_checksum(RESPONSE),
+        lambda: codec.checksum(RESPONSE)),
+)
+
+RESPONSE = codec.encode_integer(0, 0x5F, 0)
+RESPONSE = RESPONSE[:3] + \
+    codec.encode_little_endian(12034) + \
+    codec.encode_little_endian(15002) + \
+    codec.encode_little_endian(18053) + \
+    RESPONSE[15:]
+
+
+def _per_frame_us(func, frames):
+    best = min(timeit.repeat(func, number=frames, repeat=3))
+    return best / frames * 1e6
+
+
+def main(frames=DEFAULT_FRAMES):
+    assert legacy_encode_integer(0, 0x2A, 12345) == codec.encode_integer(0, 0x2A, 12345)
+    assert legacy_decode_input_values(RESPONSE) == codec.decode_input_values(RESPONSE)
+
+    print '%-22s %12s %12s %8s' % ('frames: %d' % frames, 'before us', 'after us', 'speedup')
+    for name, before, after in CASES:
+        before_us = _per_frame_us(before, frames)
+        after_us = _per_frame_us(after, frames)
+        print '%-22s %12.3f %12.3f %7.1fx' % (name, before_us, after_us, before_us / after_us)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_FRAMES)
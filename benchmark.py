@@ -0,0 +1,327 @@
+'''
+End-to-end throughput and latency benchmark.
+
+Drives DCLoad -> DCLoggerWorker -> file sink against simulated
+instruments (simulator.py) and reports, per scenario:
+
+    samples/sec         sustained rate of input data samples delivered
+    latency p50/p99     time from enqueueing a request to its sample
+                        arriving in the GUI thread, ms
+    queue depth         mean and max of the worker queue, sampled
+    cpu/sample          process CPU time (user + system) per sample, ms
+
+Scenarios:
+    display         display polling only
+    file            polling with every sample written to a CSV log
+                    through the sink stack of the GUI (logfile.py,
+                    journal, BackgroundSink)
+    mode_changes    file logging with a constant mode change every
+                    MODE_CHANGE_EVERY samples
+    multi           MULTI_INSTRUMENTS workers, each with its own
+                    instrument on a line of its own, polling in
+                    parallel; not through DCLoadBus
+    bus             MULTI_INSTRUMENTS instruments sharing one line,
+                    polled back to back by bus.DCLoadBus; latency is
+                    the time from a sample's reception to its consumer,
+                    queue depth the samples waiting in the streams
+
+Results are printed and written as JSON so runs of different releases
+can be compared:
+
+    python benchmark.py [-n SAMPLES] [-b BAUD] [-o bench_results.json] [scenario ...]
+
+With --link-stats the per command link statistics of every instrument
+(linkstats.py) are added to the results.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import Queue
+import datetime
+import shutil
+import platform
+import tempfile
+import threading
+from timeit import default_timer
+
+from PyQt4.QtCore import QCoreApplication, QObject, SIGNAL
+
+from dc_logger import DCLoggerWorker, DEFAULT_DC_LOGGER_QUEUE_SIZE
+from scheduler import CommandQueue
+from bus import DCLoadBus
+from clock import monotonic
+from sinks import BackgroundSink
+from journal import JournaledSink
+from logfile import create_sink
+from simulator import SimulatedSerial, SimulatedLoad, DEFAULT_LATENCY
+from conf import DEFAULT_BAUD, DEFAULT_FILENAME, DEFAULT_ROTATE_BYTES, DEFAULT_ROTATE_ROWS, \
+    DEFAULT_ROTATE_WHEN
+
+DEFAULT_SAMPLES = 500
+DEFAULT_RESULT_FILE = 'bench_results.json'
+MODE_CHANGE_EVERY = 50
+MULTI_INSTRUMENTS = 4
+QUEUE_DEPTH_INTERVAL = 0.01
+SCENARIO_TIMEOUT = 600
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+class _Channel(QObject):
+    """ one worker with its simulated instrument and the receiving end
+        of its signals
+
+    """
+
+    def __init__(self, baud_rate, latency, file_writer=None, link_stats=False):
+        super(_Channel, self).__init__()
+        self.queue = CommandQueue(DEFAULT_DC_LOGGER_QUEUE_SIZE)
+        self.worker = DCLoggerWorker(self.queue)
+        self.worker.engine.load.sp = SimulatedSerial(baudrate=baud_rate, latency=latency)
+        if link_stats:
+            self.worker.engine.load.EnableStats()
+        self.file_writer = file_writer
+        # constant mode set last, see _feed
+        self.mode = None
+        self.sent = []
+        self.latencies = []
+        self.received = 0
+        self.failed = 0
+        # one item per sample received, see request()
+        self._answers = Queue.Queue()
+        self.connect(self.worker, SIGNAL('display_input_data_available'), self._on_input_data)
+        self.connect(self.worker, SIGNAL('file_input_data_available'), self._on_input_data)
+        self.worker.connect(1, baud_rate)
+        self.worker.start()
+
+    def request(self, data_receiver):
+        """ request a sample and wait for it to arrive
+
+            One request at a time: the queue would fold a request into an
+            identical one still pending, and it would get no sample of its
+            own.
+        """
+        self.sent.append(default_timer())
+        self.queue.put(('get_input_data', data_receiver,))
+        self._answers.get(timeout=SCENARIO_TIMEOUT)
+
+    def _on_input_data(self, sample):
+        self.latencies.append(default_timer() - self.sent[self.received])
+        self.received += 1
+        self._answers.put(None)
+        if sample is None:
+            self.failed += 1
+            return
+        if self.file_writer is not None:
+            self.file_writer.write(sample, self.mode)
+
+    def stop(self):
+        self.worker.terminate()
+        self.worker.wait()
+
+
+def _feed(channel, samples, data_receiver, mode_change_every):
+    for i in xrange(samples):
+        if mode_change_every and i and i % mode_change_every == 0:
+            const_mode = ('cc', 'cv', 'cw', 'cr')[(i // mode_change_every) % 4]
+            channel.queue.put(('set_constants_values', (const_mode, '1.0',),))
+            channel.mode = const_mode
+        channel.request(data_receiver)
+
+
+def run_scenario(app, name, samples, baud_rate, latency, link_stats=False):
+    instruments = MULTI_INSTRUMENTS if name == 'multi' else 1
+    data_receiver = 'file' if name in ('file', 'mode_changes') else 'display'
+    mode_change_every = MODE_CHANGE_EVERY if name == 'mode_changes' else 0
+
+    directory = None
+    file_writer = None
+    if data_receiver == 'file':
+        # the log the GUI would write, in a directory of its own
+        directory = tempfile.mkdtemp()
+        file_writer = BackgroundSink(JournaledSink(create_sink(
+            os.path.join(directory, os.path.basename(DEFAULT_FILENAME)),
+            DEFAULT_ROTATE_BYTES, DEFAULT_ROTATE_ROWS, DEFAULT_ROTATE_WHEN)))
+        file_writer.sink.open()
+        file_writer.sink.started = time.time()
+        file_writer.start()
+
+    channels = [_Channel(baud_rate, latency, file_writer, link_stats) for i in xrange(instruments)]
+    # let the workers switch to remote control before measuring
+    for channel in channels:
+        channel.queue.put(('set_remote_control',))
+    for channel in channels:
+        channel.queue.join()
+
+    feeders = [threading.Thread(target=_feed,
+        args=(channel, samples, data_receiver, mode_change_every)) for channel in channels]
+
+    queue_depths = []
+    started = default_timer()
+    cpu_started = cpu_time()
+    for feeder in feeders:
+        feeder.daemon = True
+        feeder.start()
+
+    next_depth_sample = started
+    while any(feeder.is_alive() for feeder in feeders) or \
+            sum(channel.received for channel in channels) < \
+            sum(len(channel.sent) for channel in channels):
+        app.processEvents()
+        now = default_timer()
+        if now >= next_depth_sample:
+            queue_depths.append(sum(channel.queue.qsize() for channel in channels))
+            next_depth_sample = now + QUEUE_DEPTH_INTERVAL
+        if now - started > SCENARIO_TIMEOUT:
+            break
+        time.sleep(0.0005)
+
+    elapsed = default_timer() - started
+    cpu_used = cpu_time() - cpu_started
+    for channel in channels:
+        channel.stop()
+    if file_writer is not None:
+        # rows still queued are written before the sink closes
+        file_writer.stop()
+        shutil.rmtree(directory)
+
+    received = sum(channel.received for channel in channels)
+    latencies = [latency for channel in channels for latency in channel.latencies]
+    result = {
+        'instruments': instruments,
+        'samples': received,
+        'failed_samples': sum(channel.failed for channel in channels),
+        'merged_requests': sum(channel.queue.merged for channel in channels),
+        'elapsed_s': elapsed,
+        'samples_per_s': received / elapsed if elapsed else None,
+        'latency_p50_ms': percentile(latencies, 0.5) * 1e3 if latencies else None,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1e3 if latencies else None,
+        'queue_depth_mean': sum(queue_depths) / float(len(queue_depths)) if queue_depths else 0,
+        'queue_depth_max': max(queue_depths) if queue_depths else 0,
+        'queue_depth_series': queue_depths,
+        'cpu_per_sample_ms': cpu_used / received * 1e3 if received else None,
+    }
+    if file_writer is not None:
+        result['file_sink'] = file_writer.metrics()
+    if link_stats:
+        result['link_stats'] = [channel.worker.engine.load.stats.snapshot() for channel in channels]
+    return result
+
+
+def run_bus_scenario(samples, baud_rate, latency, link_stats=False):
+    addresses = range(1, MULTI_INSTRUMENTS + 1)
+    bus = DCLoadBus(SimulatedSerial([SimulatedLoad(address) for address in addresses],
+        baudrate=baud_rate, latency=latency))
+    streams = {}
+    stats = []
+    for address in addresses:
+        streams[address] = bus.add_load(address)
+        bus.execute(address, 'SetRemoteControl')
+        if link_stats:
+            stats.append(bus.execute(address, 'EnableStats'))
+
+    received = dict((address, 0) for address in addresses)
+    latencies = []
+    queue_depths = []
+    started = default_timer()
+    cpu_started = cpu_time()
+    bus.start()
+    next_depth_sample = started
+    while min(received.values()) < samples:
+        for address, stream in streams.items():
+            while received[address] < samples and not stream.empty():
+                sample = stream.get_nowait()
+                latencies.append(monotonic() - sample.timestamp)
+                received[address] += 1
+        now = default_timer()
+        if now >= next_depth_sample:
+            queue_depths.append(sum(stream.qsize() for stream in streams.values()))
+            next_depth_sample = now + QUEUE_DEPTH_INTERVAL
+        if now - started > SCENARIO_TIMEOUT:
+            break
+        time.sleep(0.0005)
+
+    elapsed = default_timer() - started
+    cpu_used = cpu_time() - cpu_started
+    bus.close()
+
+    total = sum(received.values())
+    result = {
+        'instruments': len(addresses),
+        'samples': total,
+        'failed_samples': sum(bus.errors(address) for address in addresses),
+        'merged_requests': 0,
+        'elapsed_s': elapsed,
+        'samples_per_s': total / elapsed if elapsed else None,
+        'latency_p50_ms': percentile(latencies, 0.5) * 1e3 if latencies else None,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1e3 if latencies else None,
+        'queue_depth_mean': sum(queue_depths) / float(len(queue_depths)) if queue_depths else 0,
+        'queue_depth_max': max(queue_depths) if queue_depths else 0,
+        'queue_depth_series': queue_depths,
+        'cpu_per_sample_ms': cpu_used / total * 1e3 if total else None,
+    }
+    if link_stats:
+        result['link_stats'] = [load_stats.snapshot() for load_stats in stats]
+    return result
+
+
+SCENARIOS = ('display', 'file', 'mode_changes', 'multi', 'bus',)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='DC logger end-to-end benchmark')
+    parser.add_argument('scenarios', nargs='*', default=SCENARIOS, metavar='scenario',
+        help='any of %s' % (', '.join(SCENARIOS),))
+    parser.add_argument('-n', '--samples', type=int, default=DEFAULT_SAMPLES,
+        help='samples per instrument and scenario')
+    parser.add_argument('-b', '--baud', type=int, default=DEFAULT_BAUD)
+    parser.add_argument('-l', '--latency', type=float, default=DEFAULT_LATENCY,
+        help='simulated instrument latency, seconds')
+    parser.add_argument('-o', '--output', default=DEFAULT_RESULT_FILE)
+    parser.add_argument('--link-stats', action='store_true',
+        help='record per command link statistics')
+    args = parser.parse_args(argv)
+
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+    results = {
+        'started': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'baud': args.baud,
+        'latency_s': args.latency,
+        'scenarios': {},
+    }
+
+    print '%-14s %5s %10s %10s %10s %8s %8s %10s' % ('scenario', 'inst', 'samples', 'samples/s',
+        'p50 ms', 'p99 ms', 'q max', 'cpu ms/smp')
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error('unknown scenario %s' % (name,))
+        if name == 'bus':
+            res = run_bus_scenario(args.samples, args.baud, args.latency, args.link_stats)
+        else:
+            res = run_scenario(app, name, args.samples, args.baud, args.latency, args.link_stats)
+        results['scenarios'][name] = res
+        print '%-14s %5d %10d %10.1f %10.2f %8.2f %8d %10.3f' % (name, res['instruments'],
+            res['samples'], res['samples_per_s'], res['latency_p50_ms'],
+            res['latency_p99_ms'], res['queue_depth_max'], res['cpu_per_sample_ms'])
+
+    with open(args.output, 'w') as result_file:
+        json.dump(results, result_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+'''
+Compact binary data log.
+
+An append-only file of fixed size records holding the raw integer
+counts the instrument reported, so writing a sample costs one struct
+pack instead of formatting floats and timestamps, and a record takes 24
+bytes instead of the 60 or so of a CSV row.
+
+Header, 64 bytes, little endian:
+    8s  magic 'DCLBIN01'
+    H   format version
+    H   header size
+    H   record size
+    2x
+    d   voltage conversion factor (counts per V)
+    d   current conversion factor (counts per A)
+    d   power conversion factor (counts per W)
+    d   wall time the first session started, seconds since the epoch
+    16x
+
+Record, 24 bytes:
+    q   monotonic time of the reading, ns
+    I   voltage, counts (mV)
+    I   current, counts (0.1 mA)
+    I   power, counts (mW)
+    B   op_state
+    H   demand_state
+    B   mode code: 0 cc, 1 cv, 2 cw, 3 cr, 255 unknown
+
+Session marker, 24 bytes, written before the first record of every
+session (every open() of the log):
+    q   monotonic time, ns
+    d   wall time at that monotonic time
+    f   seconds the session started before that wall time
+    3x
+    B   254
+
+The monotonic clock only has a meaning within one process and boot, so
+the timestamps of a session are converted with its own marker:
+wall time = marker wall time + (ts_ns - marker ts_ns) / 1e9.
+total_seconds counts from the start of the session, like in a CSV log:
+from open(), or from the start of the crashed session a journal resumes.
+BinaryLog maps a file with mmap for random access; to_csv() streams it
+into the CSV layout of sinks.DEFAULT_FILE_LOG_STRUCT:
+
+    python binlog.py dc_load_log.bin [dc_load_log.csv]
+'''
+
+import os
+import sys
+import csv
+import mmap
+import time
+import struct
+import bisect
+import logging
+
+from dcload import InstrumentInterface
+from sinks import DEFAULT_FILE_LOG_STRUCT, format_timestamp
+
+log = logging.getLogger('dc_logger')
+
+MAGIC = 'DCLBIN01'
+VERSION = 1
+BINARY_LOG_EXTENSION = '.bin'
+
+_HEADER = struct.Struct('<8sHHH2xdddd16x')
+_RECORD = struct.Struct('<qIIIBHB')
+_SESSION = struct.Struct('<qdf3xB')
+HEADER_SIZE = _HEADER.size
+RECORD_SIZE = _RECORD.size
+
+MODE_CODES = dict(InstrumentInterface.modes)
+UNKNOWN_MODE = 255
+# mode code of a session marker
+SESSION_MARKER = 254
+# offset of the mode code within a record
+_MODE_OFFSET = RECORD_SIZE - 1
+MODE_NAMES = dict((code, name) for name, code in MODE_CODES.items())
+
+
+class BinarySink(object):
+    """ sink (see sinks.py) appending Samples as binary records
+
+        An existing log is appended to, keeping its header; a torn record
+        at its end is cut off first.  Every session starts with a session
+        marker.
+    """
+
+    def __init__(self, filename, started=None):
+        """ @param started: wall time total_seconds counts from, the time of
+                            open() when omitted
+
+        """
+        self.filename = filename
+        self.started = started
+        self.rows = 0
+        self._file_obj = None
+        self._has_header = False
+        self._anchored = False
+
+    def open(self):
+        size = os.path.getsize(self.filename) if os.path.exists(self.filename) else 0
+        self._anchored = False
+        if self.started is None:
+            self.started = time.time()
+        if size < HEADER_SIZE:
+            # the header is written with the first record, once started
+            # is settled
+            self._file_obj = open(self.filename, 'wb')
+            self._has_header = False
+            return
+
+        with open(self.filename, 'rb') as log_file:
+            read_header(log_file)
+        self._has_header = True
+        complete = HEADER_SIZE + (size - HEADER_SIZE) // RECORD_SIZE * RECORD_SIZE
+        self._file_obj = open(self.filename, 'r+b')
+        if complete != size:
+            log.warning('Cut a torn record off the end of %s' % (self.filename,))
+            self._file_obj.truncate(complete)
+        self._file_obj.seek(complete)
+
+    def is_open(self):
+        return self._file_obj is not None
+
+    def tell(self):
+        return self._file_obj.tell()
+
+    def recover(self, offset):
+        """ cut a torn record off the end of the log, see sinks.CsvSink.recover
+
+        """
+        if not os.path.exists(self.filename):
+            return None
+        size = os.path.getsize(self.filename)
+        if size < HEADER_SIZE:
+            return 0
+        offset = max(offset, HEADER_SIZE)
+        complete = HEADER_SIZE + (size - HEADER_SIZE) // RECORD_SIZE * RECORD_SIZE
+        with open(self.filename, 'r+b') as file_obj:
+            if complete != size:
+                log.warning('Cut a torn record off the end of %s' % (self.filename,))
+                file_obj.truncate(complete)
+            if offset >= complete:
+                return 0
+            file_obj.seek(offset)
+            data = file_obj.read(complete - offset)
+        # session markers are no rows
+        return len(data) // RECORD_SIZE - data[_MODE_OFFSET::RECORD_SIZE].count(chr(SESSION_MARKER))
+
+    def _start(self, sample):
+        """ write the header of a new log and the marker of this session,
+            anchoring its monotonic timestamps to the wall clock
+
+        """
+        if not self._has_header:
+            self._file_obj.write(_HEADER.pack(MAGIC, VERSION, HEADER_SIZE, RECORD_SIZE,
+                InstrumentInterface.convert_voltage, InstrumentInterface.convert_current,
+                InstrumentInterface.convert_power, self.started))
+            self._has_header = True
+        self._file_obj.write(_SESSION.pack(int(round(sample.timestamp * 1e9)),
+            sample.wall_time, sample.wall_time - self.started, SESSION_MARKER))
+        self._anchored = True
+
+    def record(self, sample, mode):
+        return _RECORD.pack(int(round(sample.timestamp * 1e9)), sample.voltage_raw,
+            sample.current_raw, sample.power_raw, sample.op_state, sample.demand_state,
+            MODE_CODES.get(mode, UNKNOWN_MODE))
+
+    def write(self, sample, mode):
+        if not self._anchored:
+            self._start(sample)
+        self._file_obj.write(self.record(sample, mode))
+        self.rows += 1
+
+    def write_many(self, items):
+        if items and not self._anchored:
+            self._start(items[0][0])
+        self._file_obj.write(''.join([self.record(sample, mode) for sample, mode in items]))
+        self.rows += len(items)
+
+    def flush(self):
+        if self._file_obj is not None:
+            self._file_obj.flush()
+
+    def sync(self):
+        if self._file_obj is not None:
+            self._file_obj.flush()
+            os.fsync(self._file_obj.fileno())
+
+    def close(self):
+        if self._file_obj is not None:
+            self._file_obj.close()
+            self._file_obj = None
+
+
+def read_header(log_file):
+    """ @return header fields of an open binary log as a dict
+
+    """
+    data = log_file.read(HEADER_SIZE)
+    if len(data) < HEADER_SIZE:
+        raise ValueError('Binary log header is incomplete')
+    magic, version, header_size, record_size, convert_voltage, convert_current, \
+        convert_power, started = _HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError('Not a binary DC load log')
+    if version != VERSION or header_size != HEADER_SIZE or record_size != RECORD_SIZE:
+        raise ValueError('Unsupported binary log version %d' % (version,))
+    return {
+        'convert_voltage': convert_voltage,
+        'convert_current': convert_current,
+        'convert_power': convert_power,
+        'started': started,
+    }
+
+
+class BinaryLog(object):
+    """ read access to a binary log through mmap
+
+        log[i] is the raw record tuple (ts_ns, voltage, current, power,
+        op_state, demand_state, mode code), a session marker included;
+        records() iterates over the readings with their wall times and
+        rows() over them in the CSV layout, without reading the whole
+        file.  started is the start of the first session.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file_obj = open(filename, 'rb')
+        header = read_header(self._file_obj)
+        self.__dict__.update(header)
+        self._count = (os.path.getsize(filename) - HEADER_SIZE) // RECORD_SIZE
+        self._map = None
+        if self._count:
+            self._map = mmap.mmap(self._file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        self._sessions = None
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file_obj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('record index out of range')
+        return _RECORD.unpack_from(self._map, HEADER_SIZE + index * RECORD_SIZE)
+
+    def sessions(self):
+        """ @return [(record index, ts_ns, wall time, session start)] of the
+                    session markers
+
+        """
+        if self._sessions is None:
+            self._sessions = []
+            if self._count:
+                # the mode code of every record, one byte each
+                modes = self._map[HEADER_SIZE + _MODE_OFFSET::RECORD_SIZE]
+                index = modes.find(chr(SESSION_MARKER))
+                while index >= 0:
+                    self._sessions.append((index,) + self._marker(index))
+                    index = modes.find(chr(SESSION_MARKER), index + 1)
+        return self._sessions
+
+    def _marker(self, index):
+        """ @return (ts_ns, wall time, session start) of the marker at index
+
+        """
+        ts_ns, wall_time, elapsed = _SESSION.unpack_from(
+            self._map, HEADER_SIZE + index * RECORD_SIZE)[:3]
+        return ts_ns, wall_time, wall_time - elapsed
+
+    def _readings(self, start, stop):
+        """ @return generator of (wall time, session start, raw record) of
+                    the readings of records start to stop
+
+        """
+        stop = self._count if stop is None else min(stop, self._count)
+        sessions = self.sessions()
+        # the marker in effect at start
+        position = bisect.bisect_right([session[0] for session in sessions], start) - 1
+        anchor = sessions[position][1:] if position >= 0 else None
+        unpack_from = _RECORD.unpack_from
+        for index in xrange(start, stop):
+            record = unpack_from(self._map, HEADER_SIZE + index * RECORD_SIZE)
+            if record[6] == SESSION_MARKER:
+                anchor = self._marker(index)
+                continue
+            if anchor is None:
+                raise ValueError('Record %d of %s precedes any session marker' % (
+                    index, self.filename))
+            yield anchor[1] + (record[0] - anchor[0]) / 1e9, anchor[2], record
+
+    def records(self, start=0, stop=None):
+        """ iterate over the readings of records start to stop
+
+            @return generator of (wall time, voltage, current, power,
+                    op_state, demand_state, mode code), in counts
+        """
+        for wall_time, started, record in self._readings(start, stop):
+            yield (wall_time,) + record[1:]
+
+    def rows(self, start=0, stop=None):
+        """ iterate over the readings in the CSV layout of DEFAULT_FILE_LOG_STRUCT,
+            total_seconds counting from the start of their session
+
+        """
+        for wall_time, started, record in self._readings(start, stop):
+            ts_ns, voltage, current, power, op_state, demand_state, mode = record
+            yield (format_timestamp(wall_time), voltage / self.convert_voltage,
+                power / self.convert_power, current / self.convert_current,
+                MODE_NAMES.get(mode), int(wall_time - started),)
+
+
+def to_csv(filename, csv_file):
+    """ stream the binary log filename into the open file csv_file
+
+        @return number of rows written
+    """
+    csv_obj = csv.writer(csv_file)
+    csv_obj.writerow(DEFAULT_FILE_LOG_STRUCT)
+    rows = 0
+    with BinaryLog(filename) as binary_log:
+        for row in binary_log.rows():
+            csv_obj.writerow(row)
+            rows += 1
+    return rows
+
+
+def main(argv):
+    if len(argv) < 2:
+        print 'usage: python binlog.py binary_log [csv_file]'
+        return 1
+    if len(argv) > 2:
+        with open(argv[2], 'wb') as csv_file:
+            to_csv(argv[1], csv_file)
+    else:
+        to_csv(argv[1], sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,174 @@
+'''
+Several DC loads on one serial line.
+
+The 85xx loads can share an RS-485 chain, each answering only to the
+frames carrying its own address byte.  DCLoadBus owns the port, keeps
+one DCLoad per address and polls their input values back to back, so a
+single process keeps the line busy instead of running one process per
+load.  Transactions stay strictly one at a time: on a half duplex
+multi-drop line a load must finish its answer before the next one is
+addressed.
+
+Scheduling: every load has a polling interval (0 polls as fast as the
+line allows) and a priority.  Each transaction goes to the load that is
+due with the highest priority; loads of equal priority are served
+round-robin in the order they became due.  A load waiting past its due
+time gains a priority level every PRIORITY_AGING seconds, so a busy
+load of high priority delays the others but cannot starve them.  A load
+is due again an interval after it was due, or after it was polled if
+it fell behind by more than that.  Samples are delivered to a
+bounded per-address stream (Queue); when a consumer falls behind the
+oldest samples are dropped so the bus never blocks on a reader.
+'''
+
+import time
+import threading
+from Queue import Queue, Full, Empty
+
+import serial
+
+from dcload import DCLoad
+from clock import monotonic
+from conf import DEFAULT_TIMEOUT
+
+DEFAULT_STREAM_SIZE = 1000
+# sleep when no load is due, seconds
+IDLE_INTERVAL = 0.005
+# seconds past its due time worth one priority level
+PRIORITY_AGING = 0.1
+
+
+class _BusLoad(object):
+    __slots__ = ('load', 'interval', 'priority', 'next_due', 'stream', 'errors',)
+
+    def __init__(self, load, interval, priority, stream):
+        self.load = load
+        self.interval = interval
+        self.priority = priority
+        # due from the time it is added
+        self.next_due = monotonic()
+        self.stream = stream
+        self.errors = 0
+
+
+class DCLoadBus(object):
+    def __init__(self, sp=None):
+        self._sp = sp
+        self._loads = {}
+        # one transaction on the line at a time
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    def Initialize(self, com_port, baudrate):
+        self._sp = serial.Serial(com_port-1, baudrate, timeout=DEFAULT_TIMEOUT)
+
+    def close(self):
+        self.stop()
+        if self._sp is not None:
+            self._sp.close()
+
+    def add_load(self, address, interval=0, priority=0, stream_size=DEFAULT_STREAM_SIZE):
+        """ register the load answering to address
+
+            @return Queue receiving the Samples of the load
+        """
+        if self._sp is None:
+            raise Exception('Bus is not initialized')
+        if address in self._loads:
+            raise Exception('Address %s is already in use' % (address,))
+
+        load = DCLoad()
+        load.sp = self._sp
+        load.address = address
+        load.BuildFrameCache()
+        stream = Queue(stream_size)
+        with self._lock:
+            self._loads[address] = _BusLoad(load, interval, priority, stream)
+        return stream
+
+    def remove_load(self, address):
+        with self._lock:
+            del self._loads[address]
+
+    def stream(self, address):
+        return self._loads[address].stream
+
+    def errors(self, address):
+        return self._loads[address].errors
+
+    def execute(self, address, name, *args):
+        """ call DCLoad method name of the load at address between polls
+
+        """
+        with self._lock:
+            return getattr(self._loads[address].load, name)(*args)
+
+    def poll_once(self):
+        """ poll the next due load
+
+            @return address of the polled load, None if no load was due
+        """
+        with self._lock:
+            bus_load = self._next_due(monotonic())
+            if bus_load is None:
+                return None
+
+            try:
+                sample = bus_load.load.GetSample()
+            except Exception:
+                bus_load.errors += 1
+                self._sp.flushInput()
+                return bus_load.load.address
+
+        self._publish(bus_load.stream, sample)
+        return bus_load.load.address
+
+    def _next_due(self, now):
+        selected = None
+        for bus_load in self._loads.itervalues():
+            if bus_load.next_due > now:
+                continue
+            priority = bus_load.priority + (now - bus_load.next_due) / PRIORITY_AGING
+            if selected is None or priority > selected_priority or \
+                    (priority == selected_priority and bus_load.next_due < selected.next_due):
+                selected = bus_load
+                selected_priority = priority
+
+        if selected is not None:
+            next_due = selected.next_due + selected.interval
+            if next_due < now:
+                # behind by more than an interval
+                next_due = now + selected.interval
+            selected.next_due = next_due
+        return selected
+
+    def _publish(self, stream, sample):
+        while 1:
+            try:
+                stream.put_nowait(sample)
+                return
+            except Full:
+                try:
+                    stream.get_nowait()
+                except Empty:
+                    pass
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='DCLoadBus')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while self._running:
+            if self.poll_once() is None:
+                time.sleep(IDLE_INTERVAL)
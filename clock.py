@@ -0,0 +1,10 @@
+'''
+Clock used for intervals, deadlines and sample timestamps.
+'''
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2 has no monotonic clock; on Windows time.clock is the
+    # performance counter, elsewhere time.time is the best we have.
+    from timeit import default_timer as monotonic
@@ -0,0 +1,192 @@
+'''
+Encoding and decoding of the 26 byte frames spoken by the B&K 85xx DC
+loads.
+
+Frames are built and parsed as whole packets with precompiled struct
+layouts instead of byte at a time chr/ord arithmetic.  Responses are
+decoded in place with unpack_from, so they can be passed in as str,
+buffer or memoryview objects without slicing copies.
+
+Frame layout:
+    byte 0      0xaa start byte
+    byte 1      address
+    byte 2      command
+    bytes 3-24  command specific data (little endian), zero padded
+    byte 25     checksum, sum of bytes 0-24 modulo 256
+'''
+
+import struct
+
+LENGTH_PACKET = 26
+START_BYTE = 0xaa
+STATUS_COMMAND = 0x12
+STATUS_OK = 0x80
+
+# Command bodies, i.e. everything but the trailing checksum byte
+_QUERY = struct.Struct('<BBB22x')
+_INTEGER = {
+    1: struct.Struct('<BBBB21x'),
+    2: struct.Struct('<BBBH20x'),
+    4: struct.Struct('<BBBI18x'),
+}
+_TRANSIENT = struct.Struct('<BBBIHIHB9x')
+
+# Little endian integers on their own (CodeInteger/DecodeInteger)
+_LITTLE_ENDIAN = {
+    1: struct.Struct('<B'),
+    2: struct.Struct('<H'),
+    4: struct.Struct('<I'),
+}
+_MASK = {
+    1: 0xff,
+    2: 0xffff,
+    4: 0xffffffff,
+}
+
+# Responses, always unpacked from offset 0 of the full frame
+_RESPONSE_HEADER = struct.Struct('<BBBB')
+_RESPONSE_INTEGER = {
+    1: struct.Struct('<3xB'),
+    2: struct.Struct('<3xH'),
+    4: struct.Struct('<3xI'),
+}
+_RESPONSE_TRANSIENT = struct.Struct('<3xIHIHB')
+_RESPONSE_INPUT_VALUES = struct.Struct('<3xIIIBH')
+
+
+def checksum(frame):
+    """ sum of the first 25 bytes of frame modulo 256
+
+    """
+    return sum(bytearray(frame[:LENGTH_PACKET - 1])) & 0xff
+
+
+def _finish(body):
+    return body + chr(sum(bytearray(body)) & 0xff)
+
+
+def encode_little_endian(value, num_bytes=4):
+    return _LITTLE_ENDIAN[num_bytes].pack(int(value) & _MASK[num_bytes])
+
+
+def decode_little_endian(data):
+    return _LITTLE_ENDIAN[len(data)].unpack(data)[0]
+
+
+def encode_query(address, command):
+    """ frame of a command without argument
+
+    """
+    return _finish(_QUERY.pack(START_BYTE, address, command))
+
+
+def encode_integer(address, command, value, num_bytes=4):
+    """ frame of a command carrying one 1, 2 or 4 byte integer
+
+        Values are truncated to an integer and wrapped to num_bytes the
+        same way the instrument expects (two's complement, little endian).
+    """
+    return _finish(_INTEGER[num_bytes].pack(
+        START_BYTE, address, command, int(value) & _MASK[num_bytes]))
+
+
+def encode_transient(address, command, a, a_time_ms, b, b_time_ms, operation):
+    return _finish(_TRANSIENT.pack(
+        START_BYTE, address, command,
+        int(a) & 0xffffffff, int(a_time_ms) & 0xffff,
+        int(b) & 0xffffffff, int(b_time_ms) & 0xffff,
+        int(operation) & 0xff))
+
+
+def sync(data, address, command, data_reply=False):
+    """ find the response to command from address at the start of data
+
+        Bytes before a start byte, frames with a wrong checksum or address
+        and well formed but stale responses to other commands are skipped,
+        so the stream re-aligns on the next good frame.
+
+        A 0x12 status frame answers a command without data_reply.  A query
+        (data_reply) is only answered by a status frame reporting an error;
+        an OK status frame is the late answer of an earlier command and is
+        skipped like any other stale response.
+
+        @return (frame or None, rest of data, number of bytes skipped)
+    """
+    start_byte = chr(START_BYTE)
+    skipped = 0
+    while len(data) >= LENGTH_PACKET:
+        if data[0] == start_byte and ord(data[1]) == address and \
+                checksum(data) == ord(data[LENGTH_PACKET - 1]):
+            frame_command = ord(data[2])
+            if frame_command == command or (frame_command == STATUS_COMMAND and
+                    not (data_reply and ord(data[3]) == STATUS_OK)):
+                return data[:LENGTH_PACKET], data[LENGTH_PACKET:], skipped
+            skip = LENGTH_PACKET
+        else:
+            skip = data.find(start_byte, 1)
+            if skip < 0:
+                skip = len(data)
+        data = data[skip:]
+        skipped += skip
+
+    # incomplete frame: it can only start at a start byte
+    skip = data.find(start_byte)
+    if skip < 0:
+        skip = len(data)
+    return None, data[skip:], skipped + skip
+
+
+class FrameError(ValueError):
+    """ a frame is not the response a decoder was asked to decode
+
+    """
+
+
+def check_command(response, command):
+    """ raise FrameError unless response is a frame of command
+
+    """
+    if ord(response[2]) != command:
+        raise FrameError('Expected a response to command 0x%02X, got 0x%02X' % (
+            command, ord(response[2])))
+
+
+def decode_header(response):
+    """ @return (start byte, address, command, first data byte)
+
+    """
+    return _RESPONSE_HEADER.unpack_from(response)
+
+
+def decode_status(response):
+    """ @return status byte of a 0x12 status response
+
+    """
+    return _RESPONSE_HEADER.unpack_from(response)[3]
+
+
+def decode_integer(response, num_bytes=4, command=None):
+    """ @param command: if given, the command byte response must carry
+
+    """
+    if command is not None:
+        check_command(response, command)
+    return _RESPONSE_INTEGER[num_bytes].unpack_from(response)[0]
+
+
+def decode_transient(response, command=None):
+    """ @return (A, A time ms, B, B time ms, operation)
+
+    """
+    if command is not None:
+        check_command(response, command)
+    return _RESPONSE_TRANSIENT.unpack_from(response)
+
+
+def decode_input_values(response, command=None):
+    """ @return (voltage mV, current 0.1 mA, power mW, op_state, demand_state)
+
+    """
+    if command is not None:
+        check_command(response, command)
+    return _RESPONSE_INPUT_VALUES.unpack_from(response)
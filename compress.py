@@ -0,0 +1,231 @@
+'''
+Streaming gzip compression of the data log.
+
+A log named *.gz is written as a sequence of gzip members, one per flush
+of the sink: GzipBlockFile compresses what is written into the current
+member and flush() ends it.  The file is a valid gzip stream, gzip -dc
+and gzip.open read it as a whole, and every member can be decompressed
+on its own, so a crash loses at most the member being written.
+Compression runs in the thread writing the sink, the BackgroundSink
+thread, never in the acquisition path.
+
+iter_members() decompresses a log member by member and stops at a torn
+member at its end instead of failing; iter_rows() streams the CSV rows
+of a log and recover() cuts a torn member off after a crash.
+
+    python compress.py dc_load_log.csv.gz [dc_load_log.csv]
+'''
+
+import os
+import csv
+import sys
+import zlib
+import struct
+import logging
+
+log = logging.getLogger('dc_logger')
+
+GZIP_EXTENSION = '.gz'
+DEFAULT_LEVEL = 6
+# bytes read from the log at once
+READ_SIZE = 64 * 1024
+
+_GZIP_MAGIC = '\x1f\x8b'
+_FHCRC = 0x02
+_FEXTRA = 0x04
+_FNAME = 0x08
+_FCOMMENT = 0x10
+
+
+class GzipBlockFile(object):
+    """ append only file object writing one gzip member per flush()
+
+    """
+
+    def __init__(self, filename, level=DEFAULT_LEVEL):
+        self.filename = filename
+        self.level = level
+        self._file_obj = open(filename, 'ab')
+        self._file_obj.seek(0, os.SEEK_END)
+        self._compressor = None
+        # uncompressed bytes written
+        self.raw_bytes = 0
+
+    def write(self, data):
+        if not data:
+            return
+        if self._compressor is None:
+            # wbits 16 + 15: deflate with gzip header and trailer
+            self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self._file_obj.write(self._compressor.compress(data))
+        self.raw_bytes += len(data)
+
+    def flush(self):
+        """ end the member, everything written so far can be read back
+
+        """
+        if self._compressor is not None:
+            self._file_obj.write(self._compressor.flush())
+            self._compressor = None
+        self._file_obj.flush()
+
+    def fileno(self):
+        return self._file_obj.fileno()
+
+    def tell(self):
+        """ @return compressed size, the end of the last member after flush()
+
+        """
+        return self._file_obj.tell()
+
+    def close(self):
+        if self._file_obj is not None:
+            self.flush()
+            self._file_obj.close()
+            self._file_obj = None
+
+
+def _header_size(data):
+    """ @return size of the gzip member header at the start of data,
+                None if data is too short to tell
+
+    """
+    if len(data) < 10:
+        return None
+    if data[:2] != _GZIP_MAGIC or data[2] != '\x08':
+        raise ValueError('Not a gzip member')
+    flags = ord(data[3])
+    size = 10
+    if flags & _FEXTRA:
+        if len(data) < size + 2:
+            return None
+        size += 2 + struct.unpack('<H', data[size:size + 2])[0]
+    for flag in (_FNAME, _FCOMMENT):
+        if flags & flag:
+            end = data.find('\0', size)
+            if end < 0:
+                return None
+            size = end + 1
+    if flags & _FHCRC:
+        size += 2
+    return size if len(data) >= size else None
+
+
+def iter_members(file_obj, offset=0):
+    """ decompress the gzip members of file_obj, starting at offset
+
+        @return generator of (offset after the member, decompressed data),
+                ends at the end of the file or at a torn or damaged member
+    """
+    file_obj.seek(offset)
+    pending = ''
+    while 1:
+        header_size = None
+        while header_size is None:
+            try:
+                header_size = _header_size(pending)
+            except ValueError:
+                log.warning('Damaged gzip member @ %d' % (file_obj.tell() - len(pending),))
+                return
+            if header_size is None:
+                data = file_obj.read(READ_SIZE)
+                if not data:
+                    return
+                pending += data
+
+        # raw deflate, the trailer is checked here
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        data = pending[header_size:]
+        pieces = []
+        try:
+            while 1:
+                pieces.append(decompressor.decompress(data))
+                if decompressor.unused_data:
+                    break
+                data = file_obj.read(READ_SIZE)
+                if not data:
+                    return
+        except zlib.error:
+            log.warning('Damaged gzip member @ %d' % (file_obj.tell(),))
+            return
+
+        trailer = decompressor.unused_data
+        while len(trailer) < 8:
+            data = file_obj.read(READ_SIZE)
+            if not data:
+                return
+            trailer += data
+        member = ''.join(pieces)
+        crc, size = struct.unpack('<II', trailer[:8])
+        if crc != zlib.crc32(member) & 0xffffffff or size != len(member) & 0xffffffff:
+            log.warning('Damaged gzip member @ %d' % (file_obj.tell(),))
+            return
+        pending = trailer[8:]
+        yield file_obj.tell() - len(pending), member
+
+
+def read_blocks(filename):
+    """ @return generator of the decompressed members of filename
+
+    """
+    with open(filename, 'rb') as file_obj:
+        for end, data in iter_members(file_obj):
+            yield data
+
+
+def iter_lines(filename):
+    """ @return generator of the lines of a compressed log, a line may span
+                members
+
+    """
+    partial = ''
+    for data in read_blocks(filename):
+        lines = (partial + data).split('\n')
+        partial = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if partial:
+        yield partial
+
+
+def iter_rows(filename):
+    """ @return csv.reader over a compressed log, the header row first
+
+    """
+    return csv.reader(iter_lines(filename))
+
+
+def recover(filename, offset):
+    """ cut a torn member off the end of a compressed log, reading only what
+        follows offset, the end of a member known to be complete
+
+        @return number of lines in the complete members after offset
+    """
+    size = os.path.getsize(filename)
+    lines = 0
+    end = offset = min(offset, size)
+    with open(filename, 'r+b') as file_obj:
+        for end, data in iter_members(file_obj, offset):
+            lines += data.count('\n')
+        if end < size:
+            log.warning('Cut a torn gzip member off the end of %s' % (filename,))
+            file_obj.truncate(end)
+    return lines
+
+
+def main(argv):
+    if len(argv) < 2:
+        print 'usage: python compress.py compressed_log [output_file]'
+        return 1
+    out = open(argv[2], 'wb') if len(argv) > 2 else sys.stdout
+    try:
+        for data in read_blocks(argv[1]):
+            out.write(data)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
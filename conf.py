@@ -6,6 +6,11 @@ DEFAULT_TIMEOUT = 2
 # read values from DCLoad every n seconds
 DEFAULT_TIME = 60
 DEFAULT_FILENAME = 'dc_load_log.csv'
+# split the data log into segments (see sinks.RotatingSink), 0/None never
+DEFAULT_ROTATE_BYTES = 0
+DEFAULT_ROTATE_ROWS = 0
+# 'H' hourly, 'D' daily
+DEFAULT_ROTATE_WHEN = None
 
 
 
@@ -42,6 +42,12 @@ $Author:  Don Peterson $
 from __future__ import division
 import sys, time, serial
 from string import join
+import codec
+from clock import monotonic
+from sample import Sample
+from linkstats import LinkStats
+import wiretrace
+from conf import DEFAULT_TIMEOUT
 try:
     from   win32com.server.exception import COMException
 except:
@@ -55,6 +61,11 @@ nl = "\n"
  
 class InstrumentException(Exception): pass
 
+class CommandCaptured(Exception):
+    '''Raised by SendCommand while a command is being captured instead
+    of sent (see CaptureCommand).
+    '''
+
 class InstrumentInterface:
     '''Provides the interface to a 26 byte instrument along with utility
     functions.
@@ -71,21 +82,79 @@ class InstrumentInterface:
     highest_register = 25
     # Values for setting modes of CC, CV, CW, or CR
     modes = {"cc":0, "cv":1, "cw":2, "cr":3}
+    # Meaning of the status byte of a 0x12 response.  The empty string
+    # means the command was accepted.
+    status_messages = {
+        0x90 : "Wrong checksum",
+        0xA0 : "Incorrect parameter value",
+        0xB0 : "Command cannot be carried out",
+        0xC0 : "Invalid command",
+        0x80 : "",
+    }
+    # Command bytes accepted by the instrument
+    valid_commands = frozenset(range(0x20, 0x6D) + [0x12])
+    # Commands that carry no argument.  Their frames only depend on the
+    # address, so they are built once and reused for every request.
+    query_commands = (
+        0x23, 0x25, 0x27, 0x29, 0x2B, 0x2D, 0x2F, 0x31, 0x33, 0x35,
+        0x37, 0x39, 0x4F, 0x51, 0x53, 0x57, 0x59, 0x5A, 0x5E, 0x5F,
+        0x6A,
+    )
+    # Commands answered with data instead of a 0x12 status frame
+    data_commands = frozenset(query_commands) - frozenset([0x5A])
+    # Settings kept by the setpoint cache (see EnableSetpointCache):
+    # set command byte -> query command byte
+    cached_settings = {
+        0x22 : 0x23,  # max voltage
+        0x24 : 0x25,  # max current
+        0x26 : 0x27,  # max power
+        0x28 : 0x29,  # mode
+        0x2A : 0x2B,  # CC current
+        0x2C : 0x2D,  # CV voltage
+        0x2E : 0x2F,  # CW power
+        0x30 : 0x31,  # CR resistance
+    }
+    cached_queries = frozenset(cached_settings.values())
+    # Seconds a cached setting is trusted; the front panel can change it
+    setpoint_cache_ttl = 5
 
     def __init__(self):
         self.sp = None
-        #XXX: TO DELETE!!!
+        # Communication address, byte 1 of every frame.  Several loads on
+        # one multi-drop line are told apart by it (see bus.py).
         self.address = 0
+        # (address, command byte) -> complete 26 byte frame
+        self._frame_cache = {}
+        # Used by CaptureCommand/ReplayResponse to divert SendCommand
+        self._captured = None
+        self._replies = None
+        # Received bytes not consumed by a response yet
+        self._rx = ""
+        # Link counters, see ReadResponse
+        self.timeouts = 0
+        self.resync_events = 0
+        self.discarded_bytes = 0
+        # LinkStats while EnableStats is in effect
+        self.stats = None
+        # WireTrace while EnableTrace is in effect
+        self.trace = None
+        # (address, query command byte) -> (value, expiry time or None)
+        # while EnableSetpointCache is in effect
+        self._setpoints = None
+        self._setpoint_ttl = None
 
-    def Initialize(self, com_port, baudrate, address=0):
-        self.sp = serial.Serial(com_port-1, baudrate)
+    def Initialize(self, com_port, baudrate, address=0, timeout=DEFAULT_TIMEOUT):
+        # without a timeout a lost byte would block sp.read forever
+        self.sp = serial.Serial(com_port-1, baudrate, timeout=timeout)
         self.address = address
+        self.BuildFrameCache()
 
-    def connect(self, com_port, baud_rate):
+    def connect(self, com_port, baud_rate, timeout=DEFAULT_TIMEOUT):
         if self.sp is None:
-            self.Initialize(com_port, baud_rate)
+            self.Initialize(com_port, baud_rate, timeout=timeout)
         else:
             self.sp.open()
+            self.BuildFrameCache()
 
     def disconnect(self):
         self.sp.close()
@@ -97,36 +166,11 @@ class InstrumentInterface:
             .. .. .. .. ..   cb
         '''
         assert(len(bytes) == self.length_packet)
-        header = " "*3
-        out(header)
-        for i in xrange(self.length_packet):
-            if i % 10 == 0 and i != 0:
-                out(nl + header)
-            if i % 5 == 0:
-                out(" ")
-            s = "%02x" % ord(bytes[i])
-            if s == "00":
-                # Use the decimal point character if you see an
-                # unattractive printout on your machine.
-                #s = "."*2
-                # The following alternate character looks nicer
-                # in a console window on Windows.
-                s = chr(250)*2
-            out(s)
-        out(nl)
+        # chr(250) looks nicer than '.' in a console window on Windows
+        out(wiretrace.format_frame(bytes, zero=chr(250)*2) + nl)
     def CommandProperlyFormed(self, cmd):
         '''Return 1 if a command is properly formed; otherwise, return 0.
         '''
-        commands = (
-            0x20, 0x21, 0x22, 0x23, 0x24, 0x25, 0x26, 0x27, 0x28, 0x29,
-            0x2A, 0x2B, 0x2C, 0x2D, 0x2E, 0x2F, 0x30, 0x31, 0x32, 0x33,
-            0x34, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3A, 0x3B, 0x3C, 0x3D,
-            0x3E, 0x3F, 0x40, 0x41, 0x42, 0x43, 0x44, 0x45, 0x46, 0x47,
-            0x48, 0x49, 0x4A, 0x4B, 0x4C, 0x4D, 0x4E, 0x4F, 0x50, 0x51,
-            0x52, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5A, 0x5B,
-            0x5C, 0x5D, 0x5E, 0x5F, 0x60, 0x61, 0x62, 0x63, 0x64, 0x65,
-            0x66, 0x67, 0x68, 0x69, 0x6A, 0x6B, 0x6C, 0x12
-        )
         # Must be proper length
         if len(cmd) != self.length_packet:
             out("Command length = " + str(len(cmd)) + "-- should be " + \
@@ -142,7 +186,7 @@ class InstrumentInterface:
             return 0
         # Third character must be valid command
         byte3 = "%02X" % ord(cmd[2])
-        if ord(cmd[2]) not in commands:
+        if ord(cmd[2]) not in self.valid_commands:
             out("Third byte not a valid command:  %s\n" % byte3)
             return 0
         # Calculate checksum and validate it
@@ -155,11 +199,84 @@ class InstrumentInterface:
         '''Return the sum of the bytes in cmd modulo 256.
         '''
         assert((len(cmd) == self.length_packet - 1) or (len(cmd) == self.length_packet))
-        checksum = 0
-        for i in xrange(self.length_packet - 1):
-            checksum += ord(cmd[i])
-        checksum %= 256
-        return checksum
+        return codec.checksum(cmd)
+    def BuildFrameCache(self):
+        '''Build the frames of all query commands for the current address.
+        '''
+        for cmd_byte in self.query_commands:
+            self._frame_cache.pop((self.address, cmd_byte), None)
+            self.QueryFrame(cmd_byte)
+    def QueryFrame(self, cmd_byte):
+        '''Return the frame of a command without argument.  Frames are
+        cached per (address, command byte), so changing the address simply
+        builds a new set of frames on first use.
+        '''
+        key = (self.address, cmd_byte)
+        cmd = self._frame_cache.get(key)
+        if cmd is None:
+            cmd = codec.encode_query(self.address, cmd_byte)
+            assert(self.CommandProperlyFormed(cmd))
+            self._frame_cache[key] = cmd
+        return cmd
+    def EnableStats(self, stats=None):
+        '''Start recording per command latency histograms, bytes, timeouts
+        and error codes into stats (a new LinkStats if omitted).
+        '''
+        self.stats = stats if stats is not None else LinkStats()
+        return self.stats
+    def DisableStats(self):
+        self.stats = None
+    def EnableTrace(self, capacity=wiretrace.DEFAULT_CAPACITY, error_file=None):
+        '''Start recording the raw commands and responses into a ring
+        buffer of the last capacity frames.  If error_file is given the
+        buffer is dumped there whenever a command gets no response.
+        '''
+        self.trace = wiretrace.WireTrace(capacity, error_file)
+        return self.trace
+    def DisableTrace(self):
+        self.trace = None
+    def DumpTrace(self, filename):
+        '''Write the frames in the trace buffer to a binary trace file
+        (see wiretrace.py).
+        '''
+        if self.trace is None:
+            raise Exception("Wire trace is not enabled")
+        self.trace.dump(filename)
+    def EnableSetpointCache(self, ttl=None):
+        '''Answer reads of the settings in cached_settings from memory.  A
+        value is cached when it is read or successfully set and is trusted
+        for ttl seconds (setpoint_cache_ttl if omitted, 0 for ever).
+        '''
+        self._setpoints = {}
+        self._setpoint_ttl = self.setpoint_cache_ttl if ttl is None else ttl
+    def DisableSetpointCache(self):
+        self._setpoints = None
+    def InvalidateSetpointCache(self):
+        '''Forget all cached settings, e.g. after the instrument changed
+        them on its own.
+        '''
+        if self._setpoints is not None:
+            self._setpoints.clear()
+    def CacheSetpoint(self, cmd_byte, value):
+        '''Remember value as the current answer to query command cmd_byte.
+        '''
+        if self._setpoint_ttl:
+            expires = monotonic() + self._setpoint_ttl
+        else:
+            expires = None
+        self._setpoints[(self.address, cmd_byte)] = (value, expires)
+    def CachedSetpoint(self, cmd_byte):
+        '''Return the cached answer to query command cmd_byte or None.
+        '''
+        key = (self.address, cmd_byte)
+        cached = self._setpoints.get(key)
+        if cached is None:
+            return None
+        value, expires = cached
+        if expires is not None and expires <= monotonic():
+            del self._setpoints[key]
+            return None
+        return value
     def StartCommand(self, byte):
         return chr(0xaa) + chr(self.address) + chr(byte)
     def SendCommand(self, command):
@@ -167,50 +284,157 @@ class InstrumentInterface:
         response.
         '''
         assert(len(command) == self.length_packet)
+        if self._captured is not None:
+            self._captured.append(command)
+            raise CommandCaptured()
+        if self._replies is not None:
+            return self._replies.pop(0)
+        if self.stats is not None:
+            return self.SendCommands([command])[0]
+        if self.trace is not None:
+            self.trace.record(monotonic(), wiretrace.COMMAND, command)
         self.sp.write(command)
-        response = self.sp.read(self.length_packet)
-        assert(len(response) == self.length_packet)
+        return self.ReadResponse(ord(command[2]))
+    def SendCommands(self, commands):
+        '''Write several commands back to back and read all the responses
+        with one bulk read.  Return the 26 byte responses in command order.
+        '''
+        for command in commands:
+            assert(len(command) == self.length_packet)
+        stats = self.stats
+        if stats is not None:
+            started = monotonic()
+        if self.trace is not None:
+            for command in commands:
+                self.trace.record(monotonic(), wiretrace.COMMAND, command)
+        self.sp.write("".join(commands))
+        self._rx += self.sp.read(self.length_packet*len(commands))
+        if stats is None:
+            return [self.ReadResponse(ord(command[2])) for command in commands]
+
+        responses = []
+        for command in commands:
+            cmd_byte = ord(command[2])
+            discarded = self.discarded_bytes
+            try:
+                response = self.ReadResponse(cmd_byte)
+            except InstrumentException:
+                stats.record_timeout(cmd_byte, len(command),
+                    self.discarded_bytes - discarded)
+                raise
+            stats.record(cmd_byte, monotonic() - started, response, len(command),
+                len(response) + self.discarded_bytes - discarded)
+            responses.append(response)
+        return responses
+    def ReadResponse(self, cmd_byte):
+        '''Read the response to the command cmd_byte from the serial stream.
+        Junk bytes, corrupted frames and stale responses are discarded and
+        the stream re-aligns on the next good frame (see codec.sync); each
+        such recovery counts as one resync event.  Raise InstrumentException
+        if no response arrives within the port's timeout.
+        '''
+        data = self._rx
+        discarded = 0
+        while 1:
+            response, data, skipped = codec.sync(data, self.address, cmd_byte,
+                cmd_byte in self.data_commands)
+            discarded += skipped
+            if response is not None:
+                break
+            received = self.sp.read(self.length_packet - len(data))
+            if not received:
+                self._rx = ""
+                self.timeouts += 1
+                self.discarded_bytes += discarded + len(data)
+                if self.trace is not None:
+                    self.trace.record(monotonic(), wiretrace.INCOMPLETE,
+                        data[-self.length_packet:])
+                    self.trace.dump_on_error()
+                raise InstrumentException("No response to command 0x%02X" % cmd_byte)
+            data += received
+        self._rx = data
+        if discarded:
+            self.resync_events += 1
+            self.discarded_bytes += discarded
+        if self.trace is not None:
+            self.trace.record(monotonic(), wiretrace.RESPONSE, response)
         return response
+    def CaptureCommand(self, name, *args):
+        '''Call the method name with args without touching the serial
+        port and return the tuple (frame, result).  frame is the command
+        the method would have sent; if the method completed without sending
+        anything, frame is None and result holds its return value.
+        '''
+        self._captured = captured = []
+        try:
+            result = getattr(self, name)(*args)
+        except CommandCaptured:
+            return captured[0], None
+        finally:
+            self._captured = None
+        return None, result
+    def ReplayResponse(self, response, name, *args):
+        '''Call the method name with args again, handing it response as
+        the instrument's reply to the frame captured by CaptureCommand.
+        Return the method's result.
+        '''
+        self._replies = [response]
+        try:
+            return getattr(self, name)(*args)
+        finally:
+            self._replies = None
+    def Pipeline(self, calls):
+        '''Execute several methods as one transaction: all their commands
+        are written back to back and the responses read with a single bulk
+        read, saving one serial round trip per call.  calls is a sequence of
+        tuples (method name, arg, ...).  Return the list of results.
+        '''
+        results = []
+        frames = []
+        pending = []
+        for call in calls:
+            frame, result = self.CaptureCommand(*call)
+            if frame is not None:
+                frames.append(frame)
+                pending.append((len(results), call))
+            results.append(result)
+        if frames:
+            responses = self.SendCommands(frames)
+            for (idx, call), response in zip(pending, responses):
+                results[idx] = self.ReplayResponse(response, *call)
+        return results
     def ResponseStatus(self, response):
         '''Return a message string about what the response meant.  The
         empty string means the response was OK.
         '''
-        responses = {
-            0x90 : "Wrong checksum",
-            0xA0 : "Incorrect parameter value",
-            0xB0 : "Command cannot be carried out",
-            0xC0 : "Invalid command",
-            0x80 : "",
-        }
         assert(len(response) == self.length_packet)
-        assert(ord(response[2]) == 0x12)
-        return responses[ord(response[3])]
+        start, address, command, status = codec.decode_header(response)
+        assert(command == codec.STATUS_COMMAND)
+        return self.status_messages[status]
+    def CheckResponse(self, response, cmd_byte):
+        '''Raise InstrumentException unless response carries the data
+        requested by the query cmd_byte: an error status frame is raised
+        with its message, a frame of another command as unexpected.
+        '''
+        command = ord(response[2])
+        if command == codec.STATUS_COMMAND:
+            raise InstrumentException("Command 0x%02X failed: %s" % (cmd_byte,
+                self.status_messages.get(ord(response[3]), "Unknown status")))
+        if command != cmd_byte:
+            raise InstrumentException("Unexpected response 0x%02X to command 0x%02X" % (
+                command, cmd_byte))
     def CodeInteger(self, value, num_bytes=4):
         '''Construct a little endian string for the indicated value.  Two
         and 4 byte integers are the only ones allowed.
         '''
         assert(num_bytes == 1 or num_bytes == 2 or num_bytes == 4)
-        value = int(value)  # Make sure it's an integer
-        s  = chr(value & 0xff)
-        if num_bytes >= 2:
-            s += chr((value & (0xff << 8)) >> 8)
-            if num_bytes == 4:
-                s += chr((value & (0xff << 16)) >> 16)
-                s += chr((value & (0xff << 24)) >> 24)
-                assert(len(s) == 4)
-        return s
+        return codec.encode_little_endian(value, num_bytes)
     def DecodeInteger(self, str):
         '''Construct an integer from the little endian string. 1, 2, and 4 byte 
         strings are the only ones allowed.
         '''
         assert(len(str) == 1 or len(str) == 2 or len(str) == 4)
-        n  = ord(str[0])
-        if len(str) >= 2:
-            n += (ord(str[1]) << 8)
-            if len(str) == 4:
-                n += (ord(str[2]) << 16)
-                n += (ord(str[3]) << 24)
-        return n
+        return codec.decode_little_endian(str)
     def GetReserved(self, num_used):
         '''Construct a string of nul characters of such length to pad a
         command to one less than the packet size (leaves room for the 
@@ -224,35 +448,25 @@ class InstrumentInterface:
         '''
         assert(cmd_name)
         if self.debug:
-            out(cmd_name + " command:" + nl)
-            self.DumpCommand(cmd)
-            out(cmd_name + " response:" + nl)
-            self.DumpCommand(response)
+            zero = chr(250)*2
+            out(cmd_name + " command:" + nl +
+                wiretrace.format_frame(cmd, zero=zero) + nl +
+                cmd_name + " response:" + nl +
+                wiretrace.format_frame(response, zero=zero) + nl)
     def GetCommand(self, command, value, num_bytes=4):
         '''Construct the command with an integer value of 0, 1, 2, or 
         4 bytes.
         '''
-        cmd = self.StartCommand(command)
-        if num_bytes > 0:
-            r = num_bytes + 3
-            cmd += self.CodeInteger(value)[:num_bytes] + self.Reserved(r)
-        else:
-            cmd += self.Reserved(0)
-        cmd += chr(self.CalculateChecksum(cmd))
-        assert(self.CommandProperlyFormed(cmd))
-        return cmd
+        if num_bytes == 0:
+            return self.QueryFrame(command)
+        return codec.encode_integer(self.address, command, value, num_bytes)
     def GetData(self, data, num_bytes=4):
         '''Extract the little endian integer from the data and return it.
         '''
         assert(len(data) == self.length_packet)
-        if num_bytes == 1:
-            return ord(data[3])
-        elif num_bytes == 2:
-            return self.DecodeInteger(data[3:5])
-        elif num_bytes == 4:
-            return self.DecodeInteger(data[3:7])
-        else:
+        if num_bytes not in (1, 2, 4):
             raise Exception("Bad number of bytes:  %d" % num_bytes)
+        return codec.decode_integer(data, num_bytes)
     def Reserved(self, num_used):
         assert(num_used >= 3 and num_used < self.length_packet - 1)
         return chr(0)*(self.length_packet - num_used - 1)
@@ -260,10 +474,20 @@ class InstrumentInterface:
         '''Send the indicated command along with value encoded as an integer
         of the specified size.  Return the instrument's response status.
         '''
+        query = self.cached_settings.get(byte)
+        if query is None or self._setpoints is None:
+            query = None
+        else:
+            # Until the instrument confirms, the cached value is unknown
+            self._setpoints.pop((self.address, query), None)
         cmd = self.GetCommand(byte, value, num_bytes)
         response = self.SendCommand(cmd)
         self.PrintCommandAndResponse(cmd, response, msg)
-        return self.ResponseStatus(response)
+        status = self.ResponseStatus(response)
+        if query is not None and not status:
+            # Cache what the instrument stores: the encoded integer
+            self.CacheSetpoint(query, codec.decode_integer(cmd, num_bytes, byte))
+        return status
     def GetIntegerFromLoad(self, cmd_byte, msg, num_bytes=4):
         '''Construct a command from the byte in cmd_byte, send it, get
         the response, then decode the response into an integer with the
@@ -271,13 +495,20 @@ class InstrumentInterface:
         the printout.  Return the integer.
         '''
         assert(num_bytes == 1 or num_bytes == 2 or num_bytes == 4)
-        cmd = self.StartCommand(cmd_byte)
-        cmd += self.Reserved(3)
-        cmd += chr(self.CalculateChecksum(cmd))
-        assert(self.CommandProperlyFormed(cmd))
+        # A replayed response must be consumed, never answered from the cache
+        cached = self._setpoints is not None and cmd_byte in self.cached_queries
+        if cached and self._replies is None:
+            value = self.CachedSetpoint(cmd_byte)
+            if value is not None:
+                return value
+        cmd = self.QueryFrame(cmd_byte)
         response = self.SendCommand(cmd)
         self.PrintCommandAndResponse(cmd, response, msg)
-        return self.DecodeInteger(response[3:3 + num_bytes])
+        self.CheckResponse(response, cmd_byte)
+        value = codec.decode_integer(response, num_bytes, cmd_byte)
+        if cached:
+            self.CacheSetpoint(cmd_byte, value)
+        return value
 
 class DCLoad(InstrumentInterface):
     _reg_clsid_      = "{943E2FA3-4ECE-448A-93AF-9ECAEB49CA1B}"
@@ -285,6 +516,7 @@ class DCLoad(InstrumentInterface):
     _reg_progid_     = "BKServers.DCLoad85xx"  # External name
     _public_attrs_   = ["debug"]
     _public_methods_ = [
+        "ApplyMode",
         "DisableLocalControl",
         "EnableLocalControl",
         "GetBatteryTestVoltage",
@@ -304,6 +536,7 @@ class DCLoad(InstrumentInterface):
         "GetRemoteSense",
         "GetTransient",
         "GetTriggerSource",
+        "GetModeState",
         "Initialize",
         "RecallSettings",
         "SaveSettings",
@@ -330,9 +563,17 @@ class DCLoad(InstrumentInterface):
         "TurnLoadOff",
         "TurnLoadOn",
     ]
-    def Initialize(self, com_port, baudrate, address=0):
+    # Constant modes: (set command byte, query command byte, name of the
+    # conversion factor of the setpoint)
+    mode_setpoints = {
+        "cc" : (0x2A, 0x2B, "convert_current"),
+        "cv" : (0x2C, 0x2D, "convert_voltage"),
+        "cw" : (0x2E, 0x2F, "convert_power"),
+        "cr" : (0x30, 0x31, "convert_resistance"),
+    }
+    def Initialize(self, com_port, baudrate, address=0, timeout=DEFAULT_TIMEOUT):
         "Initialize the base class"
-        InstrumentInterface.Initialize(self, com_port, baudrate, address)
+        InstrumentInterface.Initialize(self, com_port, baudrate, address, timeout)
     def TimeNow(self):
         "Returns a string containing the current time"
         return time.asctime()
@@ -355,6 +596,8 @@ class DCLoad(InstrumentInterface):
         "Sets the load to local control"
         msg = "Set local control"
         local = 0
+        # The front panel may change any setting from now on
+        self.InvalidateSetpointCache()
         return self.SendIntegerToLoad(0x20, local, msg, num_bytes=1)
     def SetMaxCurrent(self, current):
         "Sets the maximum current the load will sink"
@@ -424,6 +667,65 @@ class DCLoad(InstrumentInterface):
         "Gets the constant resistance mode's resistance level"
         msg = "Get CR resistance"
         return self.GetIntegerFromLoad(0x31, msg, num_bytes=4)/self.convert_resistance
+    def ApplyMode(self, mode, value):
+        '''Set the setpoint of mode to value, then switch to mode, reading
+        back the mode and setpoint to verify them.  The mode is only
+        switched once the instrument accepted the setpoint, so a refused
+        setpoint leaves mode and setpoints as they were; a refused mode
+        switch leaves the new setpoint in the old mode.  The switch and the
+        read back go in one pipelined transaction.  The setpoint is
+        compared as the integer the instrument stores, so rounding by the
+        conversion factor is no mismatch.  Return the verified state, see
+        GetModeState.  Raise InstrumentException, naming the state the
+        instrument is left in, if a command is refused or the read back
+        differs.
+        '''
+        mode = mode.lower()
+        if mode not in self.modes:
+            raise Exception("Unknown mode")
+        set_byte, query_byte, conversion = self.mode_setpoints[mode]
+        setpoint = float(value)*getattr(self, conversion)
+        expected = codec.decode_integer(self.GetCommand(set_byte, setpoint, 4), 4, set_byte)
+        status = self.SendIntegerToLoad(set_byte, setpoint, "Set %s setpoint" % mode, 4)
+        if status:
+            raise InstrumentException("Mode %s, %s refused: %s, left %s" % (
+                mode, value, status, self._DescribeModeState(self.GetModeState())))
+        if self._setpoints is not None:
+            # The accepted setpoint was cached; read it back from the
+            # instrument instead
+            self._setpoints.pop((self.address, query_byte), None)
+        calls = [("SendIntegerToLoad", 0x28, self.modes[mode], "Set mode", 1)] + \
+            self._ModeStateCalls()
+        results = self.Pipeline(calls)
+        state = self._ModeState(results[1:])
+        if results[0]:
+            raise InstrumentException("Mode %s refused: %s, left %s" % (
+                mode, results[0], self._DescribeModeState(state)))
+        actual = results[2 + sorted(self.mode_setpoints).index(mode)]
+        if results[1] != self.modes[mode] or actual != expected:
+            raise InstrumentException("Mode %s, %s not applied: mode %s, %s" % (
+                mode, value, state["mode"], state[mode]))
+        return state
+    def GetModeState(self):
+        '''Return the active mode and the setpoints of all constant modes
+        as the dictionary {"mode":"cc", "cc":A, "cv":V, "cw":W, "cr":ohm},
+        read in one pipelined transaction (or from the setpoint cache).
+        '''
+        return self._ModeState(self.Pipeline(self._ModeStateCalls()))
+    def _DescribeModeState(self, state):
+        return "mode %s, %s %s" % (state["mode"], state["mode"], state[state["mode"]])
+    def _ModeStateCalls(self):
+        calls = [("GetIntegerFromLoad", 0x29, "Get mode", 1)]
+        for name in sorted(self.mode_setpoints):
+            query_byte = self.mode_setpoints[name][1]
+            calls.append(("GetIntegerFromLoad", query_byte, "Get %s setpoint" % name, 4))
+        return calls
+    def _ModeState(self, results):
+        modes_inv = dict((code, name) for name, code in self.modes.items())
+        state = {"mode" : modes_inv[results[0]]}
+        for name, value in zip(sorted(self.mode_setpoints), results[1:]):
+            state[name] = value/getattr(self, self.mode_setpoints[name][2])
+        return state
     def SetTransient(self, mode, A, A_time_s, B, B_time_s, operation="continuous"):
         '''Sets up the transient operation mode.  mode is one of 
         "CC", "CV", "CW", or "CR".
@@ -439,16 +741,10 @@ class DCLoad(InstrumentInterface):
             const = self.convert_power
         else:
             const = self.convert_resistance
-        cmd = self.StartCommand(opcodes[mode.lower()])
-        cmd += self.CodeInteger(A*const, num_bytes=4)
-        cmd += self.CodeInteger(A_time_s*self.to_ms, num_bytes=2)
-        cmd += self.CodeInteger(B*const, num_bytes=4)
-        cmd += self.CodeInteger(B_time_s*self.to_ms, num_bytes=2)
         transient_operations = {"continuous":0, "pulse":1, "toggled":2}
-        cmd += self.CodeInteger(transient_operations[operation], num_bytes=1)
-        cmd += self.Reserved(16)
-        cmd += chr(self.CalculateChecksum(cmd))
-        assert(self.CommandProperlyFormed(cmd))
+        cmd = codec.encode_transient(self.address, opcodes[mode.lower()],
+                A*const, A_time_s*self.to_ms, B*const, B_time_s*self.to_ms,
+                transient_operations[operation])
         response = self.SendCommand(cmd)
         self.PrintCommandAndResponse(cmd, response, "Set %s transient" % mode)
         return self.ResponseStatus(response)
@@ -457,17 +753,12 @@ class DCLoad(InstrumentInterface):
         if mode.lower() not in self.modes:
             raise Exception("Unknown mode")
         opcodes = {"cc":0x33, "cv":0x35, "cw":0x37, "cr":0x39}
-        cmd = self.StartCommand(opcodes[mode.lower()])
-        cmd += self.Reserved(3)
-        cmd += chr(self.CalculateChecksum(cmd))
-        assert(self.CommandProperlyFormed(cmd))
+        cmd_byte = opcodes[mode.lower()]
+        cmd = self.QueryFrame(cmd_byte)
         response = self.SendCommand(cmd)
         self.PrintCommandAndResponse(cmd, response, "Get %s transient" % mode)
-        A = self.DecodeInteger(response[3:7])
-        A_timer_ms = self.DecodeInteger(response[7:9])
-        B = self.DecodeInteger(response[9:13])
-        B_timer_ms = self.DecodeInteger(response[13:15])
-        operation = self.DecodeInteger(response[15])
+        self.CheckResponse(response, cmd_byte)
+        A, A_timer_ms, B, B_timer_ms, operation = codec.decode_transient(response, cmd_byte)
         time_const = 1e3
         transient_operations_inv = {0:"continuous", 1:"pulse", 2:"toggled"}
         if mode.lower() == "cc":
@@ -525,6 +816,7 @@ class DCLoad(InstrumentInterface):
         "Enable local control (i.e., key presses work) of the load"
         msg = "Enable local control"
         enabled = 1
+        self.InvalidateSetpointCache()
         return self.SendIntegerToLoad(0x55, enabled, msg, num_bytes=1)
     def DisableLocalControl(self):
         "Disable local control of the load"
@@ -560,10 +852,7 @@ class DCLoad(InstrumentInterface):
         '''Provide a software trigger.  This is only of use when the trigger
         mode is set to "bus".
         '''
-        cmd = self.StartCommand(0x5A)
-        cmd += self.Reserved(3)
-        cmd += chr(self.CalculateChecksum(cmd))
-        assert(self.CommandProperlyFormed(cmd))
+        cmd = self.QueryFrame(0x5A)
         response = self.SendCommand(cmd)
         self.PrintCommandAndResponse(cmd, response, "Trigger load (trigger = bus)")
         return self.ResponseStatus(response)
@@ -575,6 +864,7 @@ class DCLoad(InstrumentInterface):
     def RecallSettings(self, register=0):
         "Restore instrument settings from a register"
         assert(self.lowest_register <= register <= self.highest_register)
+        self.InvalidateSetpointCache()
         cmd = self.GetCommand(0x5C, register, num_bytes=1)
         response = self.SendCommand(cmd)
         self.PrintCommandAndResponse(cmd, response, "Recall register %d" % register)
@@ -594,31 +884,35 @@ class DCLoad(InstrumentInterface):
         functions_inv = {0:"fixed", 1:"short", 2:"transient", 4:"battery"}
         return functions_inv[fn]
     def GetInputValues(self):
-        '''Returns voltage in V, current in A, and power in W, op_state byte,
-        and demand_state byte.
+        '''Returns voltage in V, current in A, and power in W as strings.
+        '''
+        sample = self.GetSample()
+        s = [str(sample.voltage), str(sample.current), str(sample.power)]
+        return s
+    def GetSample(self):
+        '''Returns the input values as a Sample: raw counts, voltage in V,
+        current in A, power in W, op_state byte, demand_state word and the
+        time of the reading.
         '''
-        cmd = self.StartCommand(0x5F)
-        cmd += self.Reserved(3)
-        cmd += chr(self.CalculateChecksum(cmd))
-        assert(self.CommandProperlyFormed(cmd))
+        cmd = self.QueryFrame(0x5F)
         response = self.SendCommand(cmd)
+        timestamp = monotonic()
+        wall_time = time.time()
         self.PrintCommandAndResponse(cmd, response, "Get input values")
-        voltage = self.DecodeInteger(response[3:7])/self.convert_voltage
-        current = self.DecodeInteger(response[7:11])/self.convert_current
-        power   = self.DecodeInteger(response[11:15])/self.convert_power
-        op_state = hex(self.DecodeInteger(response[15]))
-        demand_state = hex(self.DecodeInteger(response[16:18]))
-        s = [str(voltage), str(current), str(power)]
-        return s
+        self.CheckResponse(response, 0x5F)
+        voltage, current, power, op_state, demand_state = \
+            codec.decode_input_values(response, 0x5F)
+        return Sample(voltage, current, power,
+            voltage/self.convert_voltage, current/self.convert_current,
+            power/self.convert_power, op_state, demand_state,
+            timestamp, wall_time)
     # Returns model number, serial number, and firmware version number
     def GetProductInformation(self):
         "Returns model number, serial number, and firmware version"
-        cmd = self.StartCommand(0x6A)
-        cmd += self.Reserved(3)
-        cmd += chr(self.CalculateChecksum(cmd))
-        assert(self.CommandProperlyFormed(cmd))
+        cmd = self.QueryFrame(0x6A)
         response = self.SendCommand(cmd)
         self.PrintCommandAndResponse(cmd, response, "Get product info")
+        self.CheckResponse(response, 0x6A)
         model = response[3:8]
         fw = hex(ord(response[9]))[2:] + "."
         fw += hex(ord(response[8]))[2:] 
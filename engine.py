@@ -0,0 +1,360 @@
+'''
+Acquisition engine, the Qt free core of the logger.
+
+AcquisitionEngine owns the DCLoad and serves the request tuples of a
+scheduler.CommandQueue, (command,) or (command, value), one transaction
+at a time; between requests it takes the samples of its PrecisionSampler
+(start_sampling/stop_sampling).  Results are handed to plain callbacks
+registered per event:
+
+    error_msg_posted                message for the user
+    com_port_state_changed          True/False
+    control_state_changed           'local'
+    load_state_changed              'on'/'off'
+    input_data_available            Sample or None, shared stream
+    display_input_data_available    Sample or None
+    file_input_data_available       Sample or None
+    constants_data_available        {mode: {'val': value, 'is_active': True}}
+    constant_mode_changed
+    sampler_stats_available         PrecisionSampler.stats()
+
+Callbacks run in the engine's thread.  The GUI wraps the engine in
+dc_logger.DCLoggerWorker, which turns the events into Qt signals of the
+same names; headless.py runs it in a plain thread.
+'''
+
+import logging
+import threading
+from Queue import Empty
+
+from serial import serialutil
+
+from dcload import DCLoad, InstrumentException
+from simulator import SimulatedSerial
+from sampler import PrecisionSampler
+from conf import DEFAULT_TIMEOUT
+
+log = logging.getLogger('dc_logger')
+
+UNKNOWN_STATE = 0
+LOCAL_STATE = 1
+REMOTE_STATE = 2
+# seconds between two sampler_stats_available events while sampling
+SAMPLER_REPORT_INTERVAL = 1.0
+# request making run() return once the requests before it are served
+STOP_REQUEST = 'stop_engine'
+
+EVENTS = (
+    'error_msg_posted',
+    'com_port_state_changed',
+    'control_state_changed',
+    'load_state_changed',
+    'input_data_available',
+    'display_input_data_available',
+    'file_input_data_available',
+    'constants_data_available',
+    'constant_mode_changed',
+    'sampler_stats_available',
+)
+
+
+class AcquisitionEngine(object):
+    def __init__(self, queue, test_mode=False):
+        self.load = DCLoad()
+        # constants values are re-read after every mode change
+        self.load.EnableSetpointCache()
+        # active constant mode, as last read from the instrument
+        self.mode = None
+        self._test_mode = test_mode
+        self._com_port = None
+        self._baud_rate = None
+        self._dc_logger_state = UNKNOWN_STATE
+        self._is_com_port_open = False
+        self._queue = queue
+        self._callbacks = dict((event, []) for event in EVENTS)
+        self._thread = None
+        # consecutive failed input value reads
+        self._read_failures = 0
+        self._resync_events = 0
+        # PrecisionSampler while start_sampling is in effect
+        self._sampler = None
+        self._next_sampler_report = 0
+
+    def subscribe(self, event, callback):
+        self._callbacks[event].append(callback)
+
+    def unsubscribe(self, event, callback):
+        self._callbacks[event].remove(callback)
+
+    def _emit(self, event, *args):
+        for callback in list(self._callbacks[event]):
+            try:
+                callback(*args)
+            except:
+                log.exception('Got unexpected exception @ %s callback' % (event,))
+
+    def _emit_msg(self, error_msg):
+        self._emit('error_msg_posted', error_msg)
+
+    def _get_dispatch_method(self, in_val):
+        mapper = {
+            'set_remote_control': self._set_remote_control,
+            'set_local_control': self._set_local_control,
+            'turn_load_on': self._turn_load_on,
+            'turn_load_off': self._turn_load_off,
+            'get_input_data': self._read_input_values,
+            'get_constants_values': self._get_constants_values,
+            'set_constants_values': self._set_constants_values,
+            'start_sampling': self._start_sampling,
+            'stop_sampling': self._stop_sampling,
+        }
+        return mapper.get(in_val)
+
+    def start(self):
+        """ run the engine in a thread of its own, see stop()
+
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run, name='AcquisitionEngine')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """ serve the requests already queued, then end run()
+
+        """
+        self._queue.put((STOP_REQUEST,))
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run(self):
+        while 1:
+            # requests are served between samples, so one waits for at
+            # most the transaction in flight
+            if self._sampler is not None:
+                timeout = self._sampler.timeout()
+                try:
+                    msg = self._queue.get(timeout > 0, timeout)
+                except Empty:
+                    if self._sampler.timeout() <= 0:
+                        self._take_sample()
+                    continue
+            else:
+                msg = self._queue.get()
+
+            try:
+                cmd = msg[0]
+                if cmd == STOP_REQUEST:
+                    self._stop_sampling()
+                    return
+                val = msg[1] if len(msg) > 1 else None
+                self._dispatch_request(cmd, val)
+            except:
+                log.exception('Got unexpected exception @ request dispatcher')
+            finally:
+                self._queue.task_done()
+
+    def _dispatch_request(self, cmd, val):
+        try:
+            if not self._is_com_port_open:
+                self._open_com_port()
+            if self._dc_logger_state != REMOTE_STATE:
+                self._set_remote_control()
+        except:
+            return
+
+        dispatch_method = self._get_dispatch_method(cmd)
+        if dispatch_method is None:
+            log.exception('Failed to dispatch request')
+            log.error('Empty cmd was issued')
+            return
+
+        dispatch_method() if val is None else dispatch_method(val)
+
+    def connect(self, com_port, baud_rate):
+        self._com_port = com_port
+        self._baud_rate = baud_rate
+
+        if self._test_mode and self.load.sp is None:
+            self.load.sp = SimulatedSerial(baudrate=baud_rate)
+            self._emit_msg('Test mode: using simulated instrument')
+        self._open_com_port()
+
+    def disconnect(self):
+        self._close_com_port()
+
+    def _open_com_port(self):
+        try:
+            self.load.connect(self._com_port, self._baud_rate, timeout=DEFAULT_TIMEOUT)
+            self._is_com_port_open = True
+        except:
+            self._emit_msg('Failed to open COM port %s' % (self._com_port))
+            log.error('Failed to open COM: %s, %s' % (self._com_port, self._baud_rate))
+            raise
+
+        self._emit('com_port_state_changed', True)
+
+    def _close_com_port(self):
+        try:
+            self.load.disconnect()
+            self._is_com_port_open = False
+        except:
+            self._emit_msg('Failed to close COM port')
+            log.exception('Failed to close COM')
+            raise
+
+        self._emit('com_port_state_changed', False)
+
+    def _set_remote_control(self):
+        try:
+            if self._dc_logger_state != REMOTE_STATE:
+                self.load.SetRemoteControl()
+            self._dc_logger_state = REMOTE_STATE
+            self._emit_msg('Control set to remote')
+        except:
+            self._emit_msg('Failed to set remote control')
+            log.exception('Failed to set remote control')
+            raise
+
+    def _set_local_control(self):
+        try:
+            if self._dc_logger_state != LOCAL_STATE:
+                self.load.SetLocalControl()
+            self._dc_logger_state = LOCAL_STATE
+        except:
+            self._emit_msg('Failed to set local control')
+            log.exception('Failed to set local control')
+            raise
+
+        self._emit('control_state_changed', 'local')
+
+    def _turn_load_on(self):
+        try:
+            self.load.TurnLoadOn()
+            self._emit_msg('Load turned on')
+        except:
+            self._emit_msg('Failed to turn load on')
+            log.exception('Failed to turn load on')
+            raise
+
+        self._emit('load_state_changed', 'on')
+
+    def _turn_load_off(self):
+        error_msg = 'Failed to turn load off'
+        try:
+            self.load.TurnLoadOff()
+            self._emit_msg('Load turned off')
+        except:
+            self._emit_msg(error_msg)
+            log.exception(error_msg)
+            raise
+
+        self._emit('load_state_changed', 'off')
+
+    def _read_input_values(self, data_receiver='display'):
+        ret_val = None
+        error_msg = 'Failed to obtain input values'
+        try:
+            ret_val = self.load.GetSample()
+            if self._read_failures:
+                log.warning('Input values available again after %d failed reads' % (self._read_failures))
+                self._read_failures = 0
+            if self.load.resync_events != self._resync_events:
+                self._resync_events = self.load.resync_events
+                log.warning('Response stream resynchronized, %d events, %d bytes discarded' % (
+                    self._resync_events, self.load.discarded_bytes))
+        except (serialutil.SerialException, InstrumentException):
+            # log only the first failure of a streak, otherwise log file will get very large very fast
+            self._read_failures += 1
+            if self._read_failures == 1:
+                self._emit_msg(error_msg)
+                log.exception(error_msg)
+        except:
+            self._emit_msg(error_msg)
+            log.exception(error_msg)
+            raise
+
+        if data_receiver == 'file':
+            self._emit('file_input_data_available', ret_val)
+        elif data_receiver == 'acquisition':
+            # shared stream, fanned out by acquisition.Acquisition
+            self._emit('input_data_available', ret_val)
+        else:
+            self._emit('display_input_data_available', ret_val)
+
+    def _start_sampling(self, interval):
+        """ read input values every interval seconds on the monotonic clock
+            and emit them as input_data_available, 0 reads as fast as the
+            link allows
+
+        """
+        self._sampler = PrecisionSampler(interval)
+        self._next_sampler_report = 0
+        log.info('Sampling started, interval %s s' % (interval,))
+
+    def _stop_sampling(self):
+        if self._sampler is not None:
+            log.info('Sampling stopped: %s' % (str(self._sampler.stats()),))
+            self._emit('sampler_stats_available', self._sampler.stats())
+        self._sampler = None
+
+    def _take_sample(self):
+        sampler = self._sampler
+        if not self._is_com_port_open:
+            self._emit_msg('COM port closed, sampling stopped')
+            self._stop_sampling()
+            return
+
+        try:
+            sampler.take(lambda: self._dispatch_request('get_input_data', 'acquisition'))
+        except:
+            log.exception('Got unexpected exception @ sampler')
+
+        if sampler.last >= self._next_sampler_report:
+            self._next_sampler_report = sampler.last + SAMPLER_REPORT_INTERVAL
+            self._emit('sampler_stats_available', sampler.stats())
+
+    def _emit_constants_state(self, state):
+        self.mode = state['mode']
+        ret_val = {}
+        for const_mode_name in self.load.mode_setpoints:
+            ret_val[const_mode_name] = {
+                'val': state[const_mode_name],
+            }
+        ret_val[state['mode']]['is_active'] = True
+
+        log.debug('Emitting: %s' % (str(ret_val)))
+        self._emit('constants_data_available', ret_val)
+
+    def _get_constants_values(self):
+        error_msg = 'Failed to obtain constants values'
+
+        try:
+            # all values and the mode in a single pipelined transaction
+            state = self.load.GetModeState()
+        except:
+            self._emit_msg(error_msg)
+            log.exception(error_msg)
+            raise
+
+        self._emit_constants_state(state)
+
+    def _set_constants_values(self, in_val):
+        const_mode, const_value = in_val
+        error_msg = 'Failed to update "%s" value: %s' % (const_mode, const_value,)
+
+        try:
+            # set, switch and verify in a single pipelined transaction
+            state = self.load.ApplyMode(const_mode, float(const_value))
+            log.debug('Verification: %s, in_val: %s' % (str(state), str(in_val)))
+            self._emit_msg('Mode %s activated, with value: %s' % (const_mode, const_value,))
+        except Exception, e:
+            self._emit_msg(error_msg)
+            log.exception(error_msg)
+            raise
+
+        # the verified state doubles as the constants snapshot
+        self._emit_constants_state(state)
+        self._emit('constant_mode_changed')
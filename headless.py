@@ -0,0 +1,182 @@
+'''
+Logging session without the GUI.
+
+Runs the AcquisitionEngine in a plain thread, samples the input values
+every interval seconds and appends them to a CSV file in the same format
+as the GUI.  Qt is never imported, so this runs on a lab server without
+a display.  With --format binary, or an output file ending in .bin, the
+samples go to a compact binary log instead (see binlog.py).  --rotate-mb,
+--rotate-rows and --rotate split the log into numbered segments listed in
+a manifest (see sinks.RotatingSink).  An output file ending in .csv.gz is
+written compressed (see compress.py), an uncompressed CSV log gets a
+time index (see timeindex.py).  --aggregate writes per window statistics
+to a second CSV file (see aggregate.py), --aggregate-only instead of the
+rows per sample.
+
+    python headless.py -p 1 -b 38400 -i 1 -d 3600 -o dc_load_log.csv
+    python headless.py -i 0.01 -d 3600 -o dc_load_log.bin
+    python headless.py -i 0.1 --rotate D --rotate-mb 500
+    python headless.py -i 0.1 --rotate D -o dc_load_log.csv.gz
+    python headless.py -i 0.05 --aggregate 60 --aggregate-only
+    python headless.py --test -i 0.05 -d 10 --mode cc --value 1.5 --load-on
+
+A session that ended in a crash is resumed on the next run with the same
+output, see journal.py.  Ctrl+C ends the session early.  With --load-on
+the load is turned off again at the end.
+'''
+
+import sys
+import time
+import logging
+import argparse
+
+from clock import monotonic
+from engine import AcquisitionEngine
+from scheduler import CommandQueue
+from acquisition import Acquisition
+from binlog import BINARY_LOG_EXTENSION
+from journal import JournaledSink
+from logfile import create_sink
+from sinks import BackgroundSink, DEFAULT_FLUSH_ROWS, DEFAULT_FLUSH_INTERVAL, ROTATE_WHEN, \
+    format_timestamp, split_extension
+from aggregate import WindowAggregator, AggregateCsvSink
+from conf import DEFAULT_PORT, DEFAULT_BAUD, DEFAULT_TIME, DEFAULT_FILENAME, DEFAULT_ROTATE_BYTES, \
+    DEFAULT_ROTATE_ROWS, DEFAULT_ROTATE_WHEN
+
+log = logging.getLogger('dc_logger')
+
+# seconds between progress lines
+STATUS_INTERVAL = 10
+# inserted before the extension of OUTPUT for the default aggregate file
+AGGREGATE_SUFFIX = '.agg'
+
+
+def open_writer(sink, args):
+    """ @return started BackgroundSink of sink, resuming a crashed session
+
+    """
+    sink = JournaledSink(sink)
+    writer = BackgroundSink(sink, args.flush_rows, args.flush_interval, not args.no_fsync)
+    writer.start()
+    if sink.recovered is not None:
+        log.info('Resuming unfinished session of %s started @ %s, mode %s' % (
+            sink.filename, format_timestamp(sink.started), sink.mode))
+    return writer
+
+
+def run_session(args):
+    queue = CommandQueue()
+    engine = AcquisitionEngine(queue, test_mode=args.test)
+    acquisition = Acquisition()
+    writers = []
+
+    if not args.aggregate_only:
+        sink = create_sink(args.output, int(args.rotate_mb * 1024 * 1024), args.rotate_rows,
+            args.rotate, args.format == 'binary')
+        sample_writer = open_writer(sink, args)
+        writers.append(sample_writer)
+        acquisition.subscribe('file', args.interval,
+            lambda sample: sample is not None and sample_writer.write(sample, engine.mode))
+
+    aggregator = None
+    if args.aggregate:
+        aggregate_writer = open_writer(AggregateCsvSink(args.aggregate_output), args)
+        writers.append(aggregate_writer)
+        aggregator = WindowAggregator(args.aggregate, aggregate_writer.write)
+        # every sample, whatever the interval of the raw rows
+        acquisition.subscribe('aggregate', args.interval,
+            lambda sample: aggregator.add(sample, engine.mode))
+
+    engine.subscribe('input_data_available', acquisition.publish)
+    engine.subscribe('error_msg_posted', log.info)
+    engine.subscribe('sampler_stats_available', lambda stats: log.debug('Sampler: %s' % (stats,)))
+
+    engine.connect(args.port, args.baud)
+    engine.start()
+    if args.mode is not None:
+        queue.put(('set_constants_values', (args.mode, args.value),))
+    queue.put(('get_constants_values',))
+    if args.load_on:
+        queue.put(('turn_load_on',))
+    queue.put(('start_sampling', args.interval,))
+
+    deadline = monotonic() + args.duration if args.duration is not None else None
+    try:
+        while 1:
+            timeout = STATUS_INTERVAL
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                # the session ends on time, not at the next status line
+                timeout = min(STATUS_INTERVAL, remaining)
+            time.sleep(timeout)
+            for writer in writers:
+                log.info('%d rows written to %s' % (writer.rows, writer.sink.filename))
+    except KeyboardInterrupt:
+        log.info('Interrupted')
+    finally:
+        queue.put(('stop_sampling',))
+        if args.load_on:
+            queue.put(('turn_load_off',))
+        engine.stop()
+        if aggregator is not None:
+            aggregator.flush()
+        for writer in writers:
+            writer.stop()
+        engine.disconnect()
+    for writer in writers:
+        log.info('Session ended, %d rows written to %s' % (writer.rows, writer.sink.filename))
+        log.info('File sink: %s' % (writer.metrics(),))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='DC load logging session without GUI')
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT, help='COM port number')
+    parser.add_argument('-b', '--baud', type=int, default=DEFAULT_BAUD)
+    parser.add_argument('-i', '--interval', type=float, default=DEFAULT_TIME,
+        help='seconds between samples, 0 samples as fast as the link allows')
+    parser.add_argument('-d', '--duration', type=float, help='seconds, until Ctrl+C when omitted')
+    parser.add_argument('-o', '--output', default=DEFAULT_FILENAME, help='log file, appended to')
+    parser.add_argument('--format', choices=('csv', 'binary'),
+        help='log file format, binary when OUTPUT ends in %s, csv otherwise' % (BINARY_LOG_EXTENSION,))
+    parser.add_argument('--rotate-mb', type=float, default=DEFAULT_ROTATE_BYTES / 1024.0 / 1024,
+        help='start a new segment once one reached ROTATE_MB megabytes')
+    parser.add_argument('--rotate-rows', type=int, default=DEFAULT_ROTATE_ROWS,
+        help='start a new segment every ROTATE_ROWS rows')
+    parser.add_argument('--rotate', choices=ROTATE_WHEN, default=DEFAULT_ROTATE_WHEN,
+        help='start a new segment every hour (H) or day (D)')
+    parser.add_argument('--aggregate', type=float, default=0, metavar='SECONDS',
+        help='also write min/max/mean/stddev per window of SECONDS')
+    parser.add_argument('--aggregate-output', help='aggregate CSV file, OUTPUT with .agg by default')
+    parser.add_argument('--aggregate-only', action='store_true',
+        help='write only the aggregates, no rows per sample')
+    parser.add_argument('--flush-rows', type=int, default=DEFAULT_FLUSH_ROWS,
+        help='flush the file every FLUSH_ROWS rows')
+    parser.add_argument('--flush-interval', type=float, default=DEFAULT_FLUSH_INTERVAL,
+        help='flush the file at least every FLUSH_INTERVAL seconds')
+    parser.add_argument('--no-fsync', action='store_true',
+        help='only flush, do not force the rows to disk')
+    parser.add_argument('--mode', choices=('cc', 'cv', 'cw', 'cr'), help='constant mode to apply')
+    parser.add_argument('--value', type=float, help='setpoint of --mode')
+    parser.add_argument('--load-on', action='store_true', help='turn the load on while logging')
+    parser.add_argument('--test', action='store_true', help='use a simulated instrument')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    if args.mode is not None and args.value is None:
+        parser.error('--mode requires --value')
+    if args.aggregate_only and not args.aggregate:
+        parser.error('--aggregate-only requires --aggregate')
+    if args.aggregate and args.aggregate_output is None:
+        root, ext = split_extension(args.output)
+        args.aggregate_output = root + AGGREGATE_SUFFIX + (ext if 'csv' in ext else '.csv')
+    if args.format is None:
+        args.format = 'binary' if args.output.endswith(BINARY_LOG_EXTENSION) else 'csv'
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s')
+    run_session(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
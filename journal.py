@@ -0,0 +1,159 @@
+'''
+Session journal of the data log.
+
+JournaledSink wraps a sink (see sinks.py) and, every time the sink is
+flushed, records a checkpoint in a small sidecar file, dc_load_log.csv.journal:
+the position in the log up to which every row is complete, the rows
+written, the session start total_seconds counts from and the active mode.
+close() marks the session finished.
+
+A journal that is still open on the next start means the session before
+ended in a crash.  open() then recovers the log: only the part after the
+checkpoint is read, a torn row at its end is cut off, and the session is
+resumed with its start time and mode, so total_seconds continues where
+it stopped.
+
+    writer = BackgroundSink(JournaledSink(CsvSink('dc_load_log.csv')))
+    writer.start()
+    if writer.sink.recovered:
+        ... session writer.sink.started continues
+'''
+
+import json
+import logging
+
+from sinks import atomic_write
+
+log = logging.getLogger('dc_logger')
+
+JOURNAL_SUFFIX = '.journal'
+OPEN = 'open'
+FINISHED = 'finished'
+
+
+class Journal(object):
+    def __init__(self, filename):
+        """ @param filename: data log the journal belongs to
+
+        """
+        self.filename = filename + JOURNAL_SUFFIX
+
+    def load(self):
+        """ @return the last checkpoint, None without a readable journal
+
+        """
+        try:
+            with open(self.filename, 'rb') as journal_file:
+                return json.load(journal_file)
+        except IOError:
+            return None
+        except ValueError:
+            log.warning('Ignoring damaged journal %s' % (self.filename,))
+            return None
+
+    def unfinished(self):
+        """ @return the last checkpoint of a session that did not end, or None
+
+        """
+        state = self.load()
+        if state is None or state.get('state') != OPEN:
+            return None
+        return state
+
+    def checkpoint(self, state, fsync=False):
+        """ replace the journal with state, atomically
+
+        """
+        atomic_write(self.filename, json.dumps(state), fsync)
+
+
+class JournaledSink(object):
+    """ sink checkpointing a sink with tell() and recover(), see module doc
+
+        recovered holds the checkpoint of the session resumed by open(),
+        None if a new session started.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.filename = sink.filename
+        self.journal = Journal(sink.filename)
+        self.recovered = None
+        # mode of the last row written
+        self.mode = None
+        self._last_wall_time = None
+        self._checkpointed = False
+
+    @property
+    def started(self):
+        return self.sink.started
+
+    @started.setter
+    def started(self, started):
+        self.sink.started = started
+
+    @property
+    def rows(self):
+        return self.sink.rows
+
+    def open(self):
+        state = self.journal.unfinished()
+        rows = None
+        if state is not None:
+            rows = self.sink.recover(state['position'])
+        if rows is not None:
+            log.warning('Recovered unfinished session of %s, %d rows after the last checkpoint' % (
+                self.sink.filename, rows))
+            self.recovered = state
+            self.sink.started = state['started']
+            self.mode = state['mode']
+        self.sink.open()
+
+    def is_open(self):
+        return self.sink.is_open()
+
+    def tell(self):
+        return self.sink.tell()
+
+    def write(self, sample, mode):
+        self.write_many([(sample, mode)])
+
+    def write_many(self, items):
+        if not self._checkpointed:
+            # rows before the first flush may be torn, too
+            self._checkpoint(False)
+        self.sink.write_many(items)
+        if items:
+            sample, self.mode = items[-1]
+            self._last_wall_time = sample.wall_time
+
+    def _checkpoint(self, fsync):
+        self._checkpointed = True
+        self.journal.checkpoint({
+            'state': OPEN,
+            'position': self.sink.tell(),
+            'rows': self.sink.rows,
+            'started': self.sink.started,
+            'mode': self.mode,
+            'last_wall_time': self._last_wall_time,
+        }, fsync)
+
+    def flush(self):
+        self.sink.flush()
+        self._checkpoint(False)
+
+    def sync(self):
+        self.sink.sync()
+        self._checkpoint(True)
+
+    def close(self):
+        if not self.sink.is_open():
+            return
+        self.sink.close()
+        self.journal.checkpoint({
+            'state': FINISHED,
+            'rows': self.sink.rows,
+            'started': self.sink.started,
+            'mode': self.mode,
+            'last_wall_time': self._last_wall_time,
+        }, True)
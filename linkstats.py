@@ -0,0 +1,126 @@
+'''
+Per command statistics of the serial link.
+
+LinkStats keeps, for every command byte, a fixed bucket histogram of the
+round trip latency together with the bytes sent and received, timeouts
+and the error codes of 0x12 status responses.  Recording is a handful of
+integer additions; InstrumentInterface only records while its stats
+attribute is set (see EnableStats), so a disabled LinkStats costs one
+attribute test per command.
+
+    load.EnableStats()
+    ...
+    print load.stats.format()
+    load.stats.dump('link_stats.json')
+'''
+
+import json
+import time
+import bisect
+
+import codec
+
+# upper bounds of the latency buckets, ms; one more bucket collects the rest
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200, 500, 1000, 2000)
+
+STATUS_NAMES = {
+    0x90: 'wrong_checksum',
+    0xA0: 'incorrect_parameter',
+    0xB0: 'cannot_be_carried_out',
+    0xC0: 'invalid_command',
+}
+
+
+class CommandStats(object):
+    __slots__ = ('count', 'histogram', 'total_latency', 'max_latency', 'bytes_sent',
+        'bytes_received', 'timeouts', 'errors',)
+
+    def __init__(self, num_buckets):
+        self.count = 0
+        self.histogram = [0] * num_buckets
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.timeouts = 0
+        # status byte -> count
+        self.errors = {}
+
+
+class LinkStats(object):
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(bound / 1e3 for bound in buckets_ms)
+        self.commands = {}
+        self.started = time.time()
+
+    def _command(self, cmd_byte):
+        stats = self.commands.get(cmd_byte)
+        if stats is None:
+            stats = self.commands[cmd_byte] = CommandStats(len(self.buckets) + 1)
+        return stats
+
+    def record(self, cmd_byte, latency, response, bytes_sent, bytes_received):
+        """ account one completed command
+
+            @param latency: seconds from writing the command to having its response
+        """
+        stats = self._command(cmd_byte)
+        stats.count += 1
+        stats.histogram[bisect.bisect_left(self.buckets, latency)] += 1
+        stats.total_latency += latency
+        if latency > stats.max_latency:
+            stats.max_latency = latency
+        stats.bytes_sent += bytes_sent
+        stats.bytes_received += bytes_received
+        if ord(response[2]) == codec.STATUS_COMMAND:
+            status = ord(response[3])
+            if status != codec.STATUS_OK:
+                stats.errors[status] = stats.errors.get(status, 0) + 1
+
+    def record_timeout(self, cmd_byte, bytes_sent, bytes_received):
+        stats = self._command(cmd_byte)
+        stats.timeouts += 1
+        stats.bytes_sent += bytes_sent
+        stats.bytes_received += bytes_received
+
+    def reset(self):
+        self.commands = {}
+        self.started = time.time()
+
+    def snapshot(self):
+        """ @return statistics as plain dicts, keyed by command byte as '0xNN'
+
+        """
+        bounds = ['<=%gms' % (bound * 1e3) for bound in self.buckets] + \
+            ['>%gms' % (self.buckets[-1] * 1e3)]
+        commands = {}
+        for cmd_byte, stats in sorted(self.commands.items()):
+            commands['0x%02X' % cmd_byte] = {
+                'count': stats.count,
+                'mean_latency_ms': stats.total_latency / stats.count * 1e3 if stats.count else None,
+                'max_latency_ms': stats.max_latency * 1e3,
+                'histogram': zip(bounds, stats.histogram),
+                'bytes_sent': stats.bytes_sent,
+                'bytes_received': stats.bytes_received,
+                'timeouts': stats.timeouts,
+                'errors': dict((STATUS_NAMES.get(status, '0x%02X' % status), count)
+                    for status, count in stats.errors.items()),
+            }
+        return {
+            'started': self.started,
+            'duration_s': time.time() - self.started,
+            'commands': commands,
+        }
+
+    def dump(self, filename):
+        with open(filename, 'w') as stats_file:
+            json.dump(self.snapshot(), stats_file, indent=2, sort_keys=True)
+
+    def format(self):
+        lines = ['%-6s %8s %10s %10s %8s %8s' % ('cmd', 'count', 'mean ms', 'max ms',
+            'timeouts', 'errors')]
+        for cmd_byte, stats in sorted(self.commands.items()):
+            mean = stats.total_latency / stats.count * 1e3 if stats.count else 0
+            lines.append('0x%02X   %8d %10.2f %10.2f %8d %8d' % (cmd_byte, stats.count, mean,
+                stats.max_latency * 1e3, stats.timeouts, sum(stats.errors.values())))
+        return '\n'.join(lines)
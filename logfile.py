@@ -0,0 +1,84 @@
+'''
+The sink stack of the data log, shared by the GUI, headless.py and
+benchmark.py.
+
+create_sink() picks the format of the log and the wrappers it gets:
+
+    *.bin       compact binary records, see binlog.py
+    *.gz        gzip compressed CSV, see compress.py
+    otherwise   CSV with a time index, see timeindex.py
+
+and rotates it into segments when a rotation limit is set.  The callers
+add the journal and the writer thread:
+
+    writer = BackgroundSink(JournaledSink(create_sink('dc_load_log.csv')))
+
+log_files() lists the files a log consists of, sidecars and segments
+included, and remove_log() deletes them, so a replaced log leaves no
+index, journal or manifest behind that would be taken for its own.
+'''
+
+import os
+import json
+import logging
+
+from sinks import CsvSink, RotatingSink, MANIFEST_SUFFIX, split_extension
+from binlog import BinarySink, BINARY_LOG_EXTENSION
+from journal import JOURNAL_SUFFIX
+from timeindex import IndexedCsvSink, index_filename
+from compress import GZIP_EXTENSION
+
+log = logging.getLogger('dc_logger')
+
+
+def create_sink(filename, rotate_bytes=0, rotate_rows=0, rotate_when=None, binary=None):
+    """ @return sink of the data log filename, not opened yet
+
+        @param rotate_bytes, rotate_rows, rotate_when: see RotatingSink,
+                                                       all unset for one file
+        @param binary: binary records instead of CSV, None for a .bin
+                       filename only
+    """
+    if binary is None:
+        binary = filename.endswith(BINARY_LOG_EXTENSION)
+    sink_class = BinarySink if binary else CsvSink
+    if sink_class is CsvSink and not filename.endswith(GZIP_EXTENSION):
+        # time index for seeking into long logs
+        sink_class = IndexedCsvSink
+    if rotate_bytes or rotate_rows or rotate_when:
+        return RotatingSink(filename, rotate_bytes, rotate_rows, rotate_when, sink_class)
+    return sink_class(filename)
+
+
+def log_files(filename):
+    """ @return the existing files of the data log filename: the log, its
+                journal and index, and the manifest and segments of a
+                rotated log with their indexes
+
+    """
+    files = [filename, filename + JOURNAL_SUFFIX, index_filename(filename)]
+    manifest_filename = split_extension(filename)[0] + MANIFEST_SUFFIX
+    if os.path.exists(manifest_filename):
+        try:
+            with open(manifest_filename, 'rb') as manifest_file:
+                segments = json.load(manifest_file)['segments']
+        except (IOError, ValueError, KeyError):
+            log.warning('Ignoring damaged manifest %s' % (manifest_filename,))
+            segments = []
+        directory = os.path.dirname(filename)
+        for segment in segments:
+            segment_filename = os.path.join(directory, segment['file'])
+            files.extend((segment_filename, index_filename(segment_filename),))
+        files.append(manifest_filename)
+    return [name for name in files if os.path.exists(name)]
+
+
+def remove_log(filename):
+    """ delete the data log filename with everything log_files() lists
+
+        @return number of files deleted
+    """
+    files = log_files(filename)
+    for name in files:
+        os.remove(name)
+    return len(files)
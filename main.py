@@ -1,13 +1,16 @@
 import os
 import sys
-import csv
 import time
 import errno
 import datetime
 import ConfigParser
 import logging
 import logging.handlers
-from Queue import Queue
+from scheduler import CommandQueue, priority_of, CONFIGURATION
+from acquisition import Acquisition
+from sinks import BackgroundSink, format_timestamp
+from journal import JournaledSink
+from logfile import create_sink, remove_log
 
 from PyQt4.QtCore import *
 from PyQt4 import QtGui
@@ -16,7 +19,7 @@ from PyQt4.QtGui import *
 from dcload import DCLoad
 from dc_logger import DCLoggerWorker, TEST_MODE_STATUS
 from conf import DEFAULT_PORT, DEFAULT_BAUD, DEFAULT_TIME, DEFAULT_FILENAME,\
-    NEW_FILE_DIALOG_TEXT, EXISTING_FILE_DIALOG_TEXT
+    DEFAULT_ROTATE_BYTES, DEFAULT_ROTATE_ROWS, DEFAULT_ROTATE_WHEN, NEW_FILE_DIALOG_TEXT, EXISTING_FILE_DIALOG_TEXT
 
 app_dir = os.path.normpath(os.path.expandvars('%APPDATA%/dc_logger'))
 if not os.path.exists(app_dir):
@@ -35,7 +38,6 @@ LOCAL_STATE = 1
 REMOTE_STATE = 2
 RELEASE_VERSION = 8
 
-DEFAULT_FILE_LOG_STRUCT = ('timestamp', 'voltage', 'power', 'current', 'mode', 'total_seconds',)
 
 CONSTANT_MODES = {
     'cr': {
@@ -65,7 +67,7 @@ class Logger(QtGui.QMainWindow):
     def __init__(self, parent=None):
         super(Logger, self).__init__(parent)
 
-        self._queue = Queue(DEFAULT_DC_LOGGER_QUEUE_SIZE)
+        self._queue = CommandQueue(DEFAULT_DC_LOGGER_QUEUE_SIZE)
         self._dc_logger_state = UNKNOWN_STATE
         self._is_com_port_open = False
         self._port = None
@@ -81,10 +83,12 @@ class Logger(QtGui.QMainWindow):
         self._constants_mode = None
         self._worker = DCLoggerWorker(self._queue)
         self._worker.start()
-        self._display_logger = None
-        self._file_logger = None
-        self._file_obj = None
-        self._csv_obj = None
+        # one instrument read per sample feeds both display and file log
+        self._acquisition = Acquisition()
+        # interval the worker samples at, None while it does not sample
+        self._sampling_interval = None
+        # BackgroundSink, keeps disk I/O off the GUI thread
+        self._file_writer = None
         self._constants_cache = {}
 
         #control objects
@@ -110,10 +114,11 @@ class Logger(QtGui.QMainWindow):
         self._com_status_label = None
         self._logging_status_label = None
         self._constant_mode_status_label = None
+        self._queue_status_label = None
+        self._sampler_status_label = None
 
     def main(self):
         self._setup_ui()
-        self._build_logger_timers()
         self._reset_logger_objects(False)
         self._connect_actions()
         self._connect_logger_signals()
@@ -163,6 +168,9 @@ class Logger(QtGui.QMainWindow):
         self._com_status_label = self._build_status_bar_label(central_widget, status_bar_panel, 'COM status: inactive')
         self._logging_status_label = self._build_status_bar_label(central_widget, status_bar_panel, 'Logging inactive')
         self._constant_mode_status_label = self._build_status_bar_label(central_widget, status_bar_panel, 'Current mode: N/A')
+        self._queue_status_label = self._build_status_bar_label(central_widget, status_bar_panel)
+        self._sampler_status_label = self._build_status_bar_label(central_widget, status_bar_panel, 'Sampling: inactive')
+        self._update_queue_status_label()
 
     def _build_status_bar_label(self, central_widget, parent_panel, text=''):        
         status_label = QLabel(central_widget)
@@ -441,15 +449,6 @@ class Logger(QtGui.QMainWindow):
 
         return inner_frame
 
-    def _build_logger_timers(self):
-        self._display_logger = QTimer(self)
-        self._display_logger.stop()
-        self._display_logger.setInterval(self._display_interval * 1000)
-        
-        self._file_logger = QTimer(self)
-        self._file_logger.stop()
-        self._file_logger.setInterval(self._file_log_interval * 1000)
-    
     def _reset_logger_objects(self, is_com_open=None):
         if is_com_open is not None:
             self._com_port_edit.setDisabled(is_com_open)
@@ -517,8 +516,7 @@ class Logger(QtGui.QMainWindow):
         self._log_display_interval_edit.setText(str(self._display_interval))
         self._com_port_edit.setText(str(self._port))
         self._baud_rate_edit.setText(str(self._baud))
-        self._file_logger.setInterval(self._file_log_interval * 1000)
-        self._display_logger.setInterval(self._display_interval * 1000)
+        self._update_acquisition()
 
     def _update_window_title(self, appendix=''):
         test_mode_str = 'TEST MODE ACTIVE' if TEST_MODE_STATUS else ''
@@ -566,7 +564,8 @@ class Logger(QtGui.QMainWindow):
             if q.clickedButton() is append_file:
                 return True
             elif q.clickedButton() is replace_file:
-                os.remove(self._full_filename)
+                # the index, journal and segments of the old log go, too
+                remove_log(self._full_filename)
                 return True
             elif q.clickedButton() is new_file:
                 return self._select_new_file_location()
@@ -629,18 +628,15 @@ class Logger(QtGui.QMainWindow):
             self._log_display_interval_button.clicked.connect(self._update_log_display_interval)
             self._constants_update_button.clicked.connect(self._update_constants_settings)
             self._file_log_button.clicked.connect(self._select_new_file_location)
-            self._display_logger.timeout.connect(self._request_display_data)
-            self._file_logger.timeout.connect(self._request_file_data)
             self._constants_combobox.currentIndexChanged.connect(self._on_constant_mode_selection)
             
     def _connect_logger_signals(self):
         self.connect(self._worker, SIGNAL('error_msg_posted'), self._update_log)
         self.connect(self._worker, SIGNAL('com_port_state_changed'), self._on_com_port_state_change)
         self.connect(self._worker, SIGNAL('load_state_changed'), self._on_load_state_change)
-        self.connect(self._worker, SIGNAL('display_input_data_available'), self._on_get_display_input_data)
-        self.connect(self._worker, SIGNAL('file_input_data_available'), self._on_get_file_input_data)
+        self.connect(self._worker, SIGNAL('input_data_available'), self._acquisition.publish)
+        self.connect(self._worker, SIGNAL('sampler_stats_available'), self._on_sampler_stats)
         self.connect(self._worker, SIGNAL('constants_data_available'), self._on_get_constants_data)
-        self.connect(self._worker, SIGNAL('constant_mode_changed'), self._on_constant_mode_changed)
 
     def _com_port_connection_handle(self):
         if self._is_com_port_open:
@@ -668,16 +664,18 @@ class Logger(QtGui.QMainWindow):
             if not self._check_for_existing_file():
                 return
 
-            self._file_obj = open(self._full_filename, 'a+')
-            self._csv_obj = csv.DictWriter(self._file_obj, DEFAULT_FILE_LOG_STRUCT)
-            if os.path.getsize(self._full_filename) == 0:
-                self._csv_obj.writeheader()
+            # a .bin log file gets the compact binary format, see logfile.py
+            sink = create_sink(self._full_filename, DEFAULT_ROTATE_BYTES, DEFAULT_ROTATE_ROWS,
+                DEFAULT_ROTATE_WHEN)
+            # the journal resumes a session that ended in a crash
+            self._file_writer = BackgroundSink(JournaledSink(sink))
+            self._file_writer.sink.open()
 
         except:
             self._update_log('File check failed')
             return False
 
-        self._queue.put(('get_constants_values',))
+        self._send_request(('get_constants_values',))
         return True
 
     def _start_logging(self):
@@ -685,17 +683,27 @@ class Logger(QtGui.QMainWindow):
             self._update_log('Initialization failed')
             return
 
-        self._seconds_from_logging = time.time()
+        sink = self._file_writer.sink
+        if sink.recovered is not None and sink.started is not None:
+            # total_seconds continues from the unfinished session
+            self._seconds_from_logging = sink.started
+            if self._constants_mode is None:
+                self._constants_mode = sink.mode
+            self._update_log('Resuming unfinished session started @ %s' % (
+                format_timestamp(self._seconds_from_logging)))
+        else:
+            # set by open(), except for a rotating log before its first
+            # segment
+            if sink.started is None:
+                sink.started = time.time()
+            self._seconds_from_logging = sink.started
+        self._file_writer.start()
         self._toggle_logging()
         if not self._is_load_on:
             self._load_on()
 
-        if self._display_logger.interval() >= 500:
-            self._display_logger.start()
-
-            self._display_logger.start()
-        if self._file_logger.interval() >= 500:
-            self._file_logger.start()
+        self._acquisition.reset()
+        self._update_acquisition()
 
         self._file_log_edit.setEnabled(False)
         self._file_log_button.setEnabled(False)
@@ -704,13 +712,14 @@ class Logger(QtGui.QMainWindow):
     
     def _stop_logging(self):
         self._toggle_logging()
-        if self._file_obj is not None:
-            self._file_obj.close()
+        if self._file_writer is not None:
+            self._file_writer.stop()
+            log.info('File sink: %s' % (str(self._file_writer.metrics()),))
+            self._file_writer = None
 
         self._file_log_edit.setEnabled(True)
         self._file_log_button.setEnabled(True)
-        self._display_logger.stop()
-        self._file_logger.stop()
+        self._update_acquisition()
 
         self._logging_status_label.setText('Logging: inactive')
         self._update_log('logging stopped @ %s' % (str(datetime.datetime.now())))
@@ -721,23 +730,19 @@ class Logger(QtGui.QMainWindow):
         self._is_logging_active = not self._is_logging_active
 
     def _load_on(self):
-        self._queue.put(('turn_load_on',))
+        self._send_request(('turn_load_on',))
 
     def _load_off(self):
-        self._queue.put(('turn_load_off',))
+        self._send_request(('turn_load_off',))
 
     def _update_log_file_interval(self):
         try:
             new_interval_value = float(self._log_file_interval_edit.text())
             self._file_log_interval = new_interval_value
 
-            if new_interval_value < 0.5:
-                self._file_logger.stop()
-                self._update_log('File log interval is too low, minimum allowed value is 0.5 second.')
-            else:
-                self._file_logger.setInterval(new_interval_value * 1000)
-                if not self._file_logger.isActive() and self._is_logging_active:
-                    self._file_logger.start()
+            if new_interval_value <= 0:
+                self._update_log('File log interval must be positive, file logging is off.')
+            self._update_acquisition()
 
             self._save_user_preferences()
         except:
@@ -748,14 +753,9 @@ class Logger(QtGui.QMainWindow):
         try:
             new_interval_value = float(self._log_display_interval_edit.text())
             self._display_interval = new_interval_value
-            if new_interval_value < 0.5:
-                self._display_logger.stop()
-                self._update_log('Display log interval is too low, minimum allowed value is 0.5 second.')
-            else:
-                self._display_logger.setInterval(new_interval_value * 1000)
-                    
-                if not self._display_logger.isActive() and self._is_logging_active:
-                    self._display_logger.start()
+            if new_interval_value <= 0:
+                self._update_log('Display log interval must be positive, display is off.')
+            self._update_acquisition()
 
             self._save_user_preferences()
         except:
@@ -775,17 +775,64 @@ class Logger(QtGui.QMainWindow):
             obj = str(self._constants_combobox.itemData(idx).toString())
             val = str(self._constants_value_edit.text())
             payload = ('set_constants_values', (obj, val,),)
-            self._queue.put(payload)
+            self._send_request(payload)
 
         except:
             log.exception('Failed to update constants settings')
             self._update_log('Failed to update "%s"' % (obj_full_name,))
   
-    def _request_display_data(self):
-        self._queue.put(('get_input_data', 'display',))
+    def _update_acquisition(self):
+        """ subscribe display and file log with their intervals, intervals
+            <= 0 switch a receiver off, and let the worker sample at the
+            shortest interval while logging
+
+        """
+        receivers = (
+            ('display', self._display_interval, self._on_get_display_input_data),
+            ('file', self._file_log_interval, self._on_get_file_input_data),
+        )
+        for name, interval, callback in receivers:
+            if interval <= 0:
+                self._acquisition.unsubscribe(name)
+            else:
+                self._acquisition.subscribe(name, interval, callback)
+
+        base_interval = self._acquisition.interval()
+        if not self._is_logging_active:
+            base_interval = None
+        if base_interval == self._sampling_interval:
+            return
+        if base_interval is None:
+            request = ('stop_sampling',)
+        else:
+            request = ('start_sampling', base_interval,)
+        # never dropped, not even by a full queue, see scheduler.py
+        self._send_request(request)
+        self._sampling_interval = base_interval
+        if base_interval is None:
+            self._sampler_status_label.setText('Sampling: inactive')
+
+    def _send_request(self, request):
+        """ hand request over to the worker, never blocks the GUI thread
+
+            Poll requests that do not fit are dropped silently, their timer
+            repeats them anyway; safety requests and starting and stopping
+            sampling always fit.
+        """
+        if not self._queue.offer(request) and priority_of(request) == CONFIGURATION:
+            self._update_log('Worker is busy, request "%s" was dropped' % (request[0],))
+        self._update_queue_status_label()
+
+    def _update_queue_status_label(self):
+        self._queue_status_label.setText(
+            'Requests dropped: %(dropped)d, merged: %(merged)d, delayed: %(delayed)d' % \
+                self._queue.counters())
 
-    def _request_file_data(self):
-        self._queue.put(('get_input_data', 'file',))
+    def _on_sampler_stats(self, stats):
+        achieved = stats['achieved_hz'] or 0
+        requested = stats['requested_hz']
+        self._sampler_status_label.setText('Sampling: %.1f/%s Hz, missed: %d' % (
+            achieved, '%.1f' % requested if requested else 'max', stats['missed']))
 
     def _update_log(self, log_text=''):
         try:
@@ -810,48 +857,34 @@ class Logger(QtGui.QMainWindow):
         self._load_on_button.setDisabled(load_on)
         self._load_off_button.setEnabled(load_on)
 
-    def _on_get_display_input_data(self, in_val):
-        if not in_val or in_val is None:
+    def _on_get_display_input_data(self, sample):
+        if sample is None:
             for reading_obj in self._reading_fields.values():
                 reading_obj['edit_obj'].setText('-')
             return
 
         try:
-            for key, val in in_val.items():
-                self._reading_fields[key]['edit_obj'].setText(str(val))
+            self._reading_fields['input_voltage']['edit_obj'].setText(str(sample.voltage))
+            self._reading_fields['input_current']['edit_obj'].setText(str(sample.current))
+            self._reading_fields['input_power']['edit_obj'].setText(str(sample.power))
         except:
-            if not TEST_MODE_STATUS:
-                log.exception('Failed to update display fields with data %s' % (str(in_val)))
+            log.exception('Failed to update display fields with data %s' % (str(sample)))
 
-    def _on_get_file_input_data(self, in_val):
-        log_data = {}
-        if in_val is None or not in_val:
+    def _on_get_file_input_data(self, sample):
+        if sample is None or self._file_writer is None:
             return
 
-        now = datetime.datetime.now()
-        current_date = now.strftime('%Y-%m-%d %H:%M:%S')
-       
         try:
-            total_seconds = int(time.time() - self._seconds_from_logging)
-            voltage = in_val.get('input_voltage')
-            power = in_val.get('input_power')
-            current = in_val.get('input_current')       
-
-            log_data['timestamp'] = current_date
-            log_data['voltage'] = voltage
-            log_data['power'] = power
-            log_data['current'] = current
-            log_data['mode'] = self._constants_mode
-            log_data['total_seconds'] = total_seconds
+            if not self._file_writer.write(sample, self._constants_mode):
+                log.error('File sink is falling behind, sample dropped')
+            current_date = format_timestamp(sample.wall_time)
 
             display_log_text = '%s: mode: %s, voltage: %s V, power: %s W, current: %s A' % \
-                (current_date, str(self._constants_mode).upper(), voltage, power, current)
-
-            self._csv_obj.writerow(log_data)
+                (current_date, str(self._constants_mode).upper(), sample.voltage,
+                    sample.power, sample.current)
             self._update_log(display_log_text)
         except:
-            if not TEST_MODE_STATUS:
-                log.exception('Failed to update file log')    
+            log.exception('Failed to update file log')
 
     def _on_get_constants_data(self, in_val):
         bold_font_enabled = QtGui.QFont()
@@ -881,9 +914,6 @@ class Logger(QtGui.QMainWindow):
                     log.exception('Got unexpected exception on getting contants data')
                 log.exception('Failed to fill new constant data')
 
-    def _on_constant_mode_changed(self):
-        self._queue.put(('get_constants_values',))
-
 if __name__ == '__main__':
     app = QtGui.QApplication(sys.argv)
     dc_logger = Logger()
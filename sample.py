@@ -0,0 +1,35 @@
+'''
+Input value sample as delivered by DCLoad.GetSample.
+'''
+
+
+class Sample(object):
+    """ one reading of the load's input
+
+        voltage_raw, current_raw, power_raw: counts as sent by the load
+            (mV, 0.1 mA, mW)
+        voltage, current, power: the same in V, A, W
+        op_state, demand_state: operation and demand state registers
+        timestamp: clock.monotonic() when the reading was received
+        wall_time: time.time() when the reading was received
+    """
+
+    __slots__ = ('voltage_raw', 'current_raw', 'power_raw', 'voltage', 'current',
+        'power', 'op_state', 'demand_state', 'timestamp', 'wall_time',)
+
+    def __init__(self, voltage_raw, current_raw, power_raw, voltage, current, power,
+            op_state, demand_state, timestamp, wall_time):
+        self.voltage_raw = voltage_raw
+        self.current_raw = current_raw
+        self.power_raw = power_raw
+        self.voltage = voltage
+        self.current = current
+        self.power = power
+        self.op_state = op_state
+        self.demand_state = demand_state
+        self.timestamp = timestamp
+        self.wall_time = wall_time
+
+    def __repr__(self):
+        return 'Sample(voltage=%r, current=%r, power=%r, op_state=0x%02x, demand_state=0x%04x, timestamp=%r)' % (
+            self.voltage, self.current, self.power, self.op_state, self.demand_state, self.timestamp)
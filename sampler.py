@@ -0,0 +1,92 @@
+'''
+Drift free sampling schedule.
+
+PrecisionSampler keeps the deadlines of a fixed rate acquisition on the
+monotonic clock: the n-th sample is due at start + n * interval, however
+long the individual reads take, so errors do not accumulate the way they
+do with a timer restarted after every tick.  A read that starts late is
+only late; deadlines that passed entirely while the link was busy are
+skipped and counted as missed.  An interval of 0 samples back to back, as
+fast as the link allows.
+
+The sampler does not own a thread.  The thread that owns the link asks
+it how long it may wait for other work (timeout()) and lets it time the
+read once the sample is due (take()):
+
+    sampler = PrecisionSampler(0.05)
+    while running:
+        if sampler.timeout() <= 0:
+            sampler.take(load.GetSample)
+        else:
+            ... other work, at most timeout() seconds ...
+'''
+
+from clock import monotonic
+
+
+class PrecisionSampler(object):
+    def __init__(self, interval, clock=monotonic):
+        self.interval = interval
+        self._clock = clock
+        self.reset()
+
+    def reset(self):
+        self.next_due = None
+        self.first = None
+        self.last = None
+        self.samples = 0
+        self.missed = 0
+        self.max_lateness = 0.0
+
+    def timeout(self):
+        """ @return seconds until the next sample is due, <= 0 if it is due
+
+        """
+        if self.next_due is None:
+            return 0
+        return self.next_due - self._clock()
+
+    def take(self, read):
+        """ call read() for the sample that is due and schedule the next one
+
+            @return the result of read()
+        """
+        started = self._clock()
+        if self.next_due is None:
+            self.first = self.next_due = started
+        lateness = started - self.next_due
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+        self.last = started
+        self.samples += 1
+        try:
+            return read()
+        finally:
+            self._advance(self._clock())
+
+    def _advance(self, now):
+        if self.interval <= 0:
+            self.next_due = now
+            return
+        self.next_due += self.interval
+        if now >= self.next_due + self.interval:
+            skipped = int((now - self.next_due) / self.interval)
+            self.missed += skipped
+            self.next_due += skipped * self.interval
+
+    def achieved_rate(self):
+        """ @return samples per second since the first sample, None before the second
+
+        """
+        if self.samples < 2 or self.last <= self.first:
+            return None
+        return (self.samples - 1) / (self.last - self.first)
+
+    def stats(self):
+        return {
+            'requested_hz': 1.0 / self.interval if self.interval > 0 else None,
+            'achieved_hz': self.achieved_rate(),
+            'samples': self.samples,
+            'missed': self.missed,
+            'max_lateness_ms': self.max_lateness * 1e3,
+        }
@@ -0,0 +1,205 @@
+'''
+Request queue between the GUI and DCLoggerWorker.
+
+CommandQueue is a drop-in Queue for the worker's request tuples
+(command,) / (command, value) that hands them out by priority class
+instead of arrival order:
+
+    SAFETY          load on/off, remote/local control
+    CONFIGURATION   constant mode values
+    FILE            input values for the log file or the shared stream
+    DISPLAY         input values for the display
+
+Safety requests are never refused for lack of space and always go
+next, so a "turn load off" waits at most for the transaction in flight.
+Starting and stopping sampling is never refused either, it is not
+repeated by a timer like a poll request, but waits its turn.
+Every request gets a deadline (the time it was queued plus the budget of
+its class); among the other classes a request past its deadline goes
+before the ones still in time, so a busy display cannot starve file
+sampling.  A read that is already pending is not queued a second time,
+the duplicate is merged into it and counted in merged.
+
+offer() is the non-blocking way in for the GUI thread.  When the queue
+is full, a request may evict a pending poll request of a lower class
+(display first, then file).  If there is nothing to evict, the request
+itself is dropped.  Dropped, merged and delayed (served after their
+deadline) requests are counted, see counters().
+'''
+
+import heapq
+from Queue import Queue, Full
+from itertools import count
+
+from clock import monotonic
+
+SAFETY = 0
+CONFIGURATION = 1
+FILE = 2
+DISPLAY = 3
+PRIORITY_NAMES = ('safety', 'configuration', 'file', 'display')
+
+COMMAND_PRIORITIES = {
+    'turn_load_off': SAFETY,
+    'turn_load_on': SAFETY,
+    'set_local_control': SAFETY,
+    'set_remote_control': SAFETY,
+    'set_constants_values': CONFIGURATION,
+    'get_constants_values': CONFIGURATION,
+    'start_sampling': CONFIGURATION,
+    'stop_sampling': CONFIGURATION,
+    # engine.STOP_REQUEST, after everything else that is pending
+    'stop_engine': DISPLAY,
+}
+INPUT_DATA_PRIORITIES = {
+    'acquisition': FILE,
+    'file': FILE,
+    'display': DISPLAY,
+}
+# seconds a request of each class may wait before it is overdue
+DEADLINES = (0.5, 1.0, 1.0, 2.0)
+# classes whose pending requests offer() may drop to make room
+EVICTABLE = (DISPLAY, FILE)
+# requests that only read; duplicates of a pending one are merged
+READ_COMMANDS = ('get_input_data', 'get_constants_values')
+# requests of other classes than SAFETY that are never refused for lack
+# of space
+ALWAYS_QUEUED = ('start_sampling', 'stop_sampling')
+
+
+def priority_of(msg):
+    cmd = msg[0]
+    if cmd == 'get_input_data':
+        return INPUT_DATA_PRIORITIES.get(msg[1] if len(msg) > 1 else None, DISPLAY)
+    return COMMAND_PRIORITIES.get(cmd, CONFIGURATION)
+
+
+def always_fits(msg):
+    """ @return True if msg is queued even when the queue is full
+
+    """
+    return priority_of(msg) == SAFETY or msg[0] in ALWAYS_QUEUED
+
+
+class CommandQueue(Queue):
+    def __init__(self, maxsize=0):
+        Queue.__init__(self, maxsize)
+        self.merged = 0
+        self.dropped = 0
+        self.delayed = 0
+
+    def _init(self, maxsize):
+        # per class heap of (deadline, sequence number, request)
+        self._pending = [[] for name in PRIORITY_NAMES]
+        self._reads = set()
+        self._sequence = count()
+
+    def _qsize(self, len=len):
+        return sum(len(pending) for pending in self._pending)
+
+    def put(self, item, block=True, timeout=None):
+        """ queue the request item, see Queue.put
+
+            Requests that always_fit() and duplicates of pending reads
+            never block nor raise Full.
+        """
+        with self.not_full:
+            if item in self._reads:
+                self.merged += 1
+                return
+
+            if self.maxsize > 0 and not always_fits(item):
+                if not block:
+                    if self._qsize() >= self.maxsize:
+                        raise Full
+                elif timeout is None:
+                    while self._qsize() >= self.maxsize:
+                        self.not_full.wait()
+                elif timeout < 0:
+                    raise ValueError("'timeout' must be a non-negative number")
+                else:
+                    deadline = monotonic() + timeout
+                    while self._qsize() >= self.maxsize:
+                        remaining = deadline - monotonic()
+                        if remaining <= 0:
+                            raise Full
+                        self.not_full.wait(remaining)
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def offer(self, item):
+        """ queue the request item without ever blocking
+
+            @return False if item was dropped because the queue is full
+        """
+        with self.mutex:
+            if item in self._reads:
+                self.merged += 1
+                return True
+
+            if self.maxsize > 0 and not always_fits(item) and self._qsize() >= self.maxsize:
+                if not self._evict(priority_of(item)):
+                    self.dropped += 1
+                    return False
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+            return True
+
+    def _evict(self, priority):
+        for evictable in EVICTABLE:
+            pending = self._pending[evictable]
+            if evictable > priority and pending:
+                deadline, sequence, item = heapq.heappop(pending)
+                self._reads.discard(item)
+                # never handed out, so never marked done
+                self.unfinished_tasks -= 1
+                self.dropped += 1
+                return True
+        return False
+
+    def _put(self, item):
+        priority = priority_of(item)
+        heapq.heappush(self._pending[priority],
+            (monotonic() + DEADLINES[priority], next(self._sequence), item))
+        if item[0] in READ_COMMANDS:
+            self._reads.add(item)
+
+    def _get(self):
+        selected = None
+        if self._pending[SAFETY]:
+            selected = self._pending[SAFETY]
+        else:
+            now = monotonic()
+            for pending in self._pending[SAFETY + 1:]:
+                if not pending:
+                    continue
+                if selected is None:
+                    selected = pending
+                # the most overdue request first
+                if pending[0][0] <= now and pending[0][0] < selected[0][0]:
+                    selected = pending
+        deadline, sequence, item = heapq.heappop(selected)
+        self._reads.discard(item)
+        if deadline < monotonic():
+            self.delayed += 1
+        return item
+
+    def pending(self):
+        """ @return number of queued requests per class name
+
+        """
+        with self.mutex:
+            return dict(zip(PRIORITY_NAMES, (len(pending) for pending in self._pending)))
+
+    def counters(self):
+        """ @return dict of the dropped, merged and delayed request counts
+
+        """
+        with self.mutex:
+            return {
+                'dropped': self.dropped,
+                'merged': self.merged,
+                'delayed': self.delayed,
+            }
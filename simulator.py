@@ -0,0 +1,351 @@
+'''
+In-process simulation of B&K 85xx DC loads.
+
+SimulatedSerial stands in for serial.Serial under InstrumentInterface.sp
+and answers the real 26 byte protocol: checksums are verified, set
+commands are answered with 0x12 status frames (0x80 OK, 0x90 wrong
+checksum, 0xA0 bad parameter, 0xB0 not possible, 0xC0 invalid command)
+and queries return the stored mode and setpoints.  Input values come
+from a simple source model (open circuit voltage behind an internal
+resistance) loaded according to the active constant mode.
+
+Timing follows the line: every byte costs 10 bit times at the selected
+baud rate in both directions and each response is delayed by a fixed
+instrument latency, so read() blocks just like the real port does.
+Several SimulatedLoad objects with different addresses can share one
+SimulatedSerial to model a multi-drop bus.  A noisy line is modelled by
+junk_probability (junk bytes before a response) and drop_probability (a
+response loses one byte).
+
+    load = DCLoad()
+    load.sp = SimulatedSerial(baudrate=38400)
+    load.SetRemoteControl()
+'''
+
+import math
+import time
+import random
+import threading
+
+import codec
+
+DEFAULT_LATENCY = 0.005
+DEFAULT_READ_TIMEOUT = 2
+# bits on the wire per byte: start bit, 8 data bits, stop bit
+BITS_PER_BYTE = 10
+
+STATUS_WRONG_CHECKSUM = 0x90
+STATUS_BAD_PARAMETER = 0xA0
+STATUS_NOT_POSSIBLE = 0xB0
+STATUS_INVALID_COMMAND = 0xC0
+
+# set command -> number of bytes of its integer argument; the matching
+# query is always the next command byte
+SETTINGS = {
+    0x22: 4,  # max voltage, mV
+    0x24: 4,  # max current, 0.1 mA
+    0x26: 4,  # max power, mW
+    0x28: 1,  # mode
+    0x2A: 4,  # CC current, 0.1 mA
+    0x2C: 4,  # CV voltage, mV
+    0x2E: 4,  # CW power, mW
+    0x30: 4,  # CR resistance, mohm
+    0x4E: 4,  # battery test voltage, mV
+    0x50: 2,  # load on timer, s
+    0x52: 1,  # load on timer state
+    0x56: 1,  # remote sense
+    0x58: 1,  # trigger source
+    0x5D: 1,  # function
+}
+TRANSIENT_SETTINGS = (0x32, 0x34, 0x36, 0x38)
+# commands carried out regardless of remote control
+ALWAYS_ALLOWED = (0x20, 0x55)
+
+CMD_REMOTE_CONTROL = 0x20
+CMD_LOAD_ON = 0x21
+CMD_MODE = 0x28
+CMD_COMMUNICATION_ADDRESS = 0x54
+CMD_LOCAL_CONTROL = 0x55
+CMD_TRIGGER = 0x5A
+CMD_SAVE = 0x5B
+CMD_RECALL = 0x5C
+CMD_INPUT_VALUES = 0x5F
+CMD_PRODUCT_INFORMATION = 0x6A
+
+MODE_CC, MODE_CV, MODE_CW, MODE_CR = range(4)
+MODE_SETPOINTS = {
+    MODE_CC: 0x2A,
+    MODE_CV: 0x2C,
+    MODE_CW: 0x2E,
+    MODE_CR: 0x30,
+}
+HIGHEST_REGISTER = 25
+
+
+class SimulatedLoad(object):
+    """ state machine of one instrument: frames in, response frames out
+
+    """
+
+    def __init__(self, address=0, source_voltage=12.0, source_resistance=0.05,
+            noise=0.001, model='8500', serial_number='SIM0000001', firmware=(1, 0)):
+        self.address = address
+        self.source_voltage = source_voltage
+        self.source_resistance = source_resistance
+        self.noise = noise
+        self.model = model
+        self.serial_number = serial_number
+        self.firmware = firmware
+        self.remote = False
+        self.load_on = False
+        self.local_control = True
+        self.settings = {
+            0x22: 120000,
+            0x24: 300000,
+            0x26: 300000,
+            0x28: MODE_CC,
+            0x2A: 0,
+            0x2C: 0,
+            0x2E: 0,
+            0x30: 1000000,
+            0x4E: 0,
+            0x50: 0,
+            0x52: 0,
+            0x56: 0,
+            0x58: 0,
+            0x5D: 0,
+        }
+        self.transients = dict((cmd, '\0' * 13) for cmd in TRANSIENT_SETTINGS)
+        self.registers = {}
+
+    def handle(self, frame):
+        """ @return response frame, None if the frame is not addressed to us
+
+        """
+        start, address, command, first = codec.decode_header(frame)
+        if address != self.address:
+            return None
+        if codec.checksum(frame) != ord(frame[-1]):
+            return self._status(STATUS_WRONG_CHECKSUM)
+
+        query = command - 1
+        if command in SETTINGS or command in TRANSIENT_SETTINGS or \
+                command in (CMD_LOAD_ON, CMD_COMMUNICATION_ADDRESS, CMD_TRIGGER,
+                    CMD_SAVE, CMD_RECALL):
+            if not self.remote:
+                return self._status(STATUS_NOT_POSSIBLE)
+            return self._status(self._set(command, frame))
+        elif command in ALWAYS_ALLOWED:
+            return self._status(self._set(command, frame))
+        elif query in SETTINGS:
+            return self._reply(command, codec.encode_little_endian(
+                self.settings[query], SETTINGS[query]))
+        elif query in TRANSIENT_SETTINGS:
+            return self._reply(command, self.transients[query])
+        elif command == CMD_INPUT_VALUES:
+            return self._reply(command, self._input_values())
+        elif command == CMD_PRODUCT_INFORMATION:
+            return self._reply(command, self._product_information())
+        return self._status(STATUS_INVALID_COMMAND)
+
+    def _set(self, command, frame):
+        if command in TRANSIENT_SETTINGS:
+            self.transients[command] = frame[3:16]
+            return codec.STATUS_OK
+
+        if command in SETTINGS:
+            value = codec.decode_integer(frame, SETTINGS[command])
+        else:
+            value = codec.decode_integer(frame, 1)
+
+        if command == CMD_REMOTE_CONTROL:
+            self.remote = bool(value)
+        elif command == CMD_LOCAL_CONTROL:
+            self.local_control = bool(value)
+        elif command == CMD_LOAD_ON:
+            self.load_on = bool(value)
+        elif command == CMD_MODE:
+            if value not in MODE_SETPOINTS:
+                return STATUS_BAD_PARAMETER
+            self.settings[command] = value
+        elif command == CMD_COMMUNICATION_ADDRESS:
+            self.address = value
+        elif command == CMD_TRIGGER:
+            pass
+        elif command in (CMD_SAVE, CMD_RECALL):
+            if not 1 <= value <= HIGHEST_REGISTER:
+                return STATUS_BAD_PARAMETER
+            if command == CMD_SAVE:
+                self.registers[value] = dict(self.settings)
+            elif value in self.registers:
+                self.settings.update(self.registers[value])
+            else:
+                return STATUS_NOT_POSSIBLE
+        elif command == 0x2A and value > self.settings[0x24] or \
+                command == 0x2C and value > self.settings[0x22] or \
+                command == 0x2E and value > self.settings[0x26]:
+            return STATUS_BAD_PARAMETER
+        else:
+            self.settings[command] = value
+        return codec.STATUS_OK
+
+    def operating_point(self):
+        """ @return (voltage V, current A) of the simulated source and load
+
+        """
+        v0 = self.source_voltage
+        r = self.source_resistance
+        if not self.load_on:
+            return v0, 0.0
+
+        mode = self.settings[CMD_MODE]
+        setpoint = self.settings[MODE_SETPOINTS[mode]]
+        if mode == MODE_CC:
+            current = setpoint / 1e4
+        elif mode == MODE_CV:
+            current = max(0.0, (v0 - setpoint / 1e3) / r)
+        elif mode == MODE_CW:
+            power = setpoint / 1e3
+            discriminant = v0 * v0 - 4 * r * power
+            # beyond the maximum power point the source collapses
+            current = v0 / (2 * r) if discriminant < 0 else \
+                (v0 - math.sqrt(discriminant)) / (2 * r)
+        else:
+            current = v0 / (r + max(setpoint / 1e3, 1e-3))
+
+        current = min(current, self.settings[0x24] / 1e4, v0 / r)
+        return max(0.0, v0 - current * r), current
+
+    def _input_values(self):
+        voltage, current = self.operating_point()
+        if self.noise:
+            voltage *= 1 + random.uniform(-self.noise, self.noise)
+            current *= 1 + random.uniform(-self.noise, self.noise)
+        op_state = 0x08 if self.load_on else 0
+        return codec.encode_little_endian(voltage * 1e3) + \
+            codec.encode_little_endian(current * 1e4) + \
+            codec.encode_little_endian(voltage * current * 1e3) + \
+            chr(op_state) + codec.encode_little_endian(0, 2)
+
+    def _product_information(self):
+        return self.model[:5].ljust(5, '\0') + chr(self.firmware[1]) + \
+            chr(self.firmware[0]) + self.serial_number[:10].ljust(10, '\0')
+
+    def _status(self, status):
+        return self._reply(codec.STATUS_COMMAND, chr(status))
+
+    def _reply(self, command, data):
+        body = chr(codec.START_BYTE) + chr(self.address) + chr(command) + data
+        body += '\0' * (codec.LENGTH_PACKET - 1 - len(body))
+        return body + chr(codec.checksum(body))
+
+
+class SimulatedSerial(object):
+    """ serial.Serial look-alike connected to simulated instruments
+
+        @param loads: SimulatedLoad objects on the line, one at address 0
+                      when omitted
+        @param baudrate: line speed used for transfer times, None for an
+                         infinitely fast line
+        @param latency: processing delay of the instrument, seconds
+        @param junk_probability: chance of 1-5 junk bytes before a response
+        @param drop_probability: chance of a response losing one byte
+    """
+
+    def __init__(self, loads=None, baudrate=38400, latency=DEFAULT_LATENCY,
+            timeout=DEFAULT_READ_TIMEOUT, junk_probability=0, drop_probability=0):
+        self.loads = list(loads) if loads is not None else [SimulatedLoad()]
+        self.baudrate = baudrate
+        self.latency = latency
+        self.timeout = timeout
+        self.junk_probability = junk_probability
+        self.drop_probability = drop_probability
+        self.port = 'SIM'
+        self._is_open = True
+        self._input = ''
+        # (time the data is fully received, data)
+        self._output = []
+        # time the line is free to transmit the next response
+        self._line_free = 0
+        self._condition = threading.Condition()
+
+    def _transfer_time(self, num_bytes):
+        if not self.baudrate:
+            return 0
+        return num_bytes * BITS_PER_BYTE / float(self.baudrate)
+
+    def open(self):
+        self._is_open = True
+
+    def close(self):
+        self._is_open = False
+
+    def isOpen(self):
+        return self._is_open
+
+    def inWaiting(self):
+        now = time.time()
+        with self._condition:
+            return sum(len(data) for ready, data in self._output if ready <= now)
+
+    def flushInput(self):
+        with self._condition:
+            self._output = []
+
+    def flushOutput(self):
+        with self._condition:
+            self._input = ''
+
+    def write(self, data):
+        if not self._is_open:
+            raise IOError('Port is closed')
+        now = time.time()
+        with self._condition:
+            self._input += data
+            received = now + self._transfer_time(len(data))
+            while len(self._input) >= codec.LENGTH_PACKET:
+                frame = self._input[:codec.LENGTH_PACKET]
+                self._input = self._input[codec.LENGTH_PACKET:]
+                for load in self.loads:
+                    response = load.handle(frame)
+                    if response is not None:
+                        response = self._add_noise(response)
+                        start = max(received + self.latency, self._line_free)
+                        self._line_free = start + self._transfer_time(len(response))
+                        self._output.append((self._line_free, response))
+            self._condition.notify_all()
+        return len(data)
+
+    def _add_noise(self, response):
+        if self.junk_probability and random.random() < self.junk_probability:
+            junk = ''.join(chr(random.randint(0, 255)) for i in xrange(random.randint(1, 5)))
+            response = junk + response
+        if self.drop_probability and random.random() < self.drop_probability:
+            lost = random.randint(0, len(response) - 1)
+            response = response[:lost] + response[lost + 1:]
+        return response
+
+    def read(self, size=1):
+        if not self._is_open:
+            raise IOError('Port is closed')
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        data = ''
+        with self._condition:
+            while len(data) < size:
+                now = time.time()
+                if self._output and self._output[0][0] <= now:
+                    ready, chunk = self._output.pop(0)
+                    missing = size - len(data)
+                    if len(chunk) > missing:
+                        self._output.insert(0, (ready, chunk[missing:]))
+                        chunk = chunk[:missing]
+                    data += chunk
+                    continue
+
+                if deadline is not None and now >= deadline:
+                    break
+                wake = deadline
+                if self._output:
+                    wake = self._output[0][0] if wake is None else min(wake, self._output[0][0])
+                self._condition.wait(None if wake is None else max(0, wake - now))
+        return data
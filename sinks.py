@@ -0,0 +1,547 @@
+'''
+Destinations of logged samples.
+
+CsvSink appends one row per Sample to a CSV file with the columns of
+DEFAULT_FILE_LOG_STRUCT; a new or empty file gets the header row first.
+total_seconds counts from the start of the logging session.
+
+    sink = CsvSink('dc_load_log.csv')
+    sink.open()
+    sink.write(sample, 'cc')
+    sink.close()
+
+BackgroundSink moves all formatting and disk I/O of a sink to a thread
+of its own.  write() only queues the sample; the thread writes whatever
+has accumulated as one batch and flushes, and optionally fsyncs, every
+flush_rows rows or flush_interval seconds and when stopped, which bounds
+the data lost in a crash.  metrics() reports rows, batches, flushes and
+the write and end-to-end latencies.
+
+    writer = BackgroundSink(CsvSink('dc_load_log.csv'), flush_rows=100)
+    writer.start()
+    writer.write(sample, 'cc')
+    writer.stop()
+
+RotatingSink splits the log into numbered segments, dc_load_log.0001.csv,
+dc_load_log.0002.csv, ..., each a complete file with its own header.  A
+segment is closed once it reaches max_bytes or max_rows or a sample
+crosses the next hourly ('H') or daily ('D') boundary of local time; the
+sample that triggers the rollover is the first of the next segment.
+dc_load_log.manifest.json lists the segments with their row counts and
+the wall times of their first and last rows.
+
+    writer = BackgroundSink(RotatingSink('dc_load_log.csv', max_bytes=100 * 1024 * 1024))
+
+A log named *.csv.gz is compressed by the sink thread, one gzip member
+per flush (see compress.py).
+'''
+
+import os
+import csv
+import json
+import time
+import logging
+import threading
+from Queue import Queue, Full, Empty
+
+from clock import monotonic
+from compress import GzipBlockFile, GZIP_EXTENSION, recover as recover_compressed
+
+log = logging.getLogger('dc_logger')
+
+DEFAULT_FILE_LOG_STRUCT = ('timestamp', 'voltage', 'power', 'current', 'mode', 'total_seconds',)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+DEFAULT_FLUSH_ROWS = 100
+# seconds
+DEFAULT_FLUSH_INTERVAL = 1.0
+# samples waiting for the sink thread before new ones are dropped
+DEFAULT_MAX_PENDING = 100000
+# rows written with one write_many() call at most
+MAX_BATCH = 1000
+# RotatingSink rollover boundaries
+ROTATE_WHEN = ('H', 'D')
+MANIFEST_SUFFIX = '.manifest.json'
+# bytes read from the end of a log that lost rows known to be complete
+RECOVERY_TAIL = 64 * 1024
+
+
+def format_timestamp(wall_time):
+    return time.strftime(TIMESTAMP_FORMAT, time.localtime(wall_time))
+
+
+def atomic_write(filename, data, fsync=False):
+    """ replace filename with data, atomically: a reader, or a crash, finds
+        the old content or the new one, never a part of it
+
+        @param fsync: make sure data reached the disk before the rename
+    """
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as temp_file:
+        temp_file.write(data)
+        if fsync:
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+    try:
+        os.rename(temp_filename, filename)
+    except OSError:
+        # rename does not replace an existing file on Windows
+        os.remove(filename)
+        os.rename(temp_filename, filename)
+
+
+class CsvSink(object):
+    # header row of a new log
+    header = DEFAULT_FILE_LOG_STRUCT
+
+    def __init__(self, filename, started=None):
+        """ @param started: wall time total_seconds counts from, the time of
+                            open() when omitted
+
+        """
+        self.filename = filename
+        self.started = started
+        self.rows = 0
+        self._file_obj = None
+        self._csv_obj = None
+
+    def open(self):
+        if self.filename.endswith(GZIP_EXTENSION):
+            # a gzip member per flush, see compress.py
+            self._file_obj = GzipBlockFile(self.filename)
+        else:
+            # binary mode, the csv module writes its own line endings
+            self._file_obj = open(self.filename, 'ab')
+            self._file_obj.seek(0, os.SEEK_END)
+        self._csv_obj = csv.writer(self._file_obj)
+        if os.path.getsize(self.filename) == 0:
+            self._csv_obj.writerow(self.header)
+        if self.started is None:
+            self.started = time.time()
+
+    def is_open(self):
+        return self._file_obj is not None
+
+    def tell(self):
+        """ @return size of the file including the rows not flushed yet
+
+        """
+        return self._file_obj.tell()
+
+    def recover(self, offset):
+        """ cut a torn row off the end of the log, reading only what follows
+            offset, the end of a row known to be complete
+
+            @return number of complete rows after offset, None without a log
+        """
+        if not os.path.exists(self.filename):
+            return None
+        if self.filename.endswith(GZIP_EXTENSION):
+            rows = recover_compressed(self.filename, offset)
+            return rows - 1 if offset == 0 and rows else rows
+        size = os.path.getsize(self.filename)
+        if offset > size:
+            # rows before offset were lost, look for the last one in the tail
+            offset = max(0, size - RECOVERY_TAIL)
+        with open(self.filename, 'r+b') as file_obj:
+            file_obj.seek(offset)
+            tail = file_obj.read()
+            complete = tail.rfind('\n') + 1
+            if complete < len(tail):
+                log.warning('Cut a torn row off the end of %s' % (self.filename,))
+                file_obj.truncate(offset + complete)
+        rows = tail.count('\n', 0, complete)
+        if offset == 0 and rows:
+            # header row
+            rows -= 1
+        return rows
+
+    def row(self, sample, mode):
+        """ @return the row of sample, in the order of DEFAULT_FILE_LOG_STRUCT
+
+        """
+        return (format_timestamp(sample.wall_time), sample.voltage, sample.power,
+            sample.current, mode, int(sample.wall_time - self.started),)
+
+    def write(self, sample, mode):
+        """ append the row of sample
+
+            @return the row written
+        """
+        row = self.row(sample, mode)
+        self._csv_obj.writerow(row)
+        self.rows += 1
+        return row
+
+    def write_many(self, items):
+        """ append the rows of (sample, mode) pairs with one call
+
+        """
+        self._csv_obj.writerows([self.row(sample, mode) for sample, mode in items])
+        self.rows += len(items)
+
+    def flush(self):
+        if self._file_obj is not None:
+            self._file_obj.flush()
+
+    def sync(self):
+        """ flush and make sure the data reached the disk
+
+        """
+        if self._file_obj is not None:
+            self._file_obj.flush()
+            os.fsync(self._file_obj.fileno())
+
+    def close(self):
+        if self._file_obj is not None:
+            self._file_obj.close()
+            self._file_obj = None
+            self._csv_obj = None
+
+
+def split_extension(filename):
+    """ os.path.splitext keeping the extension of a compressed log whole,
+        ('dc_load_log', '.csv.gz')
+
+    """
+    root, ext = os.path.splitext(filename)
+    if ext == GZIP_EXTENSION:
+        root, inner_ext = os.path.splitext(root)
+        ext = inner_ext + ext
+    return root, ext
+
+
+def next_boundary(wall_time, when):
+    """ @return wall time of the first full hour ('H') or midnight ('D')
+                of local time after wall_time
+
+    """
+    tm = time.localtime(wall_time)
+    if when == 'H':
+        return time.mktime((tm.tm_year, tm.tm_mon, tm.tm_mday, tm.tm_hour + 1, 0, 0, 0, 0, -1))
+    if when == 'D':
+        return time.mktime((tm.tm_year, tm.tm_mon, tm.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+    raise ValueError('Unknown rollover boundary: %s' % (when,))
+
+
+class RotatingSink(object):
+    """ sink writing numbered segments of filename through sink_class
+
+        @param max_bytes: roll over once a segment reached this size, 0 never
+        @param max_rows: roll over after this many rows, 0 never
+        @param when: roll over at every full hour 'H' or midnight 'D'
+        @param sink_class: sink of a segment, CsvSink or binlog.BinarySink
+
+        Segments of an earlier session are kept, the last one is appended
+        to until it is full.  total_seconds counts from started in all of
+        them.
+    """
+
+    def __init__(self, filename, max_bytes=0, max_rows=0, when=None, sink_class=CsvSink,
+            started=None):
+        if when is not None and when not in ROTATE_WHEN:
+            raise ValueError('Unknown rollover boundary: %s' % (when,))
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.when = when
+        self.sink_class = sink_class
+        self.started = started
+        self.rows = 0
+        self.manifest_filename = split_extension(filename)[0] + MANIFEST_SUFFIX
+        # {'file', 'rows', 'first', 'last'} per segment, oldest first
+        self.segments = []
+        self._sink = None
+        self._boundary = None
+        self._is_open = False
+        self._manifest_dirty = False
+
+    def segment_filename(self, number):
+        root, ext = split_extension(self.filename)
+        return '%s.%04d%s' % (root, number, ext)
+
+    def open(self):
+        """ read the manifest of an earlier session; the segment is opened
+            with the first row, once started is settled
+
+        """
+        self.segments = []
+        if os.path.exists(self.manifest_filename):
+            with open(self.manifest_filename, 'rb') as manifest_file:
+                self.segments = json.load(manifest_file)['segments']
+        self._is_open = True
+
+    def is_open(self):
+        return self._is_open
+
+    def tell(self):
+        """ @return [segment number, offset in it, rows in it], None before
+                    the first row
+
+        """
+        if self._sink is None:
+            return None
+        return [len(self.segments), self._sink.tell(), self.segments[-1]['rows']]
+
+    def recover(self, position):
+        """ recover the last segment, see CsvSink.recover
+
+            @param position: tell() result of the last checkpoint
+        """
+        self.open()
+        self._is_open = False
+        if not self.segments:
+            return None
+        segment = self.segments[-1]
+        filename = os.path.join(os.path.dirname(self.filename), segment['file'])
+        offset, rows = 0, 0
+        if position is not None and position[0] == len(self.segments):
+            offset, rows = position[1], position[2]
+        recovered = self.sink_class(filename).recover(offset)
+        if recovered is None:
+            return None
+        segment['rows'] = rows + recovered
+        self._manifest_dirty = True
+        self._write_manifest()
+        return recovered
+
+    def _open_segment(self, sample, new=False):
+        segment = self.segments[-1] if self.segments else None
+        if new or segment is None or self._is_full(segment, sample):
+            number = len(self.segments) + 1
+            segment = {'file': os.path.basename(self.segment_filename(number)),
+                'rows': 0, 'first': sample.wall_time, 'last': None}
+            self.segments.append(segment)
+            self._manifest_dirty = True
+            # the segment is found by recover() from now on
+            self._write_manifest()
+        directory = os.path.dirname(self.filename)
+        self._sink = self.sink_class(os.path.join(directory, segment['file']), self.started)
+        self._sink.open()
+        if self.started is None:
+            self.started = self._sink.started
+        self._boundary = None
+        if self.when is not None:
+            self._boundary = next_boundary(segment['first'], self.when)
+
+    def _is_full(self, segment, sample):
+        if self.max_rows and segment['rows'] >= self.max_rows:
+            return True
+        if self.when is not None and sample.wall_time >= next_boundary(segment['first'], self.when):
+            return True
+        if self.max_bytes:
+            filename = os.path.join(os.path.dirname(self.filename), segment['file'])
+            return os.path.exists(filename) and os.path.getsize(filename) >= self.max_bytes
+        return False
+
+    def _roll_over(self, sample):
+        """ @return True if sample belongs into a new segment
+
+        """
+        segment = self.segments[-1]
+        if self.max_rows and segment['rows'] >= self.max_rows:
+            return True
+        if self._boundary is not None and sample.wall_time >= self._boundary:
+            return True
+        return bool(self.max_bytes) and self._sink.tell() >= self.max_bytes
+
+    def _close_segment(self):
+        self._sink.close()
+        self._sink = None
+        self._write_manifest()
+
+    def write(self, sample, mode):
+        self.write_many([(sample, mode)])
+
+    def write_many(self, items):
+        """ write items in runs that fit the current segment, a rollover
+            falls between two samples
+
+        """
+        # the byte size is only known after a row was written
+        run_length = 1 if self.max_bytes else len(items)
+        start = 0
+        while start < len(items):
+            if self._sink is None:
+                self._open_segment(items[start][0])
+            elif self._roll_over(items[start][0]):
+                self._close_segment()
+                self._open_segment(items[start][0], True)
+            segment = self.segments[-1]
+            stop = start + 1
+            limit = min(len(items), start + run_length)
+            if self.max_rows:
+                limit = min(limit, start + max(1, self.max_rows - segment['rows']))
+            while stop < limit and (self._boundary is None or items[stop][0].wall_time < self._boundary):
+                stop += 1
+            run = items[start:stop]
+            self._sink.write_many(run)
+            segment['rows'] += len(run)
+            segment['last'] = run[-1][0].wall_time
+            self.rows += len(run)
+            self._manifest_dirty = True
+            start = stop
+
+    def _write_manifest(self):
+        if not self._manifest_dirty:
+            return
+        atomic_write(self.manifest_filename, json.dumps(
+            {'base': os.path.basename(self.filename), 'segments': self.segments}, indent=1))
+        self._manifest_dirty = False
+
+    def flush(self):
+        if self._sink is not None:
+            self._sink.flush()
+        self._write_manifest()
+
+    def sync(self):
+        if self._sink is not None:
+            self._sink.sync()
+        self._write_manifest()
+
+    def close(self):
+        if self._sink is not None:
+            self._close_segment()
+        self._write_manifest()
+        self._is_open = False
+
+
+class BackgroundSink(object):
+    """ runs a sink (open/write_many/flush/sync/close) in a thread of its own
+
+        @param flush_rows: flush after this many rows
+        @param flush_interval: flush at least every flush_interval seconds
+                               while rows are pending
+        @param fsync: sync() instead of flush(), rows survive a crash of
+                      the machine, not only of the process
+    """
+
+    def __init__(self, sink, flush_rows=DEFAULT_FLUSH_ROWS, flush_interval=DEFAULT_FLUSH_INTERVAL,
+            fsync=True, max_pending=DEFAULT_MAX_PENDING):
+        self.sink = sink
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        # (time queued, sample, mode), None ends the thread
+        self._pending = Queue(max_pending)
+        self._thread = None
+        self.dropped = 0
+        self.rows = 0
+        self.batches = 0
+        self.flushes = 0
+        self.errors = 0
+        self.max_write_latency = 0.0
+        self.total_write_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.max_row_latency = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if not self.sink.is_open():
+            self.sink.open()
+        self._thread = threading.Thread(target=self._run, name='BackgroundSink')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ write and flush everything queued, then close the sink
+
+        """
+        if self._thread is None:
+            return
+        self._pending.put(None)
+        self._thread.join()
+        self._thread = None
+        self.sink.close()
+
+    def write(self, sample, mode):
+        """ queue sample for writing, never blocks
+
+            @return False if the sample was dropped because the sink thread
+                    fell max_pending samples behind
+        """
+        try:
+            self._pending.put_nowait((monotonic(), sample, mode))
+            return True
+        except Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        unflushed = 0
+        flush_due = None
+        running = True
+        while running:
+            timeout = None if flush_due is None else max(0, flush_due - monotonic())
+            batch = []
+            try:
+                item = self._pending.get(timeout is None or timeout > 0, timeout)
+                while item is not None:
+                    batch.append(item)
+                    if len(batch) >= MAX_BATCH:
+                        break
+                    item = self._pending.get_nowait()
+                running = item is not None
+            except Empty:
+                pass
+
+            if batch:
+                self._write_batch(batch)
+                unflushed += len(batch)
+                if flush_due is None:
+                    flush_due = monotonic() + self.flush_interval
+            if unflushed and (unflushed >= self.flush_rows or not running or
+                    monotonic() >= flush_due):
+                self._flush()
+                unflushed = 0
+                flush_due = None
+
+    def _write_batch(self, batch):
+        started = monotonic()
+        try:
+            self.sink.write_many([(sample, mode) for queued, sample, mode in batch])
+        except:
+            self.errors += 1
+            log.exception('Failed to write %d rows' % (len(batch),))
+            return
+        finished = monotonic()
+        latency = finished - started
+        self.rows += len(batch)
+        self.batches += 1
+        self.total_write_latency += latency
+        if latency > self.max_write_latency:
+            self.max_write_latency = latency
+        # the oldest row waited longest
+        if finished - batch[0][0] > self.max_row_latency:
+            self.max_row_latency = finished - batch[0][0]
+
+    def _flush(self):
+        started = monotonic()
+        try:
+            if self.fsync:
+                self.sink.sync()
+            else:
+                self.sink.flush()
+        except:
+            self.errors += 1
+            log.exception('Failed to flush')
+            return
+        latency = monotonic() - started
+        self.flushes += 1
+        if latency > self.max_flush_latency:
+            self.max_flush_latency = latency
+
+    def metrics(self):
+        return {
+            'rows': self.rows,
+            'pending': self._pending.qsize(),
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'batches': self.batches,
+            'flushes': self.flushes,
+            'mean_write_latency_ms': self.total_write_latency / self.batches * 1e3 if self.batches else None,
+            'max_write_latency_ms': self.max_write_latency * 1e3,
+            'max_flush_latency_ms': self.max_flush_latency * 1e3,
+            'max_row_latency_ms': self.max_row_latency * 1e3,
+        }
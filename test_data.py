@@ -1,77 +0,0 @@
-TEST_CONSTANTS_VALUES = [
-    {
-        'cc': {
-            'val': 0.1,
-            'is_active': True,
-        },
-        'cv': {
-            'val': 0.2,
-            'is_active': False,
-        },
-        'cw': {
-            'val': 0.3,
-            'is_active': False,
-        },
-        'cr': {
-            'val': 0.4,
-            'is_active': False,
-        },
-    },
-    {
-        'cc': {
-            'val': 1.1,
-            'is_active': False,
-        },
-        'cv': {
-            'val': 1.2,
-            'is_active': True,
-        },
-        'cw': {
-            'val': 1.3,
-            'is_active': False,
-        },
-        'cr': {
-            'val': 1.4,
-            'is_active': False,
-        },
-    },
-    {
-        'cc': {
-            'val': 2.1,
-            'is_active': False,
-        },
-        'cv': {
-            'val': 2.2,
-            'is_active': False,
-        },
-        'cw': {
-            'val': 2.3,
-            'is_active': True,
-        },
-        'cr': {
-            'val': 2.4,
-            'is_active': False,
-        },
-    },
-    {
-        'cc': {
-            'val': 3.1,
-            'is_active': False,
-        },
-        'cv': {
-            'val': 3.2,
-            'is_active': False,
-        },
-        'cw': {
-            'val': 3.3,
-            'is_active': False,
-        },
-        'cr': {
-            'val': 3.4,
-            'is_active': True,
-        },
-    },
-]
-
-TEST_INPUT_VALUES = [('0.11', '0.12', '0.13',), ('1.12', '1.22', '1.32',), ('2.13', '2.23', '2.33',),]
-
@@ -0,0 +1,56 @@
+'''
+End-to-end benchmark scenarios against the simulated instrument, see
+benchmark.py.
+
+    python -m unittest discover tests
+'''
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    from PyQt4.QtCore import QCoreApplication
+except ImportError:
+    QCoreApplication = None
+
+SAMPLES = 20
+# seconds, keeps the runs short
+LATENCY = 0.001
+
+
+@unittest.skipIf(QCoreApplication is None, 'PyQt4 is not installed')
+class BenchmarkTest(unittest.TestCase):
+    def setUp(self):
+        self.app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+
+    def run_scenario(self, name):
+        import benchmark
+        return benchmark.run_scenario(self.app, name, SAMPLES, 115200, LATENCY)
+
+    def test_every_request_gets_a_sample(self):
+        for name in ('display', 'file', 'mode_changes',):
+            result = self.run_scenario(name)
+            self.assertEqual(result['samples'], SAMPLES, name)
+            self.assertEqual(result['merged_requests'], 0, name)
+            if name != 'display':
+                # every sample reached the log
+                self.assertEqual(result['file_sink']['rows'], SAMPLES, name)
+
+    def test_multi(self):
+        import benchmark
+        result = self.run_scenario('multi')
+        self.assertEqual(result['samples'], SAMPLES * benchmark.MULTI_INSTRUMENTS)
+
+    def test_bus(self):
+        import benchmark
+        result = benchmark.run_bus_scenario(SAMPLES, None, LATENCY)
+        self.assertEqual(result['samples'], SAMPLES * benchmark.MULTI_INSTRUMENTS)
+        self.assertEqual(result['failed_samples'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+'''
+Binary log sessions and crash recovery, see binlog.py.
+
+    python -m unittest discover tests
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from binlog import BinaryLog, BinarySink, HEADER_SIZE, RECORD_SIZE
+from journal import JournaledSink
+from sample import Sample
+
+# wall time of the first session
+STARTED = 1791000000.0
+
+# writes a session of 10 samples with the monotonic clock of a process
+# that has been up for a day, checkpoints after 5, and crashes leaving a
+# torn record
+_CRASHING_SESSION = '''
+import os
+from binlog import BinarySink, RECORD_SIZE
+from journal import JournaledSink
+from sample import Sample
+sink = JournaledSink(BinarySink(%(filename)r))
+sink.open()
+sink.started = %(started)r
+for i in range(10):
+    sink.write(Sample(12000 + i, 10000, 120000, 12.0, 1.0, 120.0, 0, 0,
+        86400.0 + i, %(started)r + i), 'cc')
+    if i == 4:
+        sink.flush()
+sink.sink.flush()
+sink.sink._file_obj.write('\\0' * (RECORD_SIZE // 2))
+sink.sink._file_obj.flush()
+os._exit(1)
+'''
+
+# resumes the log after a reboot, the monotonic clock starts again
+_RESUMED_SESSION = '''
+from binlog import BinarySink
+from journal import JournaledSink
+from sample import Sample
+sink = JournaledSink(BinarySink(%(filename)r))
+sink.open()
+assert sink.recovered is not None
+for i in range(5):
+    sink.write(Sample(13000 + i, 10000, 130000, 13.0, 1.0, 130.0, 0, 0,
+        5.0 + i, %(started)r + 3600 + i), 'cv')
+sink.close()
+'''
+
+
+def run_process(source):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([ROOT] + [path for path in [
+        env.get('PYTHONPATH')] if path])
+    process = subprocess.Popen([sys.executable, '-c', source], env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    return process.returncode, output
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'dc_load_log.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resume_in_fresh_process(self):
+        values = {'filename': self.filename, 'started': STARTED}
+        returncode, output = run_process(_CRASHING_SESSION % values)
+        self.assertEqual(returncode, 1, output)
+        returncode, output = run_process(_RESUMED_SESSION % values)
+        self.assertEqual(returncode, 0, output)
+
+        with BinaryLog(self.filename) as binary_log:
+            self.assertEqual(binary_log.started, STARTED)
+            self.assertEqual(len(binary_log.sessions()), 2)
+            records = list(binary_log.records())
+            rows = list(binary_log.rows())
+        # the torn record is cut off, the complete ones after the
+        # checkpoint are kept
+        self.assertEqual(len(records), 15)
+        expected = [STARTED + i for i in range(10)] + [STARTED + 3600 + i for i in range(5)]
+        for record, wall_time in zip(records, expected):
+            self.assertAlmostEqual(record[0], wall_time, places=3)
+        self.assertEqual([row[5] for row in rows],
+            range(10) + [3600 + i for i in range(5)])
+        self.assertEqual([row[4] for row in rows], ['cc'] * 10 + ['cv'] * 5)
+
+    def test_append_is_a_new_session(self):
+        for session in range(2):
+            sink = BinarySink(self.filename, STARTED + session * 60 - 5)
+            sink.open()
+            # every process has a monotonic clock of its own
+            sink.write(Sample(12000, 10000, 120000, 12.0, 1.0, 120.0, 0, 0,
+                session * 1000.0, STARTED + session * 60), 'cc')
+            sink.close()
+        with BinaryLog(self.filename) as binary_log:
+            self.assertEqual(len(binary_log), 4)
+            self.assertEqual(binary_log.started, STARTED - 5)
+            self.assertEqual([row[0] for row in binary_log.records()], [STARTED, STARTED + 60])
+            # total_seconds counts from the start of each session, as in
+            # a CSV log
+            self.assertEqual([row[5] for row in binary_log.rows()], [5, 5])
+
+    def test_recover_counts_readings(self):
+        sink = BinarySink(self.filename)
+        sink.open()
+        sink.write(Sample(12000, 10000, 120000, 12.0, 1.0, 120.0, 0, 0, 1.0, STARTED), 'cc')
+        sink.write(Sample(12000, 10000, 120000, 12.0, 1.0, 120.0, 0, 0, 2.0, STARTED + 1), 'cc')
+        sink.close()
+        with open(self.filename, 'ab') as log_file:
+            log_file.write('\0' * (RECORD_SIZE - 1))
+        self.assertEqual(BinarySink(self.filename).recover(0), 2)
+        self.assertEqual(os.path.getsize(self.filename), HEADER_SIZE + 3 * RECORD_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
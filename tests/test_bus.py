@@ -0,0 +1,71 @@
+'''
+Polling several loads on one line, see bus.py.
+
+    python -m unittest discover tests
+'''
+
+import os
+import sys
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bus import DCLoadBus
+from clock import monotonic
+from simulator import SimulatedSerial, SimulatedLoad
+
+ADDRESSES = (1, 2, 3)
+LATENCY = 0.001
+# seconds
+RUN_TIME = 1.0
+
+
+class BusTest(unittest.TestCase):
+    def setUp(self):
+        self.bus = DCLoadBus(SimulatedSerial([SimulatedLoad(address) for address in ADDRESSES],
+            baudrate=None, latency=LATENCY, timeout=0.05))
+
+    def tearDown(self):
+        self.bus.close()
+
+    def add_loads(self, intervals, priorities):
+        for address, interval, priority in zip(ADDRESSES, intervals, priorities):
+            self.bus.add_load(address, interval, priority)
+            self.bus.execute(address, 'SetRemoteControl')
+
+    def poll_times(self):
+        """ @return {address: [monotonic times of its polls]} over RUN_TIME
+
+        """
+        times = dict((address, []) for address in ADDRESSES)
+        stop = monotonic() + RUN_TIME
+        while monotonic() < stop:
+            address = self.bus.poll_once()
+            if address is None:
+                time.sleep(0.001)
+            else:
+                times[address].append(monotonic())
+        return times
+
+    def test_intervals(self):
+        self.add_loads((0.1, 0.2, 0.5), (0, 0, 0))
+        times = self.poll_times()
+        for address, interval in zip(ADDRESSES, (0.1, 0.2, 0.5)):
+            polls = times[address]
+            # the first poll is not repeated right away
+            gaps = [later - earlier for earlier, later in zip(polls, polls[1:])]
+            self.assertTrue(min(gaps) > interval * 0.9, (address, gaps))
+            self.assertTrue(len(polls) <= RUN_TIME / interval + 1, (address, len(polls)))
+            self.assertTrue(len(polls) >= RUN_TIME / interval - 1, (address, len(polls)))
+
+    def test_priority_does_not_starve(self):
+        self.add_loads((0, 0, 0), (3, 2, 1))
+        counts = dict((address, len(polls)) for address, polls in self.poll_times().items())
+        self.assertTrue(counts[1] > counts[2] > 0, counts)
+        self.assertTrue(counts[1] > counts[3] > 0, counts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+'''
+Frame encoding, decoding and re-synchronization, see codec.py.
+
+    python -m unittest discover tests
+'''
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import codec
+
+ADDRESS = 0
+GET_INPUT_VALUES = 0x5F
+SET_MODE = 0x28
+STATUS_ERROR = 0xB0
+
+
+def status_frame(status, address=ADDRESS):
+    return codec.encode_integer(address, codec.STATUS_COMMAND, status, 1)
+
+
+def input_values_frame(voltage=12000, address=ADDRESS):
+    return codec.encode_integer(address, GET_INPUT_VALUES, voltage, 4)
+
+
+class SyncTest(unittest.TestCase):
+    def sync(self, data, command=GET_INPUT_VALUES, data_reply=True):
+        return codec.sync(data, ADDRESS, command, data_reply)
+
+    def test_frame(self):
+        frame = input_values_frame()
+        self.assertEqual(self.sync(frame + 'ab'), (frame, 'ab', 0))
+
+    def test_garbage_before_start_byte(self):
+        frame = input_values_frame()
+        self.assertEqual(self.sync('\x00\x12\x7f' + frame), (frame, '', 3))
+
+    def test_start_byte_in_garbage(self):
+        frame = input_values_frame()
+        garbage = chr(codec.START_BYTE) + '\x00' * 5
+        self.assertEqual(self.sync(garbage + frame), (frame, '', len(garbage)))
+
+    def test_bad_checksum(self):
+        frame = input_values_frame()
+        damaged = frame[:-1] + chr((ord(frame[-1]) + 1) & 0xff)
+        self.assertEqual(self.sync(damaged + frame), (frame, '', codec.LENGTH_PACKET))
+
+    def test_wrong_address(self):
+        frame = input_values_frame()
+        other = input_values_frame(address=ADDRESS + 1)
+        self.assertEqual(self.sync(other + frame), (frame, '', codec.LENGTH_PACKET))
+
+    def test_stale_response_to_another_command(self):
+        frame = input_values_frame()
+        stale = codec.encode_integer(ADDRESS, 0x2B, 10000, 4)
+        self.assertEqual(self.sync(stale + frame), (frame, '', codec.LENGTH_PACKET))
+
+    def test_ok_status_is_no_data_reply(self):
+        # the late answer of an earlier set command
+        frame = input_values_frame()
+        late = status_frame(codec.STATUS_OK)
+        self.assertEqual(self.sync(late + frame), (frame, '', codec.LENGTH_PACKET))
+        self.assertEqual(self.sync(late), (None, '', codec.LENGTH_PACKET))
+
+    def test_error_status_answers_a_query(self):
+        error = status_frame(STATUS_ERROR)
+        self.assertEqual(self.sync(error + input_values_frame()),
+            (error, input_values_frame(), 0))
+
+    def test_ok_status_answers_a_command(self):
+        ok = status_frame(codec.STATUS_OK)
+        self.assertEqual(self.sync(ok, SET_MODE, False), (ok, '', 0))
+
+    def test_incomplete_frame(self):
+        frame = input_values_frame()
+        self.assertEqual(self.sync('\x00\x00' + frame[:10]), (None, frame[:10], 2))
+
+
+class DecodeTest(unittest.TestCase):
+    def test_check_command(self):
+        frame = input_values_frame(12345)
+        self.assertEqual(codec.decode_input_values(frame, GET_INPUT_VALUES)[0], 12345)
+        self.assertRaises(codec.FrameError, codec.decode_input_values,
+            status_frame(codec.STATUS_OK), GET_INPUT_VALUES)
+        self.assertRaises(codec.FrameError, codec.decode_integer, frame, 4, 0x2B)
+
+    def test_integer_round_trip(self):
+        for num_bytes, value in ((1, 3), (2, 0xBEEF), (4, 123456789)):
+            frame = codec.encode_integer(ADDRESS, 0x2B, value, num_bytes)
+            self.assertEqual(codec.checksum(frame), ord(frame[-1]))
+            self.assertEqual(codec.decode_integer(frame, num_bytes, 0x2B), value)
+
+
+if __name__ == '__main__':
+    unittest.main()
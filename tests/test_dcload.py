@@ -0,0 +1,58 @@
+'''
+DCLoad driver against the simulated instrument, see dcload.py and
+simulator.py.
+
+    python -m unittest discover tests
+'''
+
+import os
+import sys
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dcload import DCLoad, InstrumentException
+from simulator import SimulatedSerial
+
+
+class ApplyModeTest(unittest.TestCase):
+    def setUp(self):
+        self.load = DCLoad()
+        self.load.EnableSetpointCache()
+        self.load.sp = SimulatedSerial(baudrate=None, latency=0.001, timeout=0.05)
+        self.load.SetRemoteControl()
+
+    def test_apply(self):
+        state = self.load.ApplyMode('cv', 5)
+        self.assertEqual((state['mode'], state['cv']), ('cv', 5.0))
+        self.assertEqual(self.load.GetModeState(), state)
+
+    def test_refused_setpoint_keeps_the_mode(self):
+        before = self.load.ApplyMode('cv', 5)
+        # above the maximum current
+        self.assertRaises(InstrumentException, self.load.ApplyMode, 'cc', 100)
+        self.assertEqual(self.load.GetModeState(), before)
+
+
+class LateResponseTest(unittest.TestCase):
+    def test_late_status_is_no_sample(self):
+        load = DCLoad()
+        load.sp = SimulatedSerial(baudrate=None, latency=0, timeout=0.05)
+        load.SetRemoteControl()
+        load.SetCCCurrent(1.0)
+        # the answer to the next command arrives after the read timed out
+        load.sp.latency = 0.08
+        self.assertRaises(InstrumentException, load.SetCCCurrent, 1.5)
+        load.sp.latency = 0
+        time.sleep(0.1)
+        sample = load.GetSample()
+        # the late OK status frame was skipped, not decoded as the sample
+        self.assertTrue(sample.voltage > 1.0, sample)
+        self.assertEqual(load.resync_events, 1)
+        self.assertEqual(load.GetCCCurrent(), 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+'''
+Request queue between the GUI and the worker, see scheduler.py.
+
+    python -m unittest discover tests
+'''
+
+import os
+import sys
+import time
+import unittest
+import threading
+from Queue import Full
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import scheduler
+from scheduler import CommandQueue
+
+QUEUE_SIZE = 4
+# seconds to wait for the first sample
+SAMPLE_TIMEOUT = 5.0
+
+
+def configuration_requests(number):
+    return [('set_constants_values', ('cc', '%d.0' % (i,),),) for i in xrange(number)]
+
+
+def display_read():
+    return ('get_input_data', 'display',)
+
+
+def file_read():
+    return ('get_input_data', 'file',)
+
+
+def drain(queue):
+    requests = []
+    while not queue.empty():
+        requests.append(queue.get())
+        queue.task_done()
+    return requests
+
+
+class CommandQueueTest(unittest.TestCase):
+    def test_priority_order(self):
+        queue = CommandQueue()
+        for request in (display_read(), file_read(), ('set_constants_values', ('cc', '1.0',),),
+                ('turn_load_off',)):
+            queue.put(request)
+        self.assertEqual([request[0] for request in drain(queue)],
+            ['turn_load_off', 'set_constants_values', 'get_input_data', 'get_input_data'])
+
+    def test_same_class_in_arrival_order(self):
+        queue = CommandQueue()
+        requests = configuration_requests(3)
+        for request in requests:
+            queue.put(request)
+        self.assertEqual(drain(queue), requests)
+
+    def test_reads_are_merged(self):
+        queue = CommandQueue()
+        self.assertTrue(queue.offer(display_read()))
+        self.assertTrue(queue.offer(display_read()))
+        queue.put(display_read())
+        queue.put(file_read())
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(queue.counters(), {'dropped': 0, 'merged': 2, 'delayed': 0})
+        drain(queue)
+        # once handed out, a read is queued again
+        self.assertTrue(queue.offer(display_read()))
+        self.assertEqual(queue.qsize(), 1)
+
+    def test_writes_are_not_merged(self):
+        queue = CommandQueue()
+        for i in xrange(2):
+            queue.offer(('set_constants_values', ('cc', '1.0',),))
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(queue.counters()['merged'], 0)
+
+    def test_offer_evicts_lower_classes(self):
+        queue = CommandQueue(2)
+        queue.offer(display_read())
+        queue.offer(file_read())
+        # a file read evicts the display read
+        self.assertTrue(queue.offer(('get_input_data', 'acquisition',)))
+        self.assertEqual(queue.pending()['display'], 0)
+        # configuration evicts a file read
+        self.assertTrue(queue.offer(('set_constants_values', ('cc', '1.0',),)))
+        self.assertEqual(queue.pending(), {'safety': 0, 'configuration': 1, 'file': 1,
+            'display': 0})
+        self.assertEqual(queue.counters()['dropped'], 2)
+
+    def test_offer_drops_without_anything_to_evict(self):
+        queue = CommandQueue(2)
+        queue.offer(file_read())
+        queue.offer(('get_input_data', 'acquisition',))
+        # nothing of a lower class to evict
+        self.assertFalse(queue.offer(display_read()))
+        self.assertFalse(queue.offer(('get_input_data', 'other',)))
+        self.assertEqual(queue.counters(), {'dropped': 2, 'merged': 0, 'delayed': 0})
+        self.assertEqual(queue.qsize(), 2)
+        # evicted requests are never handed out, so join() returns
+        drain(queue)
+        queue.join()
+
+    def test_safety_always_fits(self):
+        queue = CommandQueue(2)
+        for request in configuration_requests(2):
+            queue.offer(request)
+        self.assertRaises(Full, queue.put, display_read(), False)
+        for command in ('turn_load_off', 'set_local_control',):
+            self.assertTrue(queue.offer((command,)))
+        queue.put(('turn_load_on',), False)
+        self.assertEqual(queue.pending()['safety'], 3)
+        self.assertEqual(queue.get(), ('turn_load_off',))
+        self.assertEqual(queue.counters()['dropped'], 0)
+
+    def test_delayed(self):
+        deadlines = scheduler.DEADLINES
+        scheduler.DEADLINES = (0, 0, 0, 0.05)
+        try:
+            queue = CommandQueue()
+            queue.put(display_read())
+            queue.put(file_read())
+            time.sleep(0.01)
+            # the file read is overdue, the display read is not
+            self.assertEqual(drain(queue), [file_read(), display_read()])
+            self.assertEqual(queue.counters(), {'dropped': 0, 'merged': 0, 'delayed': 1})
+        finally:
+            scheduler.DEADLINES = deadlines
+
+
+class SamplingTest(unittest.TestCase):
+    def test_start_sampling_fits_a_full_queue(self):
+        queue = CommandQueue(QUEUE_SIZE)
+        for request in configuration_requests(QUEUE_SIZE):
+            self.assertTrue(queue.offer(request))
+        self.assertFalse(queue.offer(('get_constants_values',)))
+        self.assertTrue(queue.offer(('start_sampling', 0.05,)))
+        self.assertTrue(queue.offer(('stop_sampling',)))
+        self.assertEqual(queue.qsize(), QUEUE_SIZE + 2)
+        self.assertEqual(queue.counters()['dropped'], 1)
+
+    def test_sampling_starts_behind_a_full_queue(self):
+        from engine import AcquisitionEngine
+        queue = CommandQueue(QUEUE_SIZE)
+        engine = AcquisitionEngine(queue, test_mode=True)
+        sampled = threading.Event()
+        engine.subscribe('input_data_available',
+            lambda sample: sample is not None and sampled.set())
+        engine.connect(1, 9600)
+        for request in configuration_requests(QUEUE_SIZE):
+            queue.offer(request)
+        self.assertTrue(queue.offer(('start_sampling', 0.05,)))
+        engine.start()
+        try:
+            sampled.wait(SAMPLE_TIMEOUT)
+            self.assertTrue(sampled.is_set())
+        finally:
+            queue.put(('stop_sampling',))
+            engine.stop()
+            engine.disconnect()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+'''
+Time index of CSV logs and the removal of a log with its sidecars, see
+timeindex.py and logfile.py.
+
+    python -m unittest discover tests
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from timeindex import IndexedCsvSink, TimeIndex, build, index_filename, read_range
+from journal import JournaledSink
+from logfile import create_sink, log_files, remove_log
+from sample import Sample
+
+STARTED = 1791000000.0
+
+
+def write_log(sink, seconds, start=STARTED):
+    sink = JournaledSink(sink)
+    sink.open()
+    sink.started = start
+    for i in xrange(seconds):
+        sink.write(Sample(12000, 10000, 120000, 12.0, 1.0, 120.0, 0, 0, i,
+            start + i), 'cc')
+    sink.close()
+
+
+class TimeIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'dc_load_log.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookup(self):
+        write_log(IndexedCsvSink(self.filename, every=10), 100)
+        index = TimeIndex(self.filename)
+        self.assertEqual(len(index), 10)
+        rows = list(read_range(self.filename, STARTED + 42, STARTED + 45))
+        self.assertEqual([row[5] for row in rows], ['42', '43', '44'])
+
+    def test_build(self):
+        write_log(IndexedCsvSink(self.filename, every=10), 100)
+        written = TimeIndex(self.filename)
+        os.remove(index_filename(self.filename))
+        self.assertEqual(build(self.filename, 10), 10)
+        built = TimeIndex(self.filename)
+        self.assertEqual((built.times, built.offsets), (written.times, written.offsets))
+        # a second build replaces the index
+        self.assertEqual(build(self.filename, 50), 2)
+        self.assertEqual(len(TimeIndex(self.filename)), 2)
+
+    def test_rejects_entries_not_matching_the_log(self):
+        write_log(IndexedCsvSink(self.filename, every=10), 30)
+        with open(index_filename(self.filename), 'rb') as index_obj:
+            entries = index_obj.read().splitlines()
+        wall_time, offset = entries[1].split()
+        with open(index_filename(self.filename), 'ab') as index_obj:
+            # time going backwards
+            index_obj.write('%s %d\n' % (entries[0].split()[0], int(offset) + 100))
+            # inside a row
+            index_obj.write('%.3f %d\n' % (STARTED + 25, int(offset) + 3))
+        index = TimeIndex(self.filename)
+        self.assertEqual(len(index), 3)
+
+    def test_rejects_entries_of_a_replaced_log(self):
+        write_log(IndexedCsvSink(self.filename, every=10), 30)
+        # the index of the old log survives, the new log is shorter and later
+        index_data = open(index_filename(self.filename), 'rb').read()
+        os.remove(self.filename)
+        write_log(create_sink(self.filename), 20, STARTED + 3600)
+        with open(index_filename(self.filename), 'wb') as index_obj:
+            index_obj.write(index_data)
+        self.assertEqual(len(TimeIndex(self.filename)), 0)
+        rows = list(read_range(self.filename, STARTED + 3605, STARTED + 3607))
+        self.assertEqual([row[5] for row in rows], ['5', '6'])
+
+    def test_read_range_of_a_rotated_log(self):
+        write_log(create_sink(self.filename, rotate_rows=25), 100)
+        rows = list(read_range(self.filename, STARTED + 48, STARTED + 53))
+        self.assertEqual([row[5] for row in rows], ['48', '49', '50', '51', '52'])
+        self.assertEqual(len(list(read_range(self.filename))), 100)
+
+    def test_read_range_of_a_compressed_log(self):
+        filename = self.filename + '.gz'
+        write_log(create_sink(filename), 20)
+        rows = list(read_range(filename, STARTED + 5, STARTED + 7))
+        self.assertEqual([row[5] for row in rows], ['5', '6'])
+
+    def test_remove_log(self):
+        write_log(create_sink(self.filename), 10)
+        self.assertEqual(len(log_files(self.filename)), 3)
+        rotated = os.path.join(self.directory, 'rotated.csv')
+        write_log(create_sink(rotated, rotate_rows=4), 10)
+        # three segments with their indexes, the manifest and the journal
+        self.assertEqual(len(log_files(rotated)), 8)
+        remove_log(self.filename)
+        remove_log(rotated)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
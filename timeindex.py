@@ -0,0 +1,322 @@
+'''
+Sparse time index of a CSV data log.
+
+IndexedSink wraps the CsvSink of a log and, while it writes, notes the
+wall time and byte offset of every every-th row, and of the first row of
+every session, in a sidecar file next to the log, dc_load_log.csv.idx,
+one "wall_time offset" line per entry.  read_range() looks up the last
+entry before the start of a time range, seeks there and streams the rows
+of the range, so finding an hour in a log of gigabytes reads a few
+thousand rows instead of the whole file.  build() writes the index of a
+log written without one.  A log rotated into segments (see
+sinks.RotatingSink) is read through its manifest, from the segments
+that cover the range only.
+
+    for row in read_range('dc_load_log.csv', start, stop):
+        ...
+
+    python timeindex.py build dc_load_log.csv [every]
+    python timeindex.py read dc_load_log.csv "2026-10-18 03:12:00" ["2026-10-18 03:13:00"]
+
+Compressed logs cannot be seeked into and are not indexed, they are
+read from their start.  Binary logs are read with binlog.BinaryLog.
+'''
+
+import os
+import sys
+import csv
+import json
+import time
+import math
+import bisect
+import logging
+
+from sinks import CsvSink, TIMESTAMP_FORMAT, MANIFEST_SUFFIX, atomic_write, format_timestamp, \
+    split_extension
+from compress import GZIP_EXTENSION, iter_rows
+
+log = logging.getLogger('dc_logger')
+
+INDEX_SUFFIX = '.idx'
+# rows between two index entries
+DEFAULT_INDEX_EVERY = 1000
+
+
+def index_filename(filename):
+    return filename + INDEX_SUFFIX
+
+
+def parse_timestamp(timestamp):
+    """ @return wall time of a timestamp column value
+
+    """
+    return time.mktime(time.strptime(timestamp, TIMESTAMP_FORMAT))
+
+
+class IndexedSink(object):
+    """ CsvSink wrapper writing the time index of the log, see module doc
+
+    """
+
+    def __init__(self, sink, every=DEFAULT_INDEX_EVERY):
+        self.sink = sink
+        self.filename = sink.filename
+        self.every = every
+        self._index_obj = None
+        # rows written since open()
+        self._count = 0
+
+    @property
+    def started(self):
+        return self.sink.started
+
+    @started.setter
+    def started(self, started):
+        self.sink.started = started
+
+    @property
+    def rows(self):
+        return self.sink.rows
+
+    def open(self):
+        self.sink.open()
+        self._index_obj = open(index_filename(self.filename), 'ab')
+        self._count = 0
+
+    def is_open(self):
+        return self.sink.is_open()
+
+    def tell(self):
+        return self.sink.tell()
+
+    def recover(self, offset):
+        return self.sink.recover(offset)
+
+    def write(self, sample, mode):
+        self.write_many([(sample, mode)])
+
+    def write_many(self, items):
+        """ write items in runs ending before the rows to index
+
+        """
+        start = 0
+        while start < len(items):
+            if self._count % self.every == 0:
+                self._index_obj.write('%.3f %d\n' % (items[start][0].wall_time, self.sink.tell()))
+            stop = min(len(items), start + self.every - self._count % self.every)
+            self.sink.write_many(items[start:stop])
+            self._count += stop - start
+            start = stop
+
+    def flush(self):
+        self.sink.flush()
+        if self._index_obj is not None:
+            self._index_obj.flush()
+
+    def sync(self):
+        self.sink.sync()
+        if self._index_obj is not None:
+            self._index_obj.flush()
+            os.fsync(self._index_obj.fileno())
+
+    def close(self):
+        self.sink.close()
+        if self._index_obj is not None:
+            self._index_obj.close()
+            self._index_obj = None
+
+
+class IndexedCsvSink(IndexedSink):
+    """ CsvSink with a time index, usable as sink_class of RotatingSink
+
+    """
+
+    def __init__(self, filename, started=None, every=DEFAULT_INDEX_EVERY):
+        IndexedSink.__init__(self, CsvSink(filename, started), every)
+
+
+class TimeIndex(object):
+    """ index entries of a log, see lookup()
+
+        An entry is only used if it points at the start of a row carrying
+        its timestamp, after the entry before it; entries left by a
+        recovery past the end of the log, by a replaced log or by a
+        damaged index are ignored.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.times = []
+        self.offsets = []
+        rejected = 0
+        size = os.path.getsize(filename)
+        with open(index_filename(filename), 'rb') as index_obj:
+            with open(filename, 'rb') as log_obj:
+                for line in index_obj:
+                    try:
+                        wall_time, offset = line.split()
+                        wall_time, offset = float(wall_time), int(offset)
+                    except ValueError:
+                        # torn last line
+                        continue
+                    if self.offsets and (offset <= self.offsets[-1] or wall_time < self.times[-1]):
+                        rejected += 1
+                        continue
+                    if not 0 < offset < size or not self._is_row(log_obj, offset, wall_time):
+                        rejected += 1
+                        continue
+                    self.times.append(wall_time)
+                    self.offsets.append(offset)
+        if rejected:
+            log.warning('Ignored %d entries of the index of %s not matching the log' % (
+                rejected, filename))
+
+    @staticmethod
+    def _is_row(log_obj, offset, wall_time):
+        """ @return True if a row with the timestamp of wall_time starts at
+                    offset of the open log
+
+        """
+        log_obj.seek(offset - 1)
+        if log_obj.read(1) != '\n':
+            return False
+        return log_obj.readline().split(',', 1)[0] == format_timestamp(wall_time)
+
+    def __len__(self):
+        return len(self.times)
+
+    def lookup(self, wall_time):
+        """ @return offset of the last indexed row before wall_time, 0 if
+                    there is none
+
+        """
+        position = bisect.bisect_left(self.times, wall_time)
+        if position == 0:
+            return 0
+        return self.offsets[position - 1]
+
+
+def build(filename, every=DEFAULT_INDEX_EVERY):
+    """ write the index of the existing log filename, replacing its index
+
+        @return number of entries
+    """
+    entries = []
+    with open(filename, 'rb') as log_obj:
+        # header row
+        log_obj.readline()
+        count = 0
+        while 1:
+            offset = log_obj.tell()
+            line = log_obj.readline()
+            if not line.endswith('\n'):
+                break
+            if count % every == 0:
+                try:
+                    wall_time = parse_timestamp(line.split(',', 1)[0])
+                except ValueError:
+                    # a header row of an appended session
+                    continue
+                entries.append('%.3f %d\n' % (wall_time, offset))
+            count += 1
+    # the index is sparse, a few lines per thousand rows
+    atomic_write(index_filename(filename), ''.join(entries))
+    return len(entries)
+
+
+def read_range(filename, start=None, stop=None):
+    """ stream the rows of a log with start <= timestamp < stop
+
+        The index is used if there is one, otherwise the log is read from
+        its start; a rotated log is read segment by segment, see module
+        doc.  Timestamps have a resolution of a second, all rows of the
+        second of start are included.
+
+        @param filename: log, or base name of a rotated log
+        @param start, stop: wall times, None for the start/end of the log
+        @return generator of rows as lists of strings
+    """
+    for segment_filename in _segments(filename, start, stop):
+        for row in _read_file_range(segment_filename, start, stop):
+            yield row
+
+
+def _segments(filename, start, stop):
+    """ @return the files of the log filename that may hold rows of the range
+
+    """
+    manifest_filename = split_extension(filename)[0] + MANIFEST_SUFFIX
+    if not os.path.exists(manifest_filename):
+        return [filename]
+    with open(manifest_filename, 'rb') as manifest_file:
+        segments = json.load(manifest_file)['segments']
+    directory = os.path.dirname(filename)
+    selected = []
+    for number, segment in enumerate(segments):
+        # a segment ends where the next one starts
+        following = segments[number + 1]['first'] if number + 1 < len(segments) else None
+        if start is not None and following is not None and following < math.floor(start):
+            continue
+        if stop is not None and segment['first'] >= stop:
+            break
+        selected.append(os.path.join(directory, segment['file']))
+    return selected
+
+
+def _read_file_range(filename, start, stop):
+    if not os.path.exists(filename):
+        return
+    offset = 0
+    if start is not None and os.path.exists(index_filename(filename)):
+        # rows carry whole seconds
+        offset = TimeIndex(filename).lookup(math.floor(start))
+    first = math.floor(start) if start is not None else None
+    # wall time per timestamp column value, the rows of a second share it
+    parsed = {}
+    if filename.endswith(GZIP_EXTENSION):
+        log_obj = None
+        rows = iter_rows(filename)
+    else:
+        log_obj = open(filename, 'rb')
+        log_obj.seek(offset)
+        rows = csv.reader(log_obj)
+    try:
+        for row in rows:
+            if not row or row[0] == 'timestamp':
+                continue
+            # compared as wall times, local time strings do not sort
+            # across a change of the UTC offset
+            wall_time = parsed.get(row[0])
+            if wall_time is None:
+                parsed.clear()
+                wall_time = parsed[row[0]] = parse_timestamp(row[0])
+            if first is not None and wall_time < first:
+                continue
+            if stop is not None and wall_time >= stop:
+                return
+            yield row
+    finally:
+        if log_obj is not None:
+            log_obj.close()
+
+
+def main(argv):
+    if len(argv) < 3 or argv[1] not in ('build', 'read'):
+        print 'usage: python timeindex.py build log_file [every]'
+        print '       python timeindex.py read log_file start [stop]'
+        return 1
+    if argv[1] == 'build':
+        every = int(argv[3]) if len(argv) > 3 else DEFAULT_INDEX_EVERY
+        print '%d entries' % (build(argv[2], every),)
+        return 0
+
+    start = parse_timestamp(argv[3]) if len(argv) > 3 else None
+    stop = parse_timestamp(argv[4]) if len(argv) > 4 else None
+    csv_obj = csv.writer(sys.stdout)
+    for row in read_range(argv[2], start, stop):
+        csv_obj.writerow(row)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
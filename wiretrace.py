@@ -0,0 +1,137 @@
+'''
+In-memory ring buffer of the raw frames on the serial link.
+
+WireTrace keeps the last N commands and responses with their monotonic
+timestamps in one preallocated bytearray; recording a frame is a single
+pack_into of a fixed size record.  InstrumentInterface records only
+while its trace attribute is set (see EnableTrace), so a disabled trace
+costs one attribute test per frame.  The buffer is written to a compact
+binary file on demand with dump(), or automatically when a command gets
+no response if error_file is set.
+
+Trace file: the 8 byte magic 'DCTRACE1', the record count (uint32) and
+the records, oldest first.  Each record is a timestamp (double,
+seconds), the direction, the number of valid bytes and 26 data bytes.
+
+    python wiretrace.py trace_file    prints a trace file
+'''
+
+import sys
+import struct
+
+import codec
+
+MAGIC = 'DCTRACE1'
+DEFAULT_CAPACITY = 4096
+
+COMMAND = 0
+RESPONSE = 1
+# bytes received without forming a response (timeouts)
+INCOMPLETE = 2
+DIRECTION_NAMES = {
+    COMMAND: 'command',
+    RESPONSE: 'response',
+    INCOMPLETE: 'incomplete',
+}
+
+_HEADER = struct.Struct('<8sI')
+_RECORD = struct.Struct('<dBB%ds' % codec.LENGTH_PACKET)
+
+
+class WireTrace(object):
+    def __init__(self, capacity=DEFAULT_CAPACITY, error_file=None):
+        self.capacity = capacity
+        self.error_file = error_file
+        self._buffer = bytearray(capacity * _RECORD.size)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def record(self, timestamp, direction, data):
+        _RECORD.pack_into(self._buffer, self._next * _RECORD.size,
+            timestamp, direction, len(data), data)
+        self._next += 1
+        if self._next == self.capacity:
+            self._next = 0
+        if self._count < self.capacity:
+            self._count += 1
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def records(self):
+        """ @return list of (timestamp, direction, data), oldest first
+
+        """
+        first = (self._next - self._count) % self.capacity
+        result = []
+        for i in xrange(self._count):
+            offset = ((first + i) % self.capacity) * _RECORD.size
+            timestamp, direction, length, data = _RECORD.unpack_from(self._buffer, offset)
+            result.append((timestamp, direction, data[:length]))
+        return result
+
+    def dump(self, filename):
+        first = (self._next - self._count) % self.capacity
+        with open(filename, 'wb') as trace_file:
+            trace_file.write(_HEADER.pack(MAGIC, self._count))
+            if first + self._count <= self.capacity:
+                chunks = ((first, first + self._count),)
+            else:
+                chunks = ((first, self.capacity), (0, self._next))
+            for start, end in chunks:
+                trace_file.write(buffer(self._buffer, start * _RECORD.size,
+                    (end - start) * _RECORD.size))
+
+    def dump_on_error(self):
+        if self.error_file is not None:
+            self.dump(self.error_file)
+
+
+def load(filename):
+    """ @return list of (timestamp, direction, data) stored in a trace file
+
+    """
+    with open(filename, 'rb') as trace_file:
+        magic, count = _HEADER.unpack(trace_file.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('%s is not a wire trace file' % (filename,))
+        data = trace_file.read(count * _RECORD.size)
+
+    result = []
+    for offset in xrange(0, len(data) - _RECORD.size + 1, _RECORD.size):
+        timestamp, direction, length, frame = _RECORD.unpack_from(data, offset)
+        result.append((timestamp, direction, frame[:length]))
+    return result
+
+
+def format_frame(frame, header=' '*3, zero='..'):
+    """ hex dump of a frame in groups of five bytes, ten per line, as
+
+            aa .. 20 01 ..   .. .. .. .. ..
+
+        @param zero: printed for zero bytes
+    """
+    lines = []
+    for start in xrange(0, len(frame), 10):
+        groups = []
+        for group in xrange(start, min(start + 10, len(frame)), 5):
+            groups.append(' '.join('%02x' % ord(c) if c != '\0' else zero
+                for c in frame[group:group + 5]))
+        lines.append(header + '   '.join(groups))
+    return '\n'.join(lines)
+
+
+def main(argv):
+    records = load(argv[1])
+    started = records[0][0] if records else 0
+    for timestamp, direction, data in records:
+        print '%12.6f %s' % (timestamp - started, DIRECTION_NAMES.get(direction, direction))
+        print format_frame(data)
+
+
+if __name__ == '__main__':
+    main(sys.argv)